@@ -9,13 +9,14 @@ Define the REST API for JWT authentication
 import asyncio
 import logging
 import functools
+import signal
 import os
+import json
+import hashlib
 import inspect
+import tempfile
+import importlib.util
 import aiohttp.web
-import aiohttp_swagger
-import aiohttp_cors
-import aiohttp_jinja2
-import jinja2
 import api_middlewares
 import resources
 import services
@@ -26,47 +27,65 @@ class ApiFactory(object):
     Define the REST API for JWT authentication
     """
 
-    def __init__(self, loop=None, config=None):
-        """ Create the aiohttp application """
+    # Routes under /cams/{cam_id}: path, app registry of per camera resources, resource class, handler name
+    CAMERA_ROUTES = (
+        ("/ptz/move", "ptz_moves", resources.PtzMove, "get"),
+        ("/ptz/move/ws", "ptz_moves", resources.PtzMove, "websocket"),
+        ("/ptz/position", "ptz_positions", resources.PtzPosition, "get"),
+        ("/ptz/preset/recall", "ptz_presets", resources.PtzPreset, "recall"),
+        ("/ptz/preset/store", "ptz_presets", resources.PtzPreset, "store"),
+    )
+    DRAIN_TIMEOUT = 5
+
+    def __init__(self, loop=None, config=None, load_cams=None):
+        """
+        Create the aiohttp application
+        load_cams returns cameras definitions again, it enables reload on SIGHUP and /admin/reload
+        """
 
         self.logger = logging.getLogger(self.__class__.__name__)
         self.loop = loop if loop is not None else asyncio.get_event_loop()
         self.config = config
+        self.load_cams = load_cams
+        self._reload_lock = asyncio.Lock()
 
         swagger_url = self.prefix_context_path("/doc")
 
-        self.app = aiohttp.web.Application(loop=loop, middlewares=[functools.partial(api_middlewares.rest_error_middleware, logger=self.logger)])
+        self.app = aiohttp.web.Application(
+            loop=loop, middlewares=[api_middlewares.metrics_middleware, functools.partial(api_middlewares.rest_error_middleware, logger=self.logger)]
+        )
         self.app.factory = self
 
         self.app.router.add_route("GET", "/", lambda x: aiohttp.web.HTTPFound(swagger_url))
         if self.config.context_path != "/":
             self.app.router.add_route("GET", self.config.context_path, lambda x: aiohttp.web.HTTPFound(swagger_url))
         self.app.router.add_route("GET", self.config.context_path + "/", lambda x: aiohttp.web.HTTPFound(swagger_url))
+        lock_backend = services.LOCK_BACKENDS[self.config.lock_backend](self.config.lock_path)
+        self.app["lock_manager"] = services.PtzLockManager(backend=lock_backend)
+        self.app["ptz_moves"] = {}
+        self.app["ptz_positions"] = {}
+        self.app["ptz_presets"] = {}
         for cam in self.config.cams.keys():
-            self.app.router.add_route("GET", self.prefix_context_path("/cams/%s/ptz/move" % cam), resources.PtzMove(cam).get)
+            self.add_camera_resources(cam)
+        for path, registry, resource_class, handler_name in self.CAMERA_ROUTES:
+            self.app.router.add_route("GET", self.prefix_context_path("/cams/{cam_id}" + path), self.camera_handler(registry, resource_class, handler_name))
+        self.app.router.add_route("POST", self.prefix_context_path("/batch/ptz/move"), resources.PtzBatchMove().post)
+        self.app.router.add_route("GET", self.prefix_context_path("/ptz/locks"), resources.PtzLocks().get)
+        self.app.router.add_route("GET", self.prefix_context_path("/metrics"), resources.Metrics().get)
+        self.app.router.add_route("GET", self.prefix_context_path("/health"), resources.Health().get)
+        if self.load_cams is not None:
+            self.app.router.add_route("POST", self.prefix_context_path("/admin/reload"), resources.ConfigReload().post)
+        self.app.router.add_route("POST", self.prefix_context_path("/admin/profile"), resources.Profiler().post)
         self.app.router.add_route("GET", self.prefix_context_path("/interfaces/ptz/move"), resources.InterfacePtzMove().get)
-        self.app.router.add_static(self.prefix_context_path("/static"), os.path.join(self.config.PROJECT_ROOT, "static"))
+        self.app.router.add_get(self.prefix_context_path("/static/{filename}"), resources.StaticFiles(os.path.join(self.config.PROJECT_ROOT, "static")).get)
 
         # Setup Swagger
-        # bundle_params is a GitHub patch not released
-        # in any aiohttp_swagger package
-        setup_swagger_sign = inspect.signature(aiohttp_swagger.setup_swagger)
-        kwargs = {}
-        if "bundle_params" in setup_swagger_sign.parameters:
-            kwargs["bundle_params"] = {"layout": "BaseLayout"}
-
-        aiohttp_swagger.setup_swagger(
-            app=self.app,
-            description="API to move PTZ on Bosch camera using RCP+ protocol",
-            title="PTZ API for Bosch RCP+",
-            api_version="1.0",
-            contact="acecile@le-vert.net",
-            swagger_url=swagger_url,
-            **kwargs
-        )
+        self.setup_swagger(swagger_url)
 
-        # Setup CORS
+        # Setup CORS, only imported when needed
         if self.config.allow_origin:
+            import aiohttp_cors  # pylint: disable=import-outside-toplevel
+
             self.cors = aiohttp_cors.setup(
                 self.app,
                 defaults={self.config.allow_origin: aiohttp_cors.ResourceOptions(allow_credentials=True, expose_headers="*", allow_headers="*")},
@@ -75,10 +94,8 @@ class ApiFactory(object):
                 if not isinstance(route.resource, aiohttp.web_urldispatcher.StaticResource):
                     self.cors.add(route)
 
-        # Setup Jinja2 templates
-        self.jinja2env = aiohttp_jinja2.setup(self.app, loader=jinja2.FileSystemLoader(os.path.join(self.config.PROJECT_ROOT, "templates")))
-        self.jinja2env.globals["config"] = self.config
-        self.jinja2env.globals["static_path"] = self.prefix_context_path("/static")
+        # Jinja2 templates are loaded on first HTML interface request
+        self._jinja2env = None
 
         # Print configured routes
         self.print_routes()
@@ -86,6 +103,104 @@ class ApiFactory(object):
         # Setup services
         self.app.on_startup.append(self.setup_rcp_services)
         self.app.on_shutdown.append(self.close_rcp_services)
+        self.app.on_cleanup.append(self.close_lock_manager)
+        if self.load_cams is not None:
+            self.app.on_startup.append(self.setup_reload_signal)
+            self.app.on_cleanup.append(self.remove_reload_signal)
+
+    def setup_swagger(self, swagger_url):
+        """
+        Serve SwaggerUI and API spec built from handlers docstrings
+        In fast start mode spec is cached to a file and aiohttp_swagger is only imported to build it again
+        """
+
+        params = {
+            "description": "API to move PTZ on Bosch camera using RCP+ protocol",
+            "title": "PTZ API for Bosch RCP+",
+            "api_version": "1.0",
+            "contact": "acecile@le-vert.net",
+        }
+
+        if not self.config.fast_start:
+            import aiohttp_swagger  # pylint: disable=import-outside-toplevel
+
+            # bundle_params is a GitHub patch not released
+            # in any aiohttp_swagger package
+            setup_swagger_sign = inspect.signature(aiohttp_swagger.setup_swagger)
+            if "bundle_params" in setup_swagger_sign.parameters:
+                params["bundle_params"] = {"layout": "BaseLayout"}
+
+            aiohttp_swagger.setup_swagger(app=self.app, swagger_url=swagger_url, **params)
+            return
+
+        spec = self.load_swagger_spec(params)
+        swagger_def_url = swagger_url.rstrip("/") + "/swagger.json"
+        statics_path = swagger_url.rstrip("/") + "/swagger_static"
+        # Locate package without importing it
+        static_dir = os.path.join(importlib.util.find_spec("aiohttp_swagger").submodule_search_locations[0], "swagger_ui")
+        swagger_home = []
+
+        @asyncio.coroutine
+        def swagger_home_handler(_):
+            if not swagger_home:
+                with open(os.path.join(static_dir, "index.html"), "r") as index_file:
+                    swagger_home.append(
+                        index_file.read().replace("##SWAGGER_CONFIG##", swagger_def_url).replace("##STATIC_PATH##", statics_path).replace("##SWAGGER_VALIDATOR_URL##", "")
+                    )
+            return aiohttp.web.Response(text=swagger_home[0], content_type="text/html")
+
+        @asyncio.coroutine
+        def swagger_def_handler(_):
+            return aiohttp.web.json_response(text=spec)
+
+        self.app.router.add_route("GET", swagger_url, swagger_home_handler)
+        self.app.router.add_route("GET", swagger_url.rstrip("/") + "/", swagger_home_handler)
+        self.app.router.add_route("GET", swagger_def_url, swagger_def_handler)
+        self.app.router.add_static(statics_path, static_dir)
+
+    def load_swagger_spec(self, params):
+        """
+        Return API spec JSON from cache file,
+        build it again and update cache when routes or their docstrings changed
+        """
+
+        digest = hashlib.sha1(json.dumps(params, sort_keys=True).encode("utf-8"))
+        for route in self.app.router.routes():
+            digest.update(("%s %s %s" % (route.method, route.resource.canonical, route.handler.__doc__)).encode("utf-8"))
+        key = digest.hexdigest()
+
+        try:
+            with open(self.config.swagger_cache, "r") as cache_file:
+                cache = json.load(cache_file)
+            if cache["key"] == key:
+                return cache["spec"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+        from aiohttp_swagger.helpers import generate_doc_from_each_end_point  # pylint: disable=import-outside-toplevel
+
+        self.logger.info("Building API spec, cached to %s", self.config.swagger_cache)
+        spec = generate_doc_from_each_end_point(self.app, api_base_url="/", **params)
+        try:
+            # Several workers may build it at once, never let them read a partial file
+            with tempfile.NamedTemporaryFile("w", dir=os.path.dirname(self.config.swagger_cache), delete=False) as cache_file:
+                json.dump({"key": key, "spec": spec}, cache_file)
+            os.replace(cache_file.name, self.config.swagger_cache)
+        except OSError as exc:
+            self.logger.warning("Unable to cache API spec to %s: %s", self.config.swagger_cache, exc)
+        return spec
+
+    @property
+    def jinja2env(self):
+        """ Jinja2 environment of HTML interface, created on first use """
+
+        if self._jinja2env is None:
+            import jinja2  # pylint: disable=import-outside-toplevel
+
+            self._jinja2env = jinja2.Environment(loader=jinja2.FileSystemLoader(os.path.join(self.config.PROJECT_ROOT, "templates")))
+            self._jinja2env.globals["config"] = self.config
+            self._jinja2env.globals["static_path"] = self.prefix_context_path("/static")
+        return self._jinja2env
 
     def url_for(self, name):
         """ Get relative URL for a given route named """
@@ -103,6 +218,130 @@ class ApiFactory(object):
         """ Construct a relative URL with context path """
         return self.route_join(self.config.context_path, *args)
 
+    @staticmethod
+    def camera_handler(registry, resource_class, handler_name):
+        """
+        Route handler dispatching to resource of camera given by {cam_id},
+        so cameras can be added or removed without touching the router
+        """
+
+        @asyncio.coroutine
+        def handler(request):
+            resource = request.app[registry].get(request.match_info["cam_id"], None)
+            if resource is None:
+                raise aiohttp.web.HTTPNotFound(reason="Unknown camera %s" % request.match_info["cam_id"])
+            return (yield from getattr(resource, handler_name)(request))
+
+        # Swagger documentation is read from handler docstring
+        handler.__doc__ = getattr(resource_class, handler_name).__doc__
+        return handler
+
+    def add_camera_resources(self, cam):
+        """ Create resources serving routes of one camera """
+
+        ptz_move = self.app["ptz_moves"][cam] = resources.PtzMove(cam, lock_manager=self.app["lock_manager"], server_timing=self.config.server_timing)
+        self.app["ptz_positions"][cam] = resources.PtzPosition(cam)
+        self.app["ptz_presets"][cam] = resources.PtzPreset(ptz_move)
+
+    def remove_camera_resources(self, cam):
+        """ Drop resources of one camera, its routes answer 404 from now on """
+
+        for registry in ("ptz_moves", "ptz_positions", "ptz_presets"):
+            self.app[registry].pop(cam, None)
+
+    @asyncio.coroutine
+    def reload_cams(self):
+        """
+        Load cameras definitions again and apply differences only:
+        new cameras are started, removed ones are stopped, drained and closed,
+        changed ones get a new RCP+ client but keep their lock, unchanged ones are not touched
+        Return camera ids per change, raise ValueError if definitions are invalid
+        """
+
+        yield from self._reload_lock.acquire()
+        try:
+            cams = self.load_cams()
+            old_cams = self.config.cams
+            added = sorted(set(cams) - set(old_cams))
+            removed = sorted(set(old_cams) - set(cams))
+            changed = sorted(x for x in set(cams) & set(old_cams) if cams[x] != old_cams[x])
+            unchanged = sorted(set(cams) & set(old_cams) - set(changed))
+
+            # New clients are ready before they replace old ones so routes always find a client
+            rcp_services = {cam: self.create_rcp_service(cam, cams[cam]) for cam in added + changed}
+            yield from asyncio.gather(*[x.start() for x in rcp_services.values()])
+
+            retired = []
+            for cam in removed:
+                retired.append((self.app["ptz_moves"][cam], self.app["rcp_services"].pop(cam), True))
+                self.remove_camera_resources(cam)
+            for cam in changed:
+                retired.append((self.app["ptz_moves"][cam], self.app["rcp_services"][cam], False))
+            for cam in added:
+                self.add_camera_resources(cam)
+            self.app["rcp_services"].update(rcp_services)
+            self.config.cams = cams
+
+            yield from asyncio.gather(*[self.retire_camera(*x) for x in retired])
+        finally:
+            self._reload_lock.release()
+
+        self.logger.info("Cameras reloaded: %d added, %d removed, %d changed, %d unchanged", len(added), len(removed), len(changed), len(unchanged))
+        return {"added": added, "removed": removed, "changed": changed, "unchanged": unchanged}
+
+    def create_rcp_service(self, cam, cam_params):
+        """ RCP+ client of a camera, logging and timing options come from command line and are the same for all cameras """
+
+        return services.AsyncRcpClient(name=cam, move_log_interval=self.config.move_log_interval_ms / 1000, server_timing=self.config.server_timing, **cam_params)
+
+    @asyncio.coroutine
+    def retire_camera(self, ptz_move, rcp_service, removed=False):
+        """
+        Stop using a RCP+ client: close its WebSockets, stop camera if left moving, send queued writes then close it
+        A removed camera also loses its lock and its metrics series, a changed one keeps them for its new client
+        """
+
+        yield from ptz_move.close()
+        if rcp_service.moving:
+            try:
+                yield from rcp_service.move_ptz(stop=True)
+            except Exception as exc:  # pylint: disable=broad-except
+                self.logger.error("Unable to stop camera %s before closing its client: %s: %s", rcp_service.name, exc.__class__.__name__, exc)
+        yield from rcp_service.drain(self.DRAIN_TIMEOUT)
+        yield from rcp_service.close()
+        if removed:
+            self.app["lock_manager"].release(rcp_service.name)
+            self.app["lock_manager"].forget_metrics(rcp_service.name)
+            services.METRICS_REGISTRY.remove_label_value("camera", rcp_service.name)
+
+    def reload_on_signal(self):
+        """ SIGHUP handler, errors are only logged """
+
+        @asyncio.coroutine
+        def reload():
+            try:
+                yield from self.reload_cams()
+            except Exception as exc:  # pylint: disable=broad-except
+                self.logger.error("Unable to reload cameras, keeping running configuration: %s: %s", exc.__class__.__name__, exc)
+
+        self.logger.info("Received SIGHUP, reloading cameras")
+        asyncio.ensure_future(reload())
+
+    @staticmethod
+    @asyncio.coroutine
+    def setup_reload_signal(app):
+        """ Reload cameras on SIGHUP """
+
+        asyncio.get_event_loop().add_signal_handler(signal.SIGHUP, app.factory.reload_on_signal)
+
+    @staticmethod
+    @asyncio.coroutine
+    def remove_reload_signal(app):  # pylint: disable=unused-argument
+        """ Stop handling SIGHUP, a reload received while shutting down is ignored """
+
+        asyncio.get_event_loop().remove_signal_handler(signal.SIGHUP)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
     def print_routes(self):
         """ Log all configured routes """
 
@@ -122,19 +361,39 @@ class ApiFactory(object):
     @staticmethod
     @asyncio.coroutine
     def setup_rcp_services(app):
-        """ Instance PTZ service for each camera """
+        """
+        Instance PTZ service for each camera
+        Each camera gets its own connection pool, opened right away and kept warm
+        """
 
-        app["aiohttp_session"] = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=10))
         app["rcp_services"] = {}
 
         for cam, cam_params in app.factory.config.cams.items():
-            app["rcp_services"][cam] = services.AsyncRcpClient(
-                url=cam_params["url"], username=cam_params["username"], password=cam_params["password"], name=cam, session=app["aiohttp_session"]
-            )
+            app["rcp_services"][cam] = app.factory.create_rcp_service(cam, cam_params)
+
+        yield from asyncio.gather(*[x.start() for x in app["rcp_services"].values()])
 
     @staticmethod
     @asyncio.coroutine
     def close_rcp_services(app):
-        """ Shutdown aiohttp session used by PTZ services """
+        """
+        Stop cameras left moving and shutdown
+        aiohttp sessions used by PTZ services
+        """
+
+        moving = [x for x in app["rcp_services"].values() if x.moving]
+        if moving:
+            app.factory.logger.info("Stopping %d camera(s) still moving before shutdown", len(moving))
+            results = yield from asyncio.gather(*[x.move_ptz(stop=True) for x in moving], return_exceptions=True)
+            for rcp_service, result in zip(moving, results):
+                if isinstance(result, Exception):
+                    app.factory.logger.error("Unable to stop camera %s on shutdown: %s: %s", rcp_service.name, result.__class__.__name__, result)
+
+        yield from asyncio.gather(*[x.close() for x in app["rcp_services"].values()])
+
+    @staticmethod
+    @asyncio.coroutine
+    def close_lock_manager(app):
+        """ Stop lock expiry sweep and release lock backend """
 
-        yield from app["aiohttp_session"].close()
+        app["lock_manager"].close()
@@ -0,0 +1,64 @@
+"""
+JSON encoding of API responses
+orjson is used when installed, constant bodies are encoded only once
+"""
+
+
+# pylint: disable=line-too-long
+
+
+import json
+import functools
+import aiohttp.web
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+JSON_BACKEND = "orjson" if orjson is not None else "json"
+CONTENT_TYPE = "application/json"
+CHARSET = "utf-8"
+ERROR_BODIES_CACHE_SIZE = 256
+
+
+_STDLIB_ENCODER = json.JSONEncoder(separators=(",", ":"))
+
+
+def encode_stdlib(payload):
+    """ Encode payload to JSON bytes using standard library, compact like orjson """
+    return _STDLIB_ENCODER.encode(payload).encode(CHARSET)
+
+
+encode = orjson.dumps if orjson is not None else encode_stdlib  # pylint: disable=invalid-name,no-member
+
+
+class PreEncodedPayload(dict):
+    """
+    Payload answered many times and never modified, JSON body is encoded once
+    It is still a dict so callers can read or copy it
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.body = encode(self)
+
+
+def json_response(payload, status=200):
+    """ Same as aiohttp.web.json_response, reusing body of pre-encoded payloads """
+
+    body = payload.body if isinstance(payload, PreEncodedPayload) else encode(payload)
+    return aiohttp.web.Response(body=body, status=status, content_type=CONTENT_TYPE, charset=CHARSET)
+
+
+@functools.lru_cache(maxsize=ERROR_BODIES_CACHE_SIZE)
+def _error_body(message, status):
+    """ Error messages come from a small set of templates, keep their bodies """
+    return encode({"message": message, "status": status})
+
+
+def error_response(rest_error):
+    """ JSON response of a rest error built by rest_error_from_exception """
+
+    return aiohttp.web.Response(body=_error_body(rest_error["message"], rest_error["status"]), status=rest_error["status"], content_type=CONTENT_TYPE, charset=CHARSET)
@@ -5,7 +5,54 @@ import functools
 import aiohttp
 
 
-from services import RcpHttpException
+import api_json
+from services import RcpHttpException, RcpHttpTooManyRequestsException, Histogram
+
+
+HTTP_REQUEST_DURATION = Histogram("http_request_duration_seconds", "API HTTP handlers duration by method, route and status", labelnames=("method", "route", "status"))
+
+# Camera errors (e.g. 503 from open circuit) are logged at most once per interval and per error type
+RCP_ERROR_LOG_INTERVAL = 1
+_RCP_ERRORS_LOGGED = {}
+
+
+def rest_error_from_exception(exc):
+    """
+    Build rest JSON error payload from an exception
+    Define status code according to exception type
+    """
+
+    if isinstance(exc, aiohttp.web.HTTPException):
+        status = exc.status  # pylint: disable=no-member
+        message = exc.reason  # pylint: disable=no-member
+    elif isinstance(exc, RcpHttpException):
+        status = exc.status_code  # pylint: disable=no-member
+        message = exc.message  # pylint: disable=no-member
+    elif isinstance(exc, AssertionError):
+        status = 400
+        message = str(exc)
+    else:
+        status = 500
+        message = "Internal Server Error"
+
+    return {"message": message, "status": status}
+
+
+def _log_rcp_error(logger, request, exc):
+    """
+    Log camera error on one line, at most once per RCP_ERROR_LOG_INTERVAL for each error type
+    A failing camera answers every request with the same error, no traceback is needed to tell why
+    """
+
+    key = (exc.__class__, exc.status_code)
+    now = asyncio.get_event_loop().time()
+    logged_at, not_logged = _RCP_ERRORS_LOGGED.get(key, (None, 0))
+    if logged_at is not None and now - logged_at < RCP_ERROR_LOG_INTERVAL:
+        _RCP_ERRORS_LOGGED[key] = (logged_at, not_logged + 1)
+        return
+
+    logger.error("Camera error handling request %s %s: %s: %s (%d similar error(s) not logged)", request.method, request.path, exc.__class__.__name__, exc, not_logged)
+    _RCP_ERRORS_LOGGED[key] = (now, 0)
 
 
 @asyncio.coroutine
@@ -24,29 +71,56 @@ def rest_error_middleware(_, handler, logger=None):
 
         except Exception as exc:  # pylint: disable=broad-except
 
-            # Log exception if have a logger
-            if isinstance(logger, logging.Logger):
-                logger.exception("Error handling request: %s: %s", exc.__class__.__name__, exc)
-
-            # Define status code according to exception type
-            if isinstance(exc, aiohttp.web.HTTPException):
-                status = exc.status  # pylint: disable=no-member
-                message = exc.reason  # pylint: disable=no-member
-            elif isinstance(exc, RcpHttpException):
-                status = exc.status_code  # pylint: disable=no-member
-                message = exc.message  # pylint: disable=no-member
-            elif isinstance(exc, AssertionError):
-                status = 400
-                message = str(exc)
-            else:
-                status = 500
-                message = "Internal Server Error"
+            rest_error = rest_error_from_exception(exc)
 
-            rest_error = {"message": message, "status": status}
+            # Log exception if have a logger, client and camera errors are expected and logged without traceback,
+            # rate limited writes are only counted (rcp_ptz_writes_rate_limited_total) as WebSocket ones
+            if isinstance(logger, logging.Logger) and not isinstance(exc, RcpHttpTooManyRequestsException):
+                if isinstance(exc, RcpHttpException):
+                    _log_rcp_error(logger, request, exc)
+                elif rest_error["status"] < 500:
+                    logger.warning("Client error handling request %s %s: %s: %s", request.method, request.path, exc.__class__.__name__, exc)
+                else:
+                    logger.exception("Error handling request: %s: %s", exc.__class__.__name__, exc)
 
-            response = aiohttp.web.json_response(rest_error, status=status)
+            response = api_json.error_response(rest_error)
 
         finally:
             return response  # pylint: disable=lost-exception
 
     return functools.partial(return_rest_error_response, logger=logger)
+
+
+def _route_label(request):
+    """ Route template used as metric label, keep cardinality bounded """
+
+    resource = request.match_info.route.resource
+    if resource is None:
+        return "unmatched"
+    return resource.canonical
+
+
+@asyncio.coroutine
+def metrics_middleware(_, handler):
+    """
+    A middleware to record HTTP handlers duration
+    """
+
+    @asyncio.coroutine
+    def record_handler_duration(request):
+        """ middleware handler """
+
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+        status = 500
+        try:
+            response = yield from handler(request)
+            status = response.status
+            return response
+        except aiohttp.web.HTTPException as exc:
+            status = exc.status  # pylint: disable=no-member
+            raise
+        finally:
+            HTTP_REQUEST_DURATION.labels(request.method, _route_label(request), status).observe(loop.time() - start)
+
+    return record_handler_duration
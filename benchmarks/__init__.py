@@ -0,0 +1,4 @@
+"""
+Micro-benchmarks running without any real Bosch camera
+Run them all with: python3 -m benchmarks.run
+"""
@@ -0,0 +1,31 @@
+""" JSON responses benchmarks: aiohttp json_response compared to pre-encoded bodies and fast encoder """
+
+
+# pylint: disable=line-too-long
+
+
+import aiohttp.web
+
+import api_json
+from resources import PtzMove
+from .helpers import measure
+
+
+DYNAMIC_PAYLOAD = {"message": "PTZ position", "status": 200, "pan": 123.45, "tilt": -12.5, "zoom": 4.2}
+
+
+def run(iterations):
+    """ Run JSON responses benchmarks, per response built """
+
+    results = [
+        measure("json.constant.aiohttp", lambda: aiohttp.web.json_response(dict(PtzMove.STOP_PAYLOAD), status=200), iterations),
+        measure("json.constant.pre_encoded", lambda: api_json.json_response(PtzMove.STOP_PAYLOAD, status=200), iterations),
+        measure("json.error.aiohttp", lambda: aiohttp.web.json_response({"message": "PTZ is already in use", "status": 403}, status=403), iterations),
+        measure("json.error.cached", lambda: api_json.error_response({"message": "PTZ is already in use", "status": 403}), iterations),
+        measure("json.dynamic.aiohttp", lambda: aiohttp.web.json_response(DYNAMIC_PAYLOAD, status=200), iterations),
+        measure("json.encode.stdlib", lambda: api_json.encode_stdlib(DYNAMIC_PAYLOAD), iterations),
+    ]
+    if api_json.JSON_BACKEND != "json":
+        results.append(measure("json.encode.%s" % api_json.JSON_BACKEND, lambda: api_json.encode(DYNAMIC_PAYLOAD), iterations))
+    results.append(measure("json.dynamic.%s" % api_json.JSON_BACKEND, lambda: api_json.json_response(DYNAMIC_PAYLOAD, status=200), iterations))
+    return results
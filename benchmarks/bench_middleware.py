@@ -0,0 +1,47 @@
+""" Middlewares overhead benchmarks, compared to calling the handler directly """
+
+
+# pylint: disable=line-too-long
+
+
+import asyncio
+import aiohttp.web
+import aiohttp.test_utils
+
+import api_middlewares
+from .helpers import measure_coroutine
+
+
+@asyncio.coroutine
+def _ok_handler(request):  # pylint: disable=unused-argument
+    return aiohttp.web.Response(text="OK")
+
+
+@asyncio.coroutine
+def _bad_request_handler(request):  # pylint: disable=unused-argument
+    raise AssertionError("left and right move are exclusive")
+
+
+@asyncio.coroutine
+def _wrap(app, handler):
+    """ Chain middlewares the same way ApiFactory does """
+
+    handler = yield from api_middlewares.rest_error_middleware(app, handler)
+    handler = yield from api_middlewares.metrics_middleware(app, handler)
+    return handler
+
+
+@asyncio.coroutine
+def run(iterations):
+    """ Run middlewares benchmarks """
+
+    app = aiohttp.web.Application()
+    request = aiohttp.test_utils.make_mocked_request("GET", "/cams/bench/ptz/move", app=app)
+    ok_handler = yield from _wrap(app, _ok_handler)
+    bad_request_handler = yield from _wrap(app, _bad_request_handler)
+
+    return [
+        (yield from measure_coroutine("middleware.none", lambda: _ok_handler(request), iterations)),
+        (yield from measure_coroutine("middleware.success", lambda: ok_handler(request), iterations)),
+        (yield from measure_coroutine("middleware.assertion_error", lambda: bad_request_handler(request), iterations)),
+    ]
@@ -0,0 +1,42 @@
+""" PtzMove lock benchmarks: acquire, renew and release on each lock backend """
+
+
+# pylint: disable=line-too-long,protected-access
+
+
+import os
+import asyncio
+import tempfile
+
+from resources import PtzMove
+from services import PtzLockManager, MemoryLockBackend, SharedMemoryLockBackend
+from .helpers import measure
+
+
+def _run_backend(name, backend, iterations):
+    """ Time lock operations of one backend """
+
+    lock_manager = PtzLockManager(backend=backend)
+    ptz_move = PtzMove("bench", lock_manager=lock_manager)
+
+    results = [measure("ptz_lock.%s.lock_unlock" % name, lambda: (ptz_move._lock(), ptz_move._unlock()), iterations)]
+
+    token = ptz_move._lock()
+    results.append(measure("ptz_lock.%s.renew" % name, lambda: ptz_move._renew_lock(token), iterations))
+    results.append(measure("ptz_lock.%s.owner" % name, lambda: ptz_move.locked, iterations))
+    ptz_move._unlock()
+
+    lock_manager.close()
+    return results
+
+
+@asyncio.coroutine
+def run(iterations):
+    """ Run PtzMove lock benchmarks """
+
+    results = _run_backend("memory", MemoryLockBackend(), iterations)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        results.extend(_run_backend("shm", SharedMemoryLockBackend(os.path.join(tmp_dir, "locks")), iterations))
+
+    return results
@@ -0,0 +1,68 @@
+"""
+AsyncRcpClient benchmarks
+move_ptz validation and payload encoding alone, then full round trip against fake camera
+"""
+
+
+# pylint: disable=line-too-long
+
+
+import asyncio
+import itertools
+
+from services import AsyncRcpClient
+from .fake_camera import FakeRcpCamera, FakeRcpTcpCamera
+from .helpers import measure_coroutine
+
+
+MOVES = [
+    {"left": "3", "up": "2"},
+    {"right": "7", "down": "1", "zin": "2"},
+    {"zout": "5"},
+    {"left": 0, "right": 0, "up": 0, "down": 0, "zin": 0, "zout": 0, "stop": "1"},
+]
+
+
+class _EncodeOnlyClient(AsyncRcpClient):
+    """ Client resolving writes right away, to time validation and encoding only """
+
+    def _submit_write(self, command, payload, stop=False, timing=None):
+        waiter = asyncio.Future()
+        waiter.set_result(None)
+        return waiter
+
+
+@asyncio.coroutine
+def run(iterations):
+    """ Run AsyncRcpClient benchmarks """
+
+    results = []
+
+    client = _EncodeOnlyClient(name="bench", refresh_window=0, keepalive_interval=0)
+    moves = itertools.cycle(MOVES)
+    results.append((yield from measure_coroutine("rcp_client.move_ptz_encode", lambda: client.move_ptz(**next(moves)), iterations)))
+    yield from client.close()
+
+    camera = FakeRcpCamera()
+    port = yield from camera.start()
+    client = AsyncRcpClient(url="http://127.0.0.1:%d" % port, name="bench", refresh_window=0, keepalive_interval=0)
+    try:
+        yield from client.start()
+        moves = itertools.cycle(MOVES)
+        results.append((yield from measure_coroutine("rcp_client.move_ptz_round_trip", lambda: client.move_ptz(**next(moves)), iterations)))
+    finally:
+        yield from client.close()
+        yield from camera.stop()
+
+    camera = FakeRcpTcpCamera()
+    port = yield from camera.start()
+    client = AsyncRcpClient(url="http://127.0.0.1", name="bench", refresh_window=0, keepalive_interval=0, transport="tcp", tcp_port=port)
+    try:
+        yield from client.start()
+        moves = itertools.cycle(MOVES)
+        results.append((yield from measure_coroutine("rcp_client.move_ptz_round_trip_tcp", lambda: client.move_ptz(**next(moves)), iterations)))
+    finally:
+        yield from client.close()
+        yield from camera.stop()
+
+    return results
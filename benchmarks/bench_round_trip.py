@@ -0,0 +1,74 @@
+"""
+Full API round trip benchmarks
+HTTP client -> ApiFactory application -> AsyncRcpClient -> fake camera
+"""
+
+
+# pylint: disable=line-too-long
+
+
+import time
+import asyncio
+import aiohttp
+
+from api_factory import ApiFactory
+from .fake_camera import FakeRcpCamera
+from .helpers import make_api_config, make_cams_config, measure_coroutine, start_api, summarize
+
+
+CONCURRENCY = 8
+
+
+@asyncio.coroutine
+def _move(session, url, params):
+    """ Call move route, return decoded JSON """
+
+    response = yield from session.get(url, params=params)
+    payload = yield from response.json()
+    assert response.status == 200, payload
+    return payload
+
+
+@asyncio.coroutine
+def run(iterations, project_root):
+    """ Run full round trip benchmarks """
+
+    camera = FakeRcpCamera()
+    port = yield from camera.start()
+    config = make_api_config(make_cams_config({"bench": {"url": "http://127.0.0.1:%d" % port, "refresh_window": "0", "keepalive_interval": "0"}}), project_root)
+    factory = ApiFactory(loop=asyncio.get_event_loop(), config=config)
+    runner, api_url = yield from start_api(factory)
+    move_url = api_url + "/cams/bench/ptz/move"
+    session = aiohttp.ClientSession()
+
+    try:
+        payload = yield from _move(session, move_url, {"left": "1"})
+        params = {"left": "2", "lock_token": payload["lock_token"]}
+
+        results = [(yield from measure_coroutine("round_trip.sequential", lambda: _move(session, move_url, params), iterations))]
+
+        semaphore = asyncio.Semaphore(CONCURRENCY)
+        samples = []
+
+        @asyncio.coroutine
+        def timed_move():
+            yield from semaphore.acquire()
+            try:
+                start = time.perf_counter()
+                yield from _move(session, move_url, params)
+                samples.append(time.perf_counter() - start)
+            finally:
+                semaphore.release()
+
+        start = time.perf_counter()
+        yield from asyncio.gather(*[timed_move() for _ in range(iterations)])
+        elapsed = time.perf_counter() - start
+        results.append(summarize("round_trip.concurrent", samples, concurrency=CONCURRENCY, wall_s=elapsed, throughput_per_s=iterations / elapsed))
+
+        yield from _move(session, move_url, {"stop": "1", "lock_token": payload["lock_token"]})
+    finally:
+        yield from session.close()
+        yield from runner.cleanup()
+        yield from camera.stop()
+
+    return results
@@ -0,0 +1,68 @@
+"""
+Startup time benchmarks
+Each run is a fresh interpreter importing main and building ApiFactory,
+the way a restart or a rolling deploy pays for it
+"""
+
+
+# pylint: disable=line-too-long
+
+
+import os
+import sys
+import tempfile
+import subprocess
+
+from .helpers import summarize
+
+
+# Startup takes hundreds of milliseconds, do not spawn thousands of interpreters
+RUNS_MAX = 10
+CAMS_COUNT = 10
+
+STARTUP_SCRIPT = """
+import time
+start = time.perf_counter()
+import main
+from benchmarks.helpers import make_api_config, make_cams_config
+config = make_api_config(make_cams_config(%(cams)r), %(project_root)r, fast_start=%(fast_start)r, swagger_cache=%(swagger_cache)r)
+main.ApiFactory(config=config)
+print(time.perf_counter() - start)
+"""
+
+
+def _startup(project_root, fast_start=False, swagger_cache=None):
+    """ Time import and ApiFactory creation in a new interpreter (seconds) """
+
+    script = STARTUP_SCRIPT % {
+        "cams": {"cam%d" % i: {"url": "http://127.0.0.1:%d" % (8000 + i)} for i in range(CAMS_COUNT)},
+        "project_root": project_root,
+        "fast_start": fast_start,
+        "swagger_cache": swagger_cache,
+    }
+    output = subprocess.check_output([sys.executable, "-c", script], cwd=project_root, stderr=subprocess.DEVNULL)
+    return float(output.decode("utf-8").strip().splitlines()[-1])
+
+
+def run(iterations, project_root):
+    """ Run startup benchmarks: default, fast start without spec cache and fast start with spec cache """
+
+    runs = max(1, min(iterations, RUNS_MAX))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        swagger_cache = os.path.join(tmp_dir, "swagger.json")
+
+        default = [_startup(project_root) for _ in range(runs)]
+
+        cold = []
+        for _ in range(runs):
+            if os.path.exists(swagger_cache):
+                os.unlink(swagger_cache)
+            cold.append(_startup(project_root, fast_start=True, swagger_cache=swagger_cache))
+
+        warm = [_startup(project_root, fast_start=True, swagger_cache=swagger_cache) for _ in range(runs)]
+
+    return [
+        summarize("startup.default", default, cams=CAMS_COUNT),
+        summarize("startup.fast_start_cold", cold, cams=CAMS_COUNT),
+        summarize("startup.fast_start_cached", warm, cams=CAMS_COUNT),
+    ]
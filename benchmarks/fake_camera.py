@@ -0,0 +1,388 @@
+#!/usr/bin/python3
+
+
+# pylint: disable=line-too-long
+
+
+"""
+Fake Bosch camera answering RCP+ over HTTP (/rcp.xml) or binary TCP session
+Decode and log PTZ moves, report position following them, latency, errors and 401 can be simulated
+"""
+
+
+import sys
+import time
+import socket
+import random
+import logging
+import asyncio
+import argparse
+import aiohttp.web
+
+from services.async_rcp_client import RcpTcpTransport, PTZ_POSITION_DATA, BICOM_PTZ_PRESET, encode_ptz_position_read, encode_ptz_preset_store, encode_ptz_preset_recall
+
+
+PTZ_COMMAND = 0x09A5
+BICOM_PTZ_PREFIX = "0x800006011085"
+
+RCP_REPLY_TEMPLATE = """<rcp>
+<command><hex>0x%04x</hex><dec>%d</dec></command>
+<type>%s</type>
+<direction>%s</direction>
+<num>%s</num>
+<idstring></idstring>
+<payload></payload>
+<cltid>0x0001</cltid>
+<sessionid>0x00000000</sessionid>
+<auth>1</auth>
+<protocol>TCP</protocol>
+<result>%s</result>
+</rcp>
+"""
+
+
+def decode_ptz_payload(payload):
+    """
+    Decode 0x09A5 BiCom PTZ payload built by AsyncRcpClient.move_ptz
+    Return dict with left, right, up, down, zin, zout speeds and stop flag
+    """
+
+    assert payload.lower().startswith(BICOM_PTZ_PREFIX.lower()), "Not a BiCom PTZ payload: %s" % payload
+    action = payload[len(BICOM_PTZ_PREFIX) :]
+    assert len(action) == 6 and action.isdigit(), "Invalid PTZ action: %s" % action
+
+    move = {"left": 0, "right": 0, "up": 0, "down": 0, "zin": 0, "zout": 0, "stop": action == "000000"}
+    if move["stop"]:
+        return move
+
+    if action[0] == "0":
+        move["left"] = int(action[1])
+    else:
+        move["right"] = int(action[1])
+    if action[2] == "8":
+        move["up"] = int(action[3])
+    else:
+        move["down"] = int(action[3])
+    if action[4] == "8":
+        move["zin"] = int(action[5])
+    else:
+        move["zout"] = int(action[5])
+
+    return move
+
+
+class _FakeCamera(object):  # pylint: disable=too-many-instance-attributes
+    """
+    Options and PTZ moves bookkeeping shared by HTTP and TCP fake cameras
+    :param latency: Delay before answering (seconds)
+    :param error_rate: Ratio of requests answered with an error
+    :param unauthorized_rate: Ratio of requests (sessions for TCP) refused as unauthorized
+    :param username: Require authentication with this username
+    :param password: Require authentication with this password
+    """
+
+    PAN_TILT_DEGREES_PER_SPEED = 10
+    ZOOM_RATIO_PER_SPEED = 0.5
+
+    def __init__(self, latency=0, error_rate=0, unauthorized_rate=0, username=None, password=None, name="FakeCam"):  # pylint: disable=too-many-arguments
+        assert isinstance(latency, (int, float)) and latency >= 0, "latency must be a positive number (seconds)"
+        assert isinstance(error_rate, (int, float)) and 0 <= error_rate <= 1, "error_rate must be between 0 and 1"
+        assert isinstance(unauthorized_rate, (int, float)) and 0 <= unauthorized_rate <= 1, "unauthorized_rate must be between 0 and 1"
+        assert (username is None) == (password is None), "username and password must be specified or none of them"
+
+        self.latency = latency
+        self.error_rate = error_rate
+        self.unauthorized_rate = unauthorized_rate
+        self.username = username
+        self.password = password
+        self.logger = logging.getLogger(self.__class__.__name__ + "@" + name)
+        self.moves = []
+        self.requests_count = 0
+        self.position = {"pan": 0.0, "tilt": 0.0, "zoom": 1.0}
+        self._velocity = {"pan": 0.0, "tilt": 0.0, "zoom": 0.0}
+        self._velocity_since = time.monotonic()
+        self.presets = {}
+
+    def _simulate_unauthorized(self):
+        """ Randomly refuse authentication according to unauthorized_rate """
+        return bool(self.unauthorized_rate) and random.random() < self.unauthorized_rate
+
+    def _simulate_error(self):
+        """ Randomly fail according to error_rate """
+        return bool(self.error_rate) and random.random() < self.error_rate
+
+    def _record_ptz_payload(self, payload):
+        """ Decode and log PTZ payload (move or preset), return False if invalid """
+
+        if self._record_preset_payload(payload):
+            return True
+        try:
+            move = decode_ptz_payload(payload)
+        except AssertionError as exc:
+            self.logger.warning("Invalid PTZ payload: %s", exc)
+            return False
+        self.moves.append(move)
+        self._update_position()
+        self._velocity = {
+            "pan": (move["right"] - move["left"]) * self.PAN_TILT_DEGREES_PER_SPEED,
+            "tilt": (move["up"] - move["down"]) * self.PAN_TILT_DEGREES_PER_SPEED,
+            "zoom": (move["zin"] - move["zout"]) * self.ZOOM_RATIO_PER_SPEED,
+        }
+        self.logger.info("PTZ move: %s", ", ".join("%s=%s" % (x, move[x]) for x in ("left", "right", "up", "down", "zin", "zout", "stop")))
+        return True
+
+    def _record_preset_payload(self, payload):
+        """ Store or recall preset, return False if payload is not a preset one """
+
+        try:
+            payload = bytes.fromhex(payload[2:])
+        except ValueError:
+            return False
+        header = encode_ptz_preset_store(0)[: -BICOM_PTZ_PRESET.size]
+        if len(payload) != len(header) + BICOM_PTZ_PRESET.size:
+            return False
+        preset = BICOM_PTZ_PRESET.unpack_from(payload, len(header))[0]
+
+        self._update_position()
+        if payload == encode_ptz_preset_store(preset):
+            self.presets[preset] = dict(self.position)
+            self.logger.info("PTZ preset %d stored: %s", preset, self.presets[preset])
+        elif payload == encode_ptz_preset_recall(preset):
+            self._velocity = {"pan": 0.0, "tilt": 0.0, "zoom": 0.0}
+            self.position.update(self.presets.get(preset, {}))
+            self.logger.info("PTZ preset %d recalled: %s", preset, self.position)
+        else:
+            return False
+        return True
+
+    def _update_position(self):
+        """ Move simulated position according to current velocity """
+
+        now = time.monotonic()
+        elapsed = now - self._velocity_since
+        self._velocity_since = now
+        self.position["pan"] = (self.position["pan"] + self._velocity["pan"] * elapsed) % 360
+        self.position["tilt"] = max(-90.0, min(90.0, self.position["tilt"] + self._velocity["tilt"] * elapsed))
+        self.position["zoom"] = max(1.0, min(30.0, self.position["zoom"] + self._velocity["zoom"] * elapsed))
+
+    def _position_reply(self, payload):
+        """ BiCom position reply bytes, None if payload is not a position read """
+
+        if payload != encode_ptz_position_read():
+            return None
+        self._update_position()
+        return payload + PTZ_POSITION_DATA.pack(int(self.position["pan"] * 100), int(self.position["tilt"] * 100), int(self.position["zoom"] * 100))
+
+
+class FakeRcpCamera(_FakeCamera):
+    """ aiohttp stand-in for a Bosch dome rcp.xml endpoint """
+
+    def __init__(self, *args, **kwargs):
+        super(FakeRcpCamera, self).__init__(*args, **kwargs)
+        self.auth = aiohttp.BasicAuth(self.username, self.password) if self.username is not None else None
+        self.app = aiohttp.web.Application()
+        self.app.router.add_route("GET", "/rcp.xml", self.rcp)
+        self.app.router.add_route("GET", "/", self.index)
+        self.runner = None
+
+    def _check_auth(self, request):
+        """ Tell if request must be answered with 401 """
+
+        if self._simulate_unauthorized():
+            return False
+        if self.auth is None:
+            return True
+        try:
+            return aiohttp.BasicAuth.decode(request.headers.get("Authorization", "")) == self.auth
+        except ValueError:
+            return False
+
+    @asyncio.coroutine
+    def index(self, request):  # pylint: disable=unused-argument
+        """ Answer keepalive pings, failing as RCP+ requests do so health probes see a failing camera """
+
+        if self._simulate_error():
+            return aiohttp.web.Response(status=500, text="Simulated failure")
+        return aiohttp.web.Response(text="<html></html>", content_type="text/html")
+
+    @asyncio.coroutine
+    def rcp(self, request):
+        """ Answer RCP+ requests """
+
+        self.requests_count += 1
+        if self.latency:
+            yield from asyncio.sleep(self.latency)
+
+        if not self._check_auth(request):
+            return aiohttp.web.Response(status=401, text="Unauthorized", headers={"WWW-Authenticate": 'Basic realm="FakeCam"'})
+        if self._simulate_error():
+            return aiohttp.web.Response(status=500, text="Simulated failure")
+
+        query = request.rel_url.query
+        try:
+            command = int(query.get("command", ""), 16)
+        except ValueError:
+            return aiohttp.web.Response(status=400, text="Invalid command")
+
+        result = "<str></str>"
+        if command == PTZ_COMMAND and query.get("direction", "").upper() == "WRITE":
+            if not self._record_ptz_payload(query.get("payload", "")):
+                result = "<err>0x%02x</err>" % 0x40
+        elif command == PTZ_COMMAND:
+            try:
+                reply = self._position_reply(bytes.fromhex(query.get("payload", "")[2:]))
+            except ValueError:
+                reply = None
+            if reply is None:
+                result = "<err>0x%02x</err>" % 0x40
+            else:
+                result = "<str>%s</str>" % " ".join("%02x" % x for x in reply)
+
+        body = RCP_REPLY_TEMPLATE % (command, command, query.get("type", ""), query.get("direction", ""), query.get("num", "0"), result)
+        return aiohttp.web.Response(text=body, content_type="text/xml")
+
+    @asyncio.coroutine
+    def start(self, host="127.0.0.1", port=0):
+        """ Start listening, return bound port (useful with port=0) """
+
+        sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((host, port))
+        self.runner = aiohttp.web.AppRunner(self.app, access_log=None)
+        yield from self.runner.setup()
+        yield from aiohttp.web.SockSite(self.runner, sock).start()
+        return sock.getsockname()[1]
+
+    @asyncio.coroutine
+    def stop(self):
+        """ Stop listening """
+
+        if self.runner is not None:
+            yield from self.runner.cleanup()
+            self.runner = None
+
+
+class FakeRcpTcpCamera(_FakeCamera):
+    """ asyncio stand-in for a Bosch dome binary RCP+ TCP session """
+
+    ERROR_INVALID_SESSION = 0x0A
+    ERROR_SIMULATED = 0xFF
+    ERROR_INVALID_PAYLOAD = 0x40
+
+    def __init__(self, *args, **kwargs):
+        super(FakeRcpTcpCamera, self).__init__(*args, **kwargs)
+        self.server = None
+        self.sessions_count = 0
+
+    def _check_auth(self, payload):
+        """ Validate CONF_RCP_CONNECT_PRIMITIVE plain authentication """
+
+        if self._simulate_unauthorized():
+            return False
+        if self.username is None:
+            return True
+        return payload[4:].decode("utf-8", "replace") == "+%s:%s+" % (self.username, self.password)
+
+    @staticmethod
+    def _reply(writer, tag, direction, action, session_id, payload=b""):  # pylint: disable=too-many-arguments
+        """ Write one reply frame """
+
+        direction_name = "WRITE" if direction else "READ"
+        writer.write(RcpTcpTransport.encode_frame(tag, "P_OCTET", direction_name, action, session_id=session_id, payload=payload))
+
+    @asyncio.coroutine
+    def _handle_connection(self, reader, writer):
+        """ Serve one RCP+ session, requests are answered in order """
+
+        session_id = 0
+        try:
+            while True:
+                tag, direction, _, request_session_id, _, payload = yield from RcpTcpTransport.read_frame(reader)
+                self.requests_count += 1
+                if self.latency:
+                    yield from asyncio.sleep(self.latency)
+
+                if tag == RcpTcpTransport.CONNECT_COMMAND:
+                    if self._check_auth(payload):
+                        self.sessions_count += 1
+                        session_id = self.sessions_count
+                        self._reply(writer, tag, direction, RcpTcpTransport.ACTION_REPLY, session_id, bytes([RcpTcpTransport.CONNECT_OK]))
+                    else:
+                        self._reply(writer, tag, direction, RcpTcpTransport.ACTION_REPLY, 0, bytes([0x00]))
+                elif not session_id or request_session_id != session_id:
+                    self._reply(writer, tag, direction, RcpTcpTransport.ACTION_ERROR, request_session_id, bytes([self.ERROR_INVALID_SESSION]))
+                elif self._simulate_error():
+                    self._reply(writer, tag, direction, RcpTcpTransport.ACTION_ERROR, session_id, bytes([self.ERROR_SIMULATED]))
+                elif tag == PTZ_COMMAND and direction and not self._record_ptz_payload("0x" + payload.hex()):
+                    self._reply(writer, tag, direction, RcpTcpTransport.ACTION_ERROR, session_id, bytes([self.ERROR_INVALID_PAYLOAD]))
+                elif tag == PTZ_COMMAND and not direction:
+                    reply = self._position_reply(payload)
+                    if reply is None:
+                        self._reply(writer, tag, direction, RcpTcpTransport.ACTION_ERROR, session_id, bytes([self.ERROR_INVALID_PAYLOAD]))
+                    else:
+                        self._reply(writer, tag, direction, RcpTcpTransport.ACTION_REPLY, session_id, reply)
+                else:
+                    self._reply(writer, tag, direction, RcpTcpTransport.ACTION_REPLY, session_id)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    @asyncio.coroutine
+    def start(self, host="127.0.0.1", port=0):
+        """ Start listening, return bound port (useful with port=0) """
+
+        self.server = yield from asyncio.start_server(self._handle_connection, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    @asyncio.coroutine
+    def stop(self):
+        """ Stop listening """
+
+        if self.server is not None:
+            self.server.close()
+            yield from self.server.wait_closed()
+            self.server = None
+
+
+def get_arguments_from_cmd_line():
+    """ Handle command line arguments """
+
+    parser = argparse.ArgumentParser(description="Fake Bosch camera answering RCP+", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("-b", "--bind-address", type=str, default="127.0.0.1", help="Address to bind on")
+    parser.add_argument("-p", "--bind-port", type=int, default=8080, help="Port to bind on")
+    parser.add_argument("-t", "--transport", type=str, default="http", choices=["http", "tcp"], help="Answer RCP+ over HTTP rcp.xml or binary TCP session")
+    parser.add_argument("-l", "--latency-ms", type=float, default=0, help="Delay before answering each RCP+ request")
+    parser.add_argument("-e", "--error-rate", type=float, default=0, help="Ratio of requests answered with an error")
+    parser.add_argument("-a", "--unauthorized-rate", type=float, default=0, help="Ratio of requests (sessions for TCP) refused as unauthorized")
+    parser.add_argument("-u", "--username", type=str, help="Require authentication with this username")
+    parser.add_argument("-w", "--password", type=str, help="Require authentication with this password")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)-8s [%(name)s] %(message)s", stream=sys.stdout)
+    ARGS = get_arguments_from_cmd_line()
+    KWARGS = {
+        "latency": ARGS.latency_ms / 1000,
+        "error_rate": ARGS.error_rate,
+        "unauthorized_rate": ARGS.unauthorized_rate,
+        "username": ARGS.username,
+        "password": ARGS.password,
+    }
+
+    if ARGS.transport == "http":
+        aiohttp.web.run_app(FakeRcpCamera(**KWARGS).app, host=ARGS.bind_address, port=ARGS.bind_port)
+    else:
+        LOOP = asyncio.get_event_loop()
+        CAMERA = FakeRcpTcpCamera(**KWARGS)
+        LOOP.run_until_complete(CAMERA.start(host=ARGS.bind_address, port=ARGS.bind_port))
+        print("======== Running on tcp://%s:%d ========" % (ARGS.bind_address, ARGS.bind_port))
+        try:
+            LOOP.run_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            LOOP.run_until_complete(CAMERA.stop())
+            LOOP.close()
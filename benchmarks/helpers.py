@@ -0,0 +1,105 @@
+""" Timing helpers shared by all benchmarks """
+
+
+# pylint: disable=line-too-long
+
+
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import configparser
+import aiohttp.web
+
+import main
+
+
+def summarize(name, samples, **extra):
+    """ Turn per-operation durations (seconds) into a result dict """
+
+    samples = sorted(samples)
+    total = sum(samples)
+    count = len(samples)
+    result = {
+        "name": name,
+        "iterations": count,
+        "total_s": total,
+        "mean_us": total / count * 1e6,
+        "p50_us": samples[count // 2] * 1e6,
+        "p99_us": samples[min(count - 1, int(count * 0.99))] * 1e6,
+        "ops_per_s": count / total if total else None,
+    }
+    result.update(extra)
+    return result
+
+
+def measure(name, func, iterations, **extra):
+    """ Time a synchronous callable, one sample per call """
+
+    samples = []
+    perf_counter = time.perf_counter
+    for _ in range(iterations):
+        start = perf_counter()
+        func()
+        samples.append(perf_counter() - start)
+    return summarize(name, samples, **extra)
+
+
+@asyncio.coroutine
+def measure_coroutine(name, coro_func, iterations, **extra):
+    """ Time a coroutine function, one sample per awaited call """
+
+    samples = []
+    perf_counter = time.perf_counter
+    for _ in range(iterations):
+        start = perf_counter()
+        yield from coro_func()
+        samples.append(perf_counter() - start)
+    return summarize(name, samples, **extra)
+
+
+def make_api_config(cams, project_root, context_path="/", lock_backend="memory", lock_path=None, fast_start=False, swagger_cache=None):  # pylint: disable=too-many-arguments
+    """ Build the configuration object main.py would give to ApiFactory """
+
+    config = argparse.Namespace(
+        context_path=context_path,
+        debug=False,
+        sync_logs=False,
+        move_log_interval_ms=1000,
+        server_timing=False,
+        allow_origin=None,
+        lock_backend=lock_backend,
+        lock_path=lock_path,
+        fast_start=fast_start,
+        swagger_cache=swagger_cache,
+        PROJECT_ROOT=project_root,
+    )
+    config.cams = cams
+    return config
+
+
+def make_cams_config(cams):
+    """
+    Parse cameras definitions the same way main.py does
+    :param cams: Dict mapping camera name to its INI options
+    """
+
+    parser = configparser.ConfigParser()
+    parser.read_dict(cams)
+    with tempfile.NamedTemporaryFile("w", suffix=".ini") as ini_file:
+        parser.write(ini_file)
+        ini_file.flush()
+        return main.parse_ini_config(ini_file.name)
+
+
+@asyncio.coroutine
+def start_api(factory):
+    """ Serve API on a random local port, return runner to clean up and API URL """
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(("127.0.0.1", 0))
+    runner = aiohttp.web.AppRunner(factory.app, access_log=None)
+    yield from runner.setup()
+    yield from aiohttp.web.SockSite(runner, sock).start()
+    return runner, "http://127.0.0.1:%d" % sock.getsockname()[1]
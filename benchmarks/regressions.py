@@ -0,0 +1,640 @@
+#!/usr/bin/python3
+
+
+# pylint: disable=line-too-long
+
+
+"""
+Behaviour checks against fake camera, run before benchmarks so figures
+are never measured on a known regression
+Each check raises AssertionError describing what went wrong
+"""
+
+
+import os
+import sys
+import time
+import tempfile
+import subprocess
+import logging
+import asyncio
+import aiohttp
+
+from api_factory import ApiFactory
+from resources import PtzMove
+from services import AsyncRcpClient, TokenBucket, PtzLockManager, MemoryLockBackend, SharedMemoryLockBackend, RcpHttpServiceUnavailableException, RcpHttpTooManyRequestsException, METRICS_REGISTRY, RCP_COMMANDS, register_command
+from services.ptz_lock_backends import PtzLock
+from services.async_rcp_client import RcpException, RcpTcpTransport, decode_int, decode_string
+from .fake_camera import FakeRcpCamera, FakeRcpTcpCamera
+from .helpers import make_api_config, make_cams_config, start_api
+
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+WS_FRAMES = 20
+WS_CAMERA_LATENCY = 0.05
+TIMED_STEP_MS = 100
+RATE_LIMIT = 10
+REFRESH_WINDOW = 0.1
+LOCK_TTL = 0.1
+POSITION_TTL = 0.1
+BREAKER_RESET_TIMEOUT = 0.1
+STOP_RETRY_BACKOFF = 0.03
+
+
+@asyncio.coroutine
+def _start(project_root, camera, **options):
+    """ Start fake camera and API serving it as camera "check", return (runner, API URL) """
+
+    port = yield from camera.start()
+    cam_options = {"url": "http://127.0.0.1:%d" % port, "refresh_window": "0", "keepalive_interval": "0", "prewarm_connections": "0"}
+    cam_options.update(options)
+    factory = ApiFactory(config=make_api_config(make_cams_config({"check": cam_options}), project_root))
+    return (yield from start_api(factory))
+
+
+@asyncio.coroutine
+def _start_client(camera, name, **options):
+    """ Start fake camera and return a RCP+ client of it, without background traffic unless options ask for it """
+
+    port = yield from camera.start()
+    params = {"name": name, "keepalive_interval": 0, "prewarm_connections": 0, "refresh_window": 0}
+    if isinstance(camera, FakeRcpTcpCamera):
+        params.update(url="http://127.0.0.1", transport="tcp", tcp_port=port)
+    else:
+        params["url"] = "http://127.0.0.1:%d" % port
+    params.update(options)
+    return AsyncRcpClient(**params)
+
+
+@asyncio.coroutine
+def _wait_for_stop(camera, timeout):
+    """ Wait until camera got a stop, return elapsed seconds """
+
+    loop = asyncio.get_event_loop()
+    start = loop.time()
+    while not (camera.moves and camera.moves[-1]["stop"]):
+        assert loop.time() - start < timeout, "Camera did not get stop within %ss" % timeout
+        yield from asyncio.sleep(0.005)
+    return loop.time() - start
+
+
+@asyncio.coroutine
+def check_pipeline_latest_wins(project_root):  # pylint: disable=unused-argument
+    """ Moves queued behind the one in flight are folded into the latest, every caller is answered and stop is never replaced """
+
+    camera = FakeRcpCamera(latency=WS_CAMERA_LATENCY)
+    client = yield from _start_client(camera, "check_latest_wins")
+    try:
+        moves = [asyncio.ensure_future(client.move_ptz(left=index % 7 + 1)) for index in range(10)]
+        yield from asyncio.wait_for(asyncio.gather(*moves), 1)
+        assert len(camera.moves) <= 2, "Camera got %d writes for 10 moves submitted at once, queued ones are not folded into latest one" % len(camera.moves)
+        assert camera.moves[-1]["left"] == 9 % 7 + 1, "Camera did not end on latest move but on %s" % camera.moves[-1]
+
+        moves = [asyncio.ensure_future(client.move_ptz(right=2)), asyncio.ensure_future(client.move_ptz(stop=True)), asyncio.ensure_future(client.move_ptz(right=3))]
+        yield from asyncio.wait_for(asyncio.gather(*moves), 1)
+        assert any(x["stop"] for x in camera.moves[-2:]), "Stop queued between moves was replaced by a newer move"
+        assert camera.moves[-1]["right"] == 3, "Move submitted after stop did not reach camera"
+        yield from client.move_ptz(stop=True)
+    finally:
+        yield from client.close()
+        yield from camera.stop()
+
+
+@asyncio.coroutine
+def check_redundant_writes_skipped(project_root):  # pylint: disable=unused-argument
+    """ Same move within refresh_window is skipped, resent once window expired, stops are always sent """
+
+    camera = FakeRcpCamera()
+    client = yield from _start_client(camera, "check_redundant", refresh_window=REFRESH_WINDOW)
+    try:
+        for _ in range(3):
+            yield from client.move_ptz(left=3)
+        assert len(camera.moves) == 1, "Camera got %d writes for the same move repeated within refresh_window" % len(camera.moves)
+        assert client.counters["writes_skipped"] == 2, "%d redundant write(s) counted instead of 2" % client.counters["writes_skipped"]
+
+        yield from asyncio.sleep(REFRESH_WINDOW * 1.5)
+        yield from client.move_ptz(left=3)
+        assert len(camera.moves) == 2, "Same move was not resent once refresh_window expired"
+
+        yield from client.move_ptz(left=2)
+        assert len(camera.moves) == 3, "Different move was skipped as redundant"
+
+        for _ in range(2):
+            yield from client.move_ptz(stop=True)
+        assert [x["stop"] for x in camera.moves[-2:]] == [True, True], "Repeated stop was skipped as redundant"
+    finally:
+        yield from client.close()
+        yield from camera.stop()
+
+
+@asyncio.coroutine
+def check_rcp_codecs(project_root):  # pylint: disable=unused-argument
+    """ Commands are immutable and registered once, payloads and TCP frames round trip, both transports decode replies the same way """
+
+    command = RCP_COMMANDS["ptz_position"]
+    try:
+        command.command = 0
+    except AttributeError:
+        pass
+    else:
+        raise AssertionError("Registered RcpCommand could be modified")
+    try:
+        register_command("ptz_position", 0x09A5, "P_OCTET", "READ")
+    except AssertionError:
+        pass
+    else:
+        raise AssertionError("RCP+ command name could be registered twice")
+
+    assert decode_string(RcpTcpTransport.encode_payload("P_STRING", "name")) == "name", "P_STRING payload does not round trip"
+    assert decode_int("T_DWORD")(RcpTcpTransport.encode_payload("T_DWORD", "70000")) == 70000, "T_DWORD payload does not round trip"
+
+    frame = RcpTcpTransport.encode_frame(0x09A5, "P_OCTET", "WRITE", RcpTcpTransport.ACTION_REPLY, session_id=42, num=3, payload=b"\x01\x02")
+    reader = asyncio.StreamReader()
+    reader.feed_data(frame)
+    decoded = yield from RcpTcpTransport.read_frame(reader)
+    assert decoded == (0x09A5, 0x01, RcpTcpTransport.ACTION_REPLY, 42, 3, b"\x01\x02"), "TCP frame does not round trip: %s" % (decoded,)
+
+    for camera in (FakeRcpCamera(), FakeRcpTcpCamera()):
+        transport = camera.__class__.__name__
+        client = yield from _start_client(camera, "check_codecs")
+        try:
+            yield from client.move_ptz(right=5, down=2, zout=1)
+            move = camera.moves[-1]
+            assert (move["right"], move["down"], move["zout"], move["stop"]) == (5, 2, 1, False), "%s: camera decoded move as %s" % (transport, move)
+            position = yield from client.execute("ptz_position")
+            assert sorted(position) == ["pan", "tilt", "zoom"] and position["zoom"] >= 1, "%s: position decoded as %s" % (transport, position)
+            yield from client.move_ptz(stop=True)
+        finally:
+            yield from client.close()
+            yield from camera.stop()
+
+
+@asyncio.coroutine
+def check_position_cache(project_root):  # pylint: disable=unused-argument
+    """ Concurrent position reads share one request, cached value is served within position_ttl and dropped by a preset recall """
+
+    camera = FakeRcpCamera(latency=0.02)
+    client = yield from _start_client(camera, "check_position", position_ttl=POSITION_TTL)
+    try:
+        readers = [asyncio.ensure_future(client.get_position()) for _ in range(3)]
+        # First caller gives up while read is in flight, others must still get it
+        yield from asyncio.sleep(0)
+        readers[0].cancel()
+        positions = yield from asyncio.gather(*readers[1:])
+        assert camera.requests_count == 1, "%d requests for concurrent position reads" % camera.requests_count
+        assert positions[0] == positions[1], "Concurrent position reads got different answers"
+
+        yield from client.get_position()
+        assert camera.requests_count == 1, "Position read within position_ttl was not served from cache"
+
+        yield from asyncio.sleep(POSITION_TTL * 1.5)
+        yield from client.get_position()
+        assert camera.requests_count == 2, "Position was not read again once position_ttl expired"
+
+        yield from client.recall_preset(1)
+        yield from client.get_position()
+        assert camera.requests_count == 4, "Position cached before a preset recall was served after it"
+    finally:
+        yield from client.close()
+        yield from camera.stop()
+
+
+@asyncio.coroutine
+def _wait_for_health(client, healthy, timeout):
+    """ Wait until client circuit breaker reports given health """
+
+    loop = asyncio.get_event_loop()
+    start = loop.time()
+    while client.health["healthy"] != healthy:
+        assert loop.time() - start < timeout, "Camera health did not become %s within %ss" % (healthy, timeout)
+        yield from asyncio.sleep(0.01)
+
+
+@asyncio.coroutine
+def check_circuit_breaker(project_root):  # pylint: disable=unused-argument
+    """ Consecutive camera failures open circuit, requests then fail fast until a probe finds camera back """
+
+    camera = FakeRcpCamera(error_rate=1)
+    client = yield from _start_client(camera, "check_breaker", breaker_failures=2, breaker_reset_timeout=BREAKER_RESET_TIMEOUT)
+    try:
+        for _ in range(2):
+            try:
+                yield from client.execute("ptz_position")
+            except RcpHttpServiceUnavailableException:
+                raise AssertionError("Circuit opened before breaker_failures consecutive failures")
+            except RcpException:
+                pass
+        assert client.health["state"] == "open", "Circuit is %s after breaker_failures consecutive failures" % client.health["state"]
+
+        requests_count = camera.requests_count
+        try:
+            yield from client.execute("ptz_position")
+        except RcpHttpServiceUnavailableException:
+            pass
+        else:
+            raise AssertionError("Request went through open circuit")
+        assert camera.requests_count == requests_count, "Request was sent to camera while circuit is open"
+
+        # Failed probe keeps circuit open, a successful one closes it
+        yield from asyncio.sleep(BREAKER_RESET_TIMEOUT * 1.5)
+        assert not client.health["healthy"], "Circuit closed while camera still fails"
+        camera.error_rate = 0
+        yield from _wait_for_health(client, True, BREAKER_RESET_TIMEOUT * 3)
+        yield from client.execute("ptz_position")
+    finally:
+        yield from client.close()
+        yield from camera.stop()
+
+
+@asyncio.coroutine
+def check_stop_delivery(project_root):  # pylint: disable=unused-argument
+    """ Stop is retried after camera failures, goes through open circuit and is hedged when camera is slow """
+
+    camera = FakeRcpCamera(error_rate=1)
+    client = yield from _start_client(camera, "check_stop", breaker_failures=1, breaker_reset_timeout=60, stop_retries=3, stop_retry_backoff=STOP_RETRY_BACKOFF)
+    try:
+        try:
+            yield from client.execute("ptz_position")
+        except RcpException:
+            pass
+        assert client.health["state"] == "open", "Circuit did not open on camera failure"
+
+        stop = asyncio.ensure_future(client.move_ptz(stop=True))
+        yield from asyncio.sleep(STOP_RETRY_BACKOFF * 1.5)
+        camera.error_rate = 0
+        yield from asyncio.wait_for(stop, 1)
+        assert camera.moves and camera.moves[-1]["stop"], "Stop was not retried after camera failures or was blocked by open circuit"
+        assert client._metric_stop_attempts["retry"].value >= 1, "Stop retries were not counted"  # pylint: disable=protected-access
+
+        camera.error_rate = 1
+        requests_count = camera.requests_count
+        try:
+            yield from client.move_ptz(stop=True)
+        except RcpException:
+            pass
+        else:
+            raise AssertionError("Stop failing more than stop_retries times did not raise")
+        assert camera.requests_count - requests_count == 3 + 1, "Camera got %d stop requests for stop_retries=3" % (camera.requests_count - requests_count)
+    finally:
+        yield from client.close()
+        yield from camera.stop()
+
+    camera = FakeRcpCamera(latency=0.1)
+    client = yield from _start_client(camera, "check_stop_hedge", stop_hedge_delay=0.02)
+    try:
+        yield from client.move_ptz(stop=True)
+        assert camera.requests_count == 2, "Slow stop was not hedged, camera got %d request(s)" % camera.requests_count
+    finally:
+        yield from client.close()
+        yield from camera.stop()
+
+
+@asyncio.coroutine
+def check_camera_config(project_root):  # pylint: disable=unused-argument
+    """ Camera options fall back on their profile then defaults, milliseconds are given in seconds, invalid options are refused """
+
+    cams = make_cams_config(
+        {"profile:slow": {"timeout_ms": "3000", "stop_retries": "5"}, "check": {"url": "http://127.0.0.1", "profile": "slow", "stop_retries": "1", "read_timeout_ms": "1500"}}
+    )
+    assert set(cams) == {"check"}, "Profiles were taken for cameras: %s" % sorted(cams)
+    params = cams["check"]
+    assert (params["timeout"], params["read_timeout"], params["stop_retries"]) == (3, 1.5, 1), "Camera options do not override profile ones: %s" % params
+    assert params["connect_timeout"] is None and params["stop_retry_backoff"] == 0.05, "Defaults not applied: %s" % params
+    yield from AsyncRcpClient(name="check_config", **params).close()
+
+    for options, error in (
+        ({"url": "http://127.0.0.1", "timeout": "1"}, "unknown option"),
+        ({"url": "http://127.0.0.1", "profile": "missing"}, "unknown profile"),
+        ({"url": "http://127.0.0.1", "timeout_ms": "fast"}, "must be an integer"),
+        ({"url": "http://127.0.0.1", "timeout_ms": "500", "connect_timeout_ms": "800"}, "not above timeout_ms"),
+        ({"url": "http://127.0.0.1", "prewarm_connections": "8", "pool_size": "4"}, "between 0 and pool_size"),
+        ({"url": "ftp://127.0.0.1"}, "http(s) URL"),
+        ({"url": "http://127.0.0.1", "rate_limit_mode": "drop"}, "rate_limit_mode"),
+    ):
+        try:
+            make_cams_config({"check": options})
+        except ValueError as exc:
+            assert error in str(exc), "Invalid options %s refused with unexpected error: %s" % (options, exc)
+        else:
+            raise AssertionError("Invalid camera options were accepted: %s" % options)
+
+
+@asyncio.coroutine
+def check_websocket_latest_wins(project_root):
+    """ Burst of WebSocket frames then a stop: frames are folded into the latest one and stop is not delayed by the burst """
+
+    camera = FakeRcpCamera(latency=WS_CAMERA_LATENCY)
+    runner, api_url = yield from _start(project_root, camera)
+    session = aiohttp.ClientSession()
+    try:
+        ws = yield from session.ws_connect(api_url + "/cams/check/ptz/move/ws")
+        for index in range(WS_FRAMES):
+            yield from ws.send_str("%d,0,0,0,0,0,0" % (index % 7 + 1))
+        yield from ws.send_str("0,0,0,0,0,0,1")
+
+        elapsed = yield from _wait_for_stop(camera, WS_FRAMES * WS_CAMERA_LATENCY * 2)
+        assert len(camera.moves) <= 4, "Camera got %d writes for %d WebSocket frames and a stop, frames are not folded into latest one" % (len(camera.moves), WS_FRAMES)
+        assert elapsed < WS_CAMERA_LATENCY * 4, "Stop reached camera %d ms after WebSocket burst" % (elapsed * 1000)
+        # Early stop may land first, let queued one complete before closing
+        yield from runner.app["rcp_services"]["check"].drain(1)
+        yield from ws.close()
+    finally:
+        yield from session.close()
+        yield from runner.cleanup()
+        yield from camera.stop()
+
+
+@asyncio.coroutine
+def _move_once_free(app, ptz_move, args):
+    """ Move as soon as camera lock is free, within the loop iteration releasing it """
+
+    while ptz_move.locked:
+        yield from asyncio.sleep(0)
+    return (yield from ptz_move.move(app, args))
+
+
+@asyncio.coroutine
+def check_websocket_close_keeps_lock_until_stopped(project_root):
+    """ Lock of a closed WebSocket is released once its stop is sent, stop can not halt the move of next owner """
+
+    camera = FakeRcpCamera(latency=WS_CAMERA_LATENCY)
+    runner, api_url = yield from _start(project_root, camera)
+    session = aiohttp.ClientSession()
+    try:
+        ptz_move = runner.app["ptz_moves"]["check"]
+        ws = yield from session.ws_connect(api_url + "/cams/check/ptz/move/ws")
+        yield from ws.send_str("3,0,0,0,0,0,0")
+        while not camera.moves:
+            yield from asyncio.sleep(0.005)
+        args = dict.fromkeys(PtzMove.MOVE_KEYS, 0)
+        args["right"] = 2
+        next_owner = asyncio.ensure_future(_move_once_free(runner.app, ptz_move, args))
+        yield from ws.close()
+
+        _, status = yield from asyncio.wait_for(next_owner, 1)
+        assert status == 200, "Next owner got HTTP %d after WebSocket close" % status
+        yield from runner.app["rcp_services"]["check"].drain(1)
+        assert camera.moves[-1]["right"] == 2, "Stop of closed WebSocket halted move of next lock owner"
+        yield from ptz_move.move(runner.app, dict(args, right=0, stop=1), ptz_move.locked)
+    finally:
+        yield from session.close()
+        yield from runner.cleanup()
+        yield from camera.stop()
+
+
+@asyncio.coroutine
+def check_timed_move_stopped_by_other_worker(project_root):
+    """ Stop handled by another worker (shared lock) drops remaining steps of a timed move """
+
+    camera = FakeRcpCamera()
+    runner, _ = yield from _start(project_root, camera)
+    lock_dir = tempfile.TemporaryDirectory()
+    lock_managers = [PtzLockManager(backend=SharedMemoryLockBackend(os.path.join(lock_dir.name, "ptz.locks"))) for _ in range(2)]
+    try:
+        first, second = (PtzMove("check", lock_manager=x) for x in lock_managers)
+        steps = [(dict(left=3, right=0, up=0, down=0, zin=0, zout=0), TIMED_STEP_MS), (dict(left=0, right=3, up=0, down=0, zin=0, zout=0), TIMED_STEP_MS)]
+        payload, _ = yield from first.move_sequence(runner.app, steps)
+        args = dict.fromkeys(PtzMove.MOVE_KEYS, 0)
+        args["stop"] = 1
+        _, status = yield from second.move(runner.app, args, payload["lock_token"])
+        assert status == 200, "Stop from lock owner got HTTP %d on other worker" % status
+
+        yield from asyncio.sleep(TIMED_STEP_MS * 3 / 1000)
+        assert [move["stop"] for move in camera.moves] == [False, True], "Camera got %d writes after timed move was stopped by other worker, remaining steps were not dropped" % (len(camera.moves) - 2)
+    finally:
+        for lock_manager in lock_managers:
+            lock_manager.close()
+        lock_dir.cleanup()
+        yield from runner.cleanup()
+        yield from camera.stop()
+
+
+@asyncio.coroutine
+def check_timed_move_with_stop_rejected(project_root):
+    """ stop=1 sent along duration_ms or sequence is refused instead of being dropped """
+
+    camera = FakeRcpCamera()
+    runner, api_url = yield from _start(project_root, camera)
+    session = aiohttp.ClientSession()
+    try:
+        for query in ("right=2&duration_ms=%d&stop=1" % TIMED_STEP_MS, "sequence=0,2,0,0,0,0,%d&stop=1" % TIMED_STEP_MS):
+            response = yield from session.get(api_url + "/cams/check/ptz/move?" + query)
+            assert response.status == 400, "Timed move with stop=1 (%s) got HTTP %d" % (query, response.status)
+        assert not camera.moves, "Camera moved for a timed move sent with stop=1"
+    finally:
+        yield from session.close()
+        yield from runner.cleanup()
+        yield from camera.stop()
+
+
+@asyncio.coroutine
+def check_lock_expiry(project_root):  # pylint: disable=unused-argument
+    """ Renewed lock outlives its ttl, an idle one is dropped by the sweep, a lock without ttl never expires """
+
+    lock_manager = PtzLockManager(resolution=LOCK_TTL / 5)
+    try:
+        token = lock_manager.acquire("check", ttl=LOCK_TTL)
+        for _ in range(3):
+            yield from asyncio.sleep(LOCK_TTL * 0.6)
+            assert lock_manager.renew("check", token), "Lock expired while being renewed"
+        assert lock_manager.owner("check") == token, "Renewed lock did not outlive its ttl"
+
+        yield from asyncio.sleep(LOCK_TTL * 2)
+        assert "check" not in lock_manager.backend.locks, "Idle lock was not dropped by expiry sweep"
+        assert lock_manager.acquire("check", ttl=LOCK_TTL) is not None, "Camera could not be locked again after expiry"
+        lock_manager.release("check")
+
+        token = lock_manager.acquire("check")
+        yield from asyncio.sleep(LOCK_TTL * 2)
+        assert lock_manager.owner("check") == token, "Lock without ttl expired"
+        assert lock_manager.acquire("check", ttl=LOCK_TTL) is None, "Locked camera was locked again"
+    finally:
+        lock_manager.close()
+
+
+@asyncio.coroutine
+def check_lock_backends(project_root):  # pylint: disable=unused-argument
+    """ Both backends follow the same lock rules, shared memory one shares locks between processes and drops those of dead ones """
+
+    lock_dir = tempfile.TemporaryDirectory()
+    lock_path = os.path.join(lock_dir.name, "ptz.locks")
+    lock_managers = [PtzLockManager(backend=MemoryLockBackend()), PtzLockManager(backend=SharedMemoryLockBackend(lock_path))]
+    try:
+        for lock_manager in lock_managers:
+            name = lock_manager.backend.__class__.__name__
+            token = lock_manager.acquire("check", ttl=LOCK_TTL)
+            assert lock_manager.acquire("check", ttl=LOCK_TTL) is None, "%s: locked camera was locked again" % name
+            lock_manager.release("check", "WRONGTOK")
+            assert lock_manager.owner("check") == token, "%s: lock released with a wrong token" % name
+            lock_manager.release("check", token)
+            assert lock_manager.owner("check") is None, "%s: lock not released with its token" % name
+
+        # Another worker sees locks through its own mapping of the same file
+        other = PtzLockManager(backend=SharedMemoryLockBackend(lock_path))
+        lock_managers.append(other)
+        token = lock_managers[1].acquire("check")
+        assert other.owner("check") == token, "Lock taken by a worker is not seen by another one"
+        lock_managers[1].release("check", token)
+
+        dead = subprocess.Popen(["true"])
+        dead.wait()
+        with other.backend.transaction():
+            other.backend.put("check", PtzLock("DEADPROC", None, None, time.monotonic(), dead.pid))
+        assert lock_managers[1].owner("check") is None, "Lock without ttl of a dead worker was not dropped"
+    finally:
+        for lock_manager in lock_managers:
+            lock_manager.close()
+        lock_dir.cleanup()
+
+
+@asyncio.coroutine
+def check_stale_lock_renew_rejected(project_root):  # pylint: disable=unused-argument
+    """ Token of an expired lock can not renew the lock another worker took since, nor move camera """
+
+    lock_dir = tempfile.TemporaryDirectory()
+    lock_managers = [PtzLockManager(backend=SharedMemoryLockBackend(os.path.join(lock_dir.name, "ptz.locks"))) for _ in range(2)]
+    try:
+        stale = lock_managers[0].acquire("check", ttl=0.05)
+        yield from asyncio.sleep(0.1)
+        owner = lock_managers[1].acquire("check", ttl=0.2)
+        assert owner is not None, "Expired lock was not taken over by other worker"
+        expires_in = lock_managers[1].state()["check"]["expires_in_seconds"]
+
+        assert lock_managers[0].renew("check", stale) is False, "Expired token renewed lock of its new owner"
+        assert lock_managers[1].state()["check"]["expires_in_seconds"] <= expires_in, "Expired token pushed back deadline of new owner"
+        ptz_move = PtzMove("check", lock_manager=lock_managers[0])
+        assert ptz_move.claim_lock(stale) == (None, False), "Expired token was accepted by claim_lock"
+        assert lock_managers[1].renew("check", owner) is True, "Lock owner could not renew its lock"
+    finally:
+        for lock_manager in lock_managers:
+            lock_manager.close()
+        lock_dir.cleanup()
+
+
+@asyncio.coroutine
+def check_rate_limit_coalesce(project_root):  # pylint: disable=unused-argument
+    """ Bucket allows bursts then one write per token, moves over limit are folded into latest one and stops are never delayed """
+
+    bucket = TokenBucket(RATE_LIMIT, burst=2)
+    assert [bucket.take() for _ in range(3)] == [True, True, False], "Token bucket does not allow exactly its burst"
+    assert 0 < bucket.wait_time() <= 1 / RATE_LIMIT, "Token bucket wait time %.3f s does not match its rate" % bucket.wait_time()
+
+    camera = FakeRcpCamera()
+    client = yield from _start_client(camera, "check_rate_limit", rate_limit=RATE_LIMIT, rate_limit_burst=1, rate_limit_mode="coalesce")
+    try:
+        loop = asyncio.get_event_loop()
+        yield from client.move_ptz(left=1)
+        start = loop.time()
+        yield from asyncio.gather(*[client.move_ptz(left=x) for x in range(2, 7)])
+        assert loop.time() - start >= 0.5 / RATE_LIMIT, "Moves over rate limit were not delayed"
+        assert [x["left"] for x in camera.moves] == [1, 6], "Moves over rate limit were not folded into latest one: %s" % camera.moves
+
+        move = asyncio.ensure_future(client.move_ptz(right=2))
+        yield from asyncio.sleep(0)
+        start = loop.time()
+        yield from client.move_ptz(stop=True)
+        yield from move
+        assert loop.time() - start < 0.5 / RATE_LIMIT, "Stop waited for rate limiter"
+        assert camera.moves[-1]["stop"] and all(x["right"] != 2 for x in camera.moves), "Move waiting for a token was sent after stop"
+    finally:
+        yield from client.close()
+        yield from camera.stop()
+
+
+@asyncio.coroutine
+def check_rate_limited_move_retried(project_root):
+    """ Move rejected by rate limiter is sent when retried, not skipped as redundant """
+
+    camera = FakeRcpCamera()
+    runner, _ = yield from _start(project_root, camera, refresh_window="5", rate_limit=str(RATE_LIMIT), rate_limit_burst="1", rate_limit_mode="reject")
+    try:
+        rcp_service = runner.app["rcp_services"]["check"]
+        yield from rcp_service.move_ptz(left=3)
+        try:
+            yield from rcp_service.move_ptz(right=2)
+        except RcpHttpTooManyRequestsException:
+            pass
+        else:
+            raise AssertionError("Move right after a burst of 1 was not rejected by rate limiter")
+
+        yield from asyncio.sleep(1.5 / RATE_LIMIT)
+        yield from rcp_service.move_ptz(right=2)
+        assert camera.moves[-1]["right"] == 2, "Move retried after HTTP 429 was skipped as redundant and never reached camera"
+        yield from rcp_service.move_ptz(stop=True)
+    finally:
+        yield from runner.cleanup()
+        yield from camera.stop()
+
+
+@asyncio.coroutine
+def check_removed_camera_metrics_dropped(project_root):
+    """ Metrics series of a camera removed by a reload are dropped, those of other cameras are kept """
+
+    camera = FakeRcpCamera()
+    port = yield from camera.start()
+    cam_options = {"url": "http://127.0.0.1:%d" % port, "refresh_window": "0", "keepalive_interval": "0", "prewarm_connections": "0"}
+    cams = make_cams_config({"removed": cam_options, "kept": cam_options})
+    factory = ApiFactory(config=make_api_config(cams, project_root), load_cams=lambda: make_cams_config({"kept": cam_options}))
+    runner, _ = yield from start_api(factory)
+    try:
+        for cam in ("removed", "kept"):
+            ptz_move = runner.app["ptz_moves"][cam]
+            args = dict.fromkeys(PtzMove.MOVE_KEYS, 0)
+            args["left"] = 3
+            payload, _ = yield from ptz_move.move(runner.app, args)
+            yield from ptz_move.move(runner.app, dict(args, left=0, stop=1), payload["lock_token"])
+        assert 'camera="removed"' in METRICS_REGISTRY.render(), "No metrics series recorded for camera"
+
+        yield from factory.reload_cams()
+        metrics = METRICS_REGISTRY.render()
+        assert 'camera="removed"' not in metrics, "Metrics series of removed camera are still exposed"
+        assert 'camera="kept"' in metrics, "Metrics series of kept camera were dropped"
+    finally:
+        yield from runner.cleanup()
+        yield from camera.stop()
+
+
+CHECKS = (
+    check_pipeline_latest_wins,
+    check_websocket_latest_wins,
+    check_redundant_writes_skipped,
+    check_rcp_codecs,
+    check_position_cache,
+    check_circuit_breaker,
+    check_stop_delivery,
+    check_camera_config,
+    check_websocket_close_keeps_lock_until_stopped,
+    check_timed_move_stopped_by_other_worker,
+    check_timed_move_with_stop_rejected,
+    check_lock_expiry,
+    check_lock_backends,
+    check_stale_lock_renew_rejected,
+    check_rate_limit_coalesce,
+    check_rate_limited_move_retried,
+    check_removed_camera_metrics_dropped,
+)
+
+
+@asyncio.coroutine
+def run(project_root):
+    """ Run all checks, first failure raises AssertionError """
+
+    for check in CHECKS:
+        yield from check(project_root)
+
+
+def main():
+    """ Run checks from command line, exit status tells if they passed """
+
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)-8s [%(name)s] %(message)s", stream=sys.stdout)
+    try:
+        asyncio.get_event_loop().run_until_complete(run(PROJECT_ROOT))
+    except AssertionError as exc:
+        print("Regression: %s" % exc)
+        sys.exit(1)
+    print("%d check(s) passed" % len(CHECKS))
+
+
+if __name__ == "__main__":
+    main()
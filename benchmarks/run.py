@@ -0,0 +1,80 @@
+#!/usr/bin/python3
+
+
+# pylint: disable=line-too-long
+
+
+"""
+Run all benchmarks and write results to a JSON file
+so figures can be compared between releases
+"""
+
+
+import os
+import sys
+import json
+import time
+import logging
+import asyncio
+import argparse
+import platform
+import aiohttp
+
+from . import regressions, bench_rcp_client, bench_ptz_lock, bench_middleware, bench_json, bench_round_trip, bench_startup
+
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+
+def get_arguments_from_cmd_line():
+    """ Handle command line arguments """
+
+    parser = argparse.ArgumentParser(description="Bosch Dome RCP+ PTZ API benchmarks", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("-n", "--iterations", type=int, default=2000, help="Number of iterations of each benchmark")
+    parser.add_argument("-o", "--output", type=str, default=os.path.join(PROJECT_ROOT, "bench_results.json"), help="Path to JSON results file")
+    return parser.parse_args()
+
+
+@asyncio.coroutine
+def run_all(iterations):
+    """ Run regression checks, then all benchmarks sequentially """
+
+    yield from regressions.run(PROJECT_ROOT)
+
+    results = []
+    results.extend((yield from bench_rcp_client.run(iterations)))
+    results.extend((yield from bench_ptz_lock.run(iterations)))
+    results.extend((yield from bench_middleware.run(iterations)))
+    results.extend(bench_json.run(iterations))
+    results.extend((yield from bench_round_trip.run(iterations, PROJECT_ROOT)))
+    results.extend(bench_startup.run(iterations, PROJECT_ROOT))
+    return results
+
+
+def main():
+    """ Run benchmarks, print a summary and dump JSON results """
+
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)-8s [%(name)s] %(message)s", stream=sys.stdout)
+    args = get_arguments_from_cmd_line()
+
+    loop = asyncio.get_event_loop()
+    results = loop.run_until_complete(run_all(args.iterations))
+
+    for result in results:
+        print("%-40s %10.1f us/op  p99 %10.1f us  %12.0f ops/s" % (result["name"], result["mean_us"], result["p99_us"], result["ops_per_s"]))
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "aiohttp": aiohttp.__version__,
+        "platform": platform.platform(),
+        "iterations": args.iterations,
+        "results": results,
+    }
+    with open(args.output, "w") as output:
+        json.dump(report, output, indent=2, sort_keys=True)
+    print("Results written to %s" % args.output)
+
+
+if __name__ == "__main__":
+    main()
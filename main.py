@@ -11,14 +11,25 @@ Main file to run Bosch Dome RCP+ PTZ API
 
 import sys
 import os
+import time
+import queue
+import atexit
+import signal
 import shutil
+import tempfile
 import logging
+import logging.handlers
 import argparse
+import functools
+import collections
 import configparser
+import urllib.parse
 import aiohttp.web
 import setproctitle
 
 from api_factory import ApiFactory
+from services.async_rcp_client import TRANSPORTS, RATE_LIMIT_MODES
+from services.ptz_lock_backends import LOCK_BACKENDS
 
 
 PROJECT_ROOT = os.path.abspath(os.path.join(__file__, os.pardir))
@@ -40,15 +51,45 @@ def set_process_name(config_obj=None):
     setproctitle.setproctitle("%s-%s %s" % (artifact_id, version, cli_args))  # pylint: disable=maybe-no-member,c-extension-no-member
 
 
-def configure_root_logger(level=logging.INFO):
-    """ Override root logger to use a better formatter """
+LOG_LISTENER = None
+
+
+def configure_root_logger(level=logging.INFO, queued=True):
+    """
+    Override root logger to use a better formatter
+    When queued, records are only put in a queue by the event loop thread and written to stdout by a listener thread
+    Call it again in forked processes as listener thread does not survive fork
+    """
+    global LOG_LISTENER  # pylint: disable=global-statement
 
     if os.getenv("NO_LOGS_TS", None) is None:
         formatter = "%(asctime)s %(levelname)-8s [%(name)s] %(message)s"
     else:
         formatter = "%(levelname)-8s [%(name)s] %(message)s"
 
-    logging.basicConfig(level=level, format=formatter, stream=sys.stdout)
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter(formatter))
+
+    if queued:
+        records = queue.Queue(-1)
+        LOG_LISTENER = logging.handlers.QueueListener(records, handler)
+        LOG_LISTENER.start()
+        handler = logging.handlers.QueueHandler(records)
+    else:
+        LOG_LISTENER = None
+
+    root_logger = logging.getLogger()
+    for previous in list(root_logger.handlers):
+        root_logger.removeHandler(previous)
+    root_logger.addHandler(handler)
+    root_logger.setLevel(level)
+
+
+def stop_root_logger():
+    """ Write records left in queue and stop listener thread """
+
+    if LOG_LISTENER is not None:
+        LOG_LISTENER.stop()
 
 
 def get_arguments_from_cmd_line():
@@ -65,56 +106,304 @@ def get_arguments_from_cmd_line():
     parser.add_argument("-b", "--bind-address", type=str, default="::1", help="Address to bind on", metavar="0.0.0.0")
     parser.add_argument("-p", "--bind-port", type=int, default=5000, help="Port to bind on", metavar=8877)
 
+    parser.add_argument("-w", "--workers", type=int, default=1, help="Number of worker processes sharing bind port using SO_REUSEPORT")
+
     parser.add_argument("-c", "--context-path", type=str, default="/", help="Text to be used as prefix URL")
     parser.add_argument("-d", "--debug", action="store_true", help="Put loggers in DEBUG level")
+    parser.add_argument("--sync-logs", action="store_true", help="Write logs from event loop thread instead of a background thread")
+    parser.add_argument("--server-timing", action="store_true", help="Return time spent in each phase of PTZ moves (lock, queue, connection, camera) in Server-Timing header")
+    parser.add_argument("--move-log-interval-ms", type=int, default=1000, help="Log PTZ moves of a camera at most once per interval, 0 logs every move")
     parser.add_argument("-o", "--allow-origin", type=str, help="Allow to restrict the API access to the given URL or domain only")
 
+    parser.add_argument(
+        "--lock-backend", type=str, choices=sorted(LOCK_BACKENDS), default="memory", help="Where PTZ locks are stored, shm shares them between processes on this host"
+    )
+    parser.add_argument(
+        "--lock-path", type=str, default=os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "bosch-dome-rcpplus-ptz-locks"), help="File used by shm lock backend"
+    )
+
+    parser.add_argument("--fast-start", action="store_true", help="Cache API spec built from handlers docstrings and only import SwaggerUI dependencies to build it again")
+    parser.add_argument(
+        "--swagger-cache", type=str, default=os.path.join(tempfile.gettempdir(), "bosch-dome-rcpplus-ptz-swagger.json"), help="File caching API spec in fast start mode"
+    )
+
     parser.add_argument(
         "-f", "--config-file", type=str, default=os.path.join(PROJECT_ROOT, "config.ini"), help="Path to INI configuration file defining cameras"
     )
 
     parsed = parser.parse_args()
+    if parsed.workers < 1:
+        parser.error("--workers must be at least 1")
+    if parsed.move_log_interval_ms < 0:
+        parser.error("--move-log-interval-ms must be positive or 0")
     if parsed.context_path != "/":
         parsed.context_path = "/" + parsed.context_path.strip("/") + "/"
 
-    parsed.cams = parse_ini_config(parsed.config_file)
+    try:
+        parsed.cams = parse_ini_config(parsed.config_file)
+    except ValueError as exc:
+        parser.error("invalid configuration file %s: %s" % (parsed.config_file, exc))
     parsed.PROJECT_ROOT = PROJECT_ROOT
 
     return parsed
 
 
+PROFILE_PREFIX = "profile:"
+
+# INI option: (ConfigParser getter, fallback), options ending with _ms are given to AsyncRcpClient in seconds without suffix
+CAMERA_OPTIONS = collections.OrderedDict(
+    (
+        ("url", ("get", None)),
+        ("username", ("get", None)),
+        ("password", ("get", None)),
+        ("transport", ("get", "http")),
+        ("tcp_port", ("getint", 1756)),
+        ("timeout_ms", ("getint", 1000)),
+        ("connect_timeout_ms", ("getint", None)),
+        ("read_timeout_ms", ("getint", None)),
+        ("pool_size", ("getint", 4)),
+        ("keepalive_timeout", ("getfloat", 30)),
+        ("keepalive_interval", ("getfloat", 10)),
+        ("prewarm_connections", ("getint", 1)),
+        ("refresh_window", ("getfloat", 1)),
+        ("position_ttl", ("getfloat", 0.5)),
+        ("breaker_failures", ("getint", 3)),
+        ("breaker_reset_timeout", ("getfloat", 5)),
+        ("stop_retries", ("getint", 3)),
+        ("stop_retry_backoff_ms", ("getint", 50)),
+        ("stop_hedge_delay_ms", ("getint", 0)),
+        ("rate_limit", ("getfloat", 0)),
+        ("rate_limit_burst", ("getint", 5)),
+        ("rate_limit_mode", ("get", "coalesce")),
+    )
+)
+
+
+def validate_camera_config(params):
+    """ Check camera options read from INI file, raise ValueError describing first invalid one """
+
+    if not params["url"] or urllib.parse.urlparse(params["url"]).scheme not in ("http", "https"):
+        raise ValueError("url must be an http(s) URL")
+    if (params["username"] is None) != (params["password"] is None):
+        raise ValueError("username and password must be specified or none of them")
+    if params["transport"] not in TRANSPORTS:
+        raise ValueError("transport must be one of %s" % ", ".join(sorted(TRANSPORTS)))
+    if not 0 < params["tcp_port"] < 65536:
+        raise ValueError("tcp_port must be a valid TCP port")
+    if params["rate_limit_mode"] not in RATE_LIMIT_MODES:
+        raise ValueError("rate_limit_mode must be one of %s" % ", ".join(RATE_LIMIT_MODES))
+    for option in ("timeout_ms", "pool_size", "breaker_failures", "keepalive_timeout", "breaker_reset_timeout", "rate_limit_burst"):
+        if params[option] <= 0:
+            raise ValueError("%s must be strictly positive" % option)
+    for option in ("connect_timeout_ms", "read_timeout_ms"):
+        if params[option] is not None and not 0 < params[option] <= params["timeout_ms"]:
+            raise ValueError("%s must be strictly positive and not above timeout_ms (%d)" % (option, params["timeout_ms"]))
+    for option in ("keepalive_interval", "refresh_window", "position_ttl", "stop_retries", "stop_retry_backoff_ms", "stop_hedge_delay_ms", "rate_limit"):
+        if params[option] < 0:
+            raise ValueError("%s must be positive or 0 to disable" % option)
+    if not 0 <= params["prewarm_connections"] <= params["pool_size"]:
+        raise ValueError("prewarm_connections must be between 0 and pool_size (%d)" % params["pool_size"])
+
+
 def parse_ini_config(filepath):
     """
     Parse INI file containing cameras definitions
+    Options are looked up in camera section, then in section [profile:<name>] given by its profile option.
+    Return AsyncRcpClient arguments of each camera, raise ValueError if a camera is misconfigured
     """
 
     parser = configparser.ConfigParser()
-    parser.read(filepath)
+    try:
+        parser.read(filepath)
+    except configparser.Error as exc:
+        raise ValueError(str(exc)) from None
+
+    profiles = [x[len(PROFILE_PREFIX):] for x in parser.sections() if x.startswith(PROFILE_PREFIX)]
 
     cams = {}
     for cam in parser.sections():
-        cams[cam] = {
-            "url": parser.get(cam, "url"),
-            "username": parser.get(cam, "username", fallback=None),
-            "password": parser.get(cam, "password", fallback=None),
-        }
+        if cam.startswith(PROFILE_PREFIX):
+            continue
+
+        sections = [cam]
+        profile = parser.get(cam, "profile", fallback=None)
+        if profile is not None:
+            if profile not in profiles:
+                raise ValueError("Camera %s: unknown profile %s (defined: %s)" % (cam, profile, ", ".join(profiles) or "none"))
+            sections.append(PROFILE_PREFIX + profile)
+
+        for section in sections:
+            unknown = set(parser.options(section)) - set(CAMERA_OPTIONS) - {"profile"}
+            if unknown:
+                raise ValueError("Section %s: unknown option(s) %s" % (section, ", ".join(sorted(unknown))))
+
+        params = {}
+        for option, (getter, fallback) in CAMERA_OPTIONS.items():
+            section = next((x for x in sections if parser.has_option(x, option)), None)
+            try:
+                params[option] = getattr(parser, getter)(section, option) if section is not None else fallback
+            except ValueError:
+                raise ValueError("Section %s: %s must be %s" % (section, option, "an integer" if getter == "getint" else "a number")) from None
+            except configparser.Error as exc:
+                raise ValueError("Section %s: %s" % (section, exc)) from None
+        try:
+            validate_camera_config(params)
+        except ValueError as exc:
+            raise ValueError("Camera %s: %s" % (cam, exc)) from None
+
+        cams[cam] = {}
+        for option, value in params.items():
+            if option.endswith("_ms"):
+                option, value = option[: -len("_ms")], value / 1000 if value is not None else None
+            cams[cam][option] = value
 
     return cams
 
 
-def create_api():
-    """ Setup app for both command line and Gunicorn run """
+def configure_logging(config, supervisor=False):
+    """
+    Setup root logger according to command line
+    Workers supervisor runs no event loop and forks, its logs are written synchronously
+    """
 
-    config = get_arguments_from_cmd_line()
     log_level = logging.DEBUG if config.debug else logging.INFO
-    configure_root_logger(level=log_level)
+    configure_root_logger(level=log_level, queued=not (config.sync_logs or supervisor))
+
+
+def configure():
+    """ Parse command line, setup logging and process name """
+
+    config = get_arguments_from_cmd_line()
+    configure_logging(config, supervisor=config.workers > 1)
+    atexit.register(stop_root_logger)
     set_process_name(config_obj=config)
-    return ApiFactory(config=config)
 
+    if config.workers > 1 and config.lock_backend != "shm":
+        logging.getLogger("main").warning("PTZ locks must be shared by %d workers, using shm lock backend", config.workers)
+        config.lock_backend = "shm"
 
-if __name__ == "__main__":
+    return config
+
+
+def create_api(config=None):
+    """ Setup app for both command line and Gunicorn run """
+
+    if config is None:
+        config = configure()
+    return ApiFactory(config=config, load_cams=functools.partial(parse_ini_config, config.config_file))
 
-    API = create_api()
+
+def run_api(config):
+    """ Build API and serve it until SIGINT/SIGTERM """
+
+    api = create_api(config)
     aiohttp.web.run_app(
-        API.app, host=API.config.bind_address, port=API.config.bind_port, access_log_format="%s %r [status:%s request:%Tfs bytes:%bb]"
+        api.app,
+        host=api.config.bind_address,
+        port=api.config.bind_port,
+        access_log_format="%s %r [status:%s request:%Tfs bytes:%bb]",
+        reuse_port=api.config.workers > 1,
     )
+
+
+class WorkersSupervisor(object):
+    """
+    Fork workers all bound on the same address using SO_REUSEPORT,
+    restart them when they die, forward SIGINT/SIGTERM on shutdown and SIGHUP to reload cameras
+    """
+
+    RESTART_DELAY = 1
+
+    def __init__(self, config):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.config = config
+        self.workers = {}
+        self.stopping = False
+
+    def spawn(self, index):
+        """ Fork one worker, child never returns """
+
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            # Reload sent while worker starts must not kill it, loop handler is installed on startup
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            configure_logging(self.config)
+            exit_code = 0
+            try:
+                run_api(self.config)
+            except Exception:  # pylint: disable=broad-except
+                logging.getLogger("Worker-%d" % index).exception("Worker crashed")
+                exit_code = 1
+            finally:
+                stop_root_logger()
+                logging.shutdown()
+            os._exit(exit_code)  # pylint: disable=protected-access
+
+        self.workers[pid] = index
+        self.logger.info("Started worker %d with pid %d", index, pid)
+
+    def stop(self, signum, _):
+        """ Signal handler forwarding shutdown to all workers """
+
+        self.logger.info("Received signal %d, stopping %d worker(s)", signum, len(self.workers))
+        self.stopping = True
+        for pid in self.workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def reload(self, signum, _):
+        """
+        Signal handler forwarding cameras reload to all workers,
+        definitions are reloaded here too so restarted workers get them
+        """
+
+        self.logger.info("Received signal %d, reloading cameras on %d worker(s)", signum, len(self.workers))
+        try:
+            self.config.cams = parse_ini_config(self.config.config_file)
+        except ValueError as exc:
+            self.logger.error("Unable to reload cameras, keeping running configuration: %s", exc)
+            return
+        for pid in self.workers:
+            try:
+                os.kill(pid, signal.SIGHUP)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        """ Start workers and supervise them until all are stopped """
+
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGHUP, self.reload)
+
+        for index in range(self.config.workers):
+            self.spawn(index)
+
+        while self.workers:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            index = self.workers.pop(pid, None)
+            if index is None:
+                continue
+            if self.stopping:
+                self.logger.info("Worker %d (pid %d) stopped", index, pid)
+                continue
+            self.logger.warning("Worker %d (pid %d) died with wait status %d, restarting", index, pid, status)
+            time.sleep(self.RESTART_DELAY)
+            if not self.stopping:
+                self.spawn(index)
+
+
+if __name__ == "__main__":
+
+    CONFIG = configure()
+    if CONFIG.workers > 1:
+        WorkersSupervisor(CONFIG).run()
+    else:
+        run_api(CONFIG)
@@ -3,4 +3,13 @@ Relative import of all resources
 """
 
 from .ptz_move import PtzMove
+from .ptz_batch_move import PtzBatchMove
+from .ptz_locks import PtzLocks
+from .ptz_position import PtzPosition
+from .ptz_preset import PtzPreset
 from .interface_ptz_move import InterfacePtzMove
+from .static_files import StaticFiles, CachedAsset
+from .metrics import Metrics
+from .health import Health
+from .config_reload import ConfigReload
+from .profiler import Profiler
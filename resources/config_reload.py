@@ -0,0 +1,85 @@
+""" Reload cameras definitions without restarting """
+
+
+# pylint: disable=line-too-long
+
+
+import os
+import signal
+import asyncio
+
+from api_json import json_response
+
+
+class ConfigReload(object):  # pylint: disable=too-few-public-methods
+    """ Reload cameras definitions without restarting """
+
+    @asyncio.coroutine
+    def post(self, request):
+        """
+        ---
+        description: Load INI file again and apply differences only, same as sending SIGHUP. New cameras are started, removed ones are stopped, drained and closed, changed ones get a new RCP+ client (WebSockets are closed, token locks are kept). Unchanged cameras keep their locks and connections. With several workers reload is forwarded to all of them and answered with 202 right away.
+        produces:
+        - application/json
+        tags:
+        - admin
+        responses:
+            200:
+                description: Configuration reloaded
+                schema:
+                    title: Reload_Success
+                    type: object
+                    required:
+                        - status
+                        - message
+                        - cameras
+                    properties:
+                        message:
+                            type: string
+                            description: Success message
+                            example: Configuration reloaded
+                        status:
+                            type: number
+                            description: HTTP success status code
+                            example: 200
+                        cameras:
+                            type: object
+                            description: Camera ids per change applied
+                            example: {"added": ["9012"], "removed": [], "changed": ["1234"], "unchanged": ["5678"]}
+            202:
+                description: Reload forwarded to all workers
+            400:
+                description: Invalid configuration file, running configuration is kept
+                schema:
+                    title: Bad_Request
+                    type: object
+                    required:
+                        - status
+                        - message
+                    properties:
+                        message:
+                            type: string
+                            description: Validation error message
+                            example: "Camera 1234: read_timeout_ms must be strictly positive and not above timeout_ms (1000)"
+                        status:
+                            type: number
+                            description: HTTP error status code
+                            example: 400
+        """
+
+        factory = request.app.factory
+        workers = getattr(factory.config, "workers", 1)
+        if workers > 1:
+            # Only this worker got the request, supervisor forwards SIGHUP to every worker
+            os.kill(os.getppid(), signal.SIGHUP)
+            payload = {"message": "Reload requested on %d workers" % workers, "status": 202}
+            return json_response(payload, status=202)
+
+        try:
+            cameras = yield from factory.reload_cams()
+        except ValueError as exc:
+            payload = {"message": str(exc), "status": 400}
+            return json_response(payload, status=400)
+
+        payload = {"message": "Configuration reloaded", "status": 200, "cameras": cameras}
+        return json_response(payload, status=200)
@@ -0,0 +1,49 @@
+""" Expose health of all cameras """
+
+
+# pylint: disable=line-too-long
+
+
+import asyncio
+
+from api_json import json_response
+
+
+class Health(object):  # pylint: disable=too-few-public-methods
+    """ Expose health of all cameras """
+
+    @asyncio.coroutine
+    def get(self, request):
+        """
+        ---
+        description: Health of all cameras. Camera is unhealthy (circuit open) after consecutive connection failures, timeouts or server errors, requests to it fail right away with 503 until a background probe succeeds. Status is 200 when all cameras are healthy, 503 otherwise.
+        produces:
+        - application/json
+        tags:
+        - monitoring
+        responses:
+            200:
+                description: All cameras are healthy
+                schema:
+                    title: Health
+                    type: object
+                    required:
+                        - status
+                        - cameras
+                    properties:
+                        status:
+                            type: number
+                            description: HTTP status code
+                            example: 200
+                        cameras:
+                            type: object
+                            description: Health per camera id
+                            example: {"1234": {"healthy": true, "state": "closed", "consecutive_failures": 0, "open_for_seconds": null, "last_error": null}}
+            503:
+                description: At least one camera is unhealthy, same body
+        """
+
+        cameras = {cam: rcp_service.health for cam, rcp_service in request.app["rcp_services"].items()}
+        status = 200 if all(x["healthy"] for x in cameras.values()) else 503
+
+        return json_response({"status": status, "cameras": cameras}, status=status)
@@ -5,15 +5,24 @@
 
 
 import asyncio
-import aiohttp_jinja2
+
+from .static_files import CachedAsset
 
 
 class InterfacePtzMove(object):  # pylint: disable=too-few-public-methods
-    """ HTML interface providing JS joystick """
+    """
+    HTML interface providing JS joystick
+    Page is rendered once and kept in memory, again only when cameras list changes (reload)
+    """
+
+    CACHE_CONTROL = "no-cache"
+
+    def __init__(self):
+        self.page = None
+        self.page_cams = None
 
-    @staticmethod
     @asyncio.coroutine
-    def get(request):
+    def get(self, request):
         """
         ---
         description: Interface with PTZ JS joystick <br/><br/><h2><a href="interfaces/ptz/move">Open HTML interface</a></h2>
@@ -24,6 +33,15 @@ class InterfacePtzMove(object):  # pylint: disable=too-few-public-methods
         responses:
             200:
                 description: Interface with PTZ JS joystick <br/><br/><h2><a href="interfaces/ptz/move">Open HTML interface</a></h2>
+            304:
+                description: Client copy is still valid
         """
 
-        return aiohttp_jinja2.render_template("ptz_move.html", request, context={})
+        factory = request.app.factory
+        cams = sorted(factory.config.cams)
+        if self.page is None or self.page_cams != cams:
+            html = factory.jinja2env.get_template("ptz_move.html").render()
+            self.page = CachedAsset(html.encode("utf-8"), "text/html", self.CACHE_CONTROL, charset="utf-8")
+            self.page_cams = cams
+
+        return self.page.response(request)
@@ -0,0 +1,32 @@
+""" Expose metrics in Prometheus text format """
+
+
+# pylint: disable=line-too-long
+
+
+import asyncio
+import aiohttp.web
+
+from services import METRICS_REGISTRY
+
+
+class Metrics(object):  # pylint: disable=too-few-public-methods
+    """ Expose metrics in Prometheus text format """
+
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    @asyncio.coroutine
+    def get(self, request):  # pylint: disable=unused-argument
+        """
+        ---
+        description: Metrics in Prometheus text format (RCP+ requests latency and errors per camera, PTZ locks events, HTTP handlers latency)
+        produces:
+        - text/plain
+        tags:
+        - monitoring
+        responses:
+            200:
+                description: Metrics in Prometheus text format
+        """
+
+        return aiohttp.web.Response(body=METRICS_REGISTRY.render().encode("utf-8"), headers={"Content-Type": self.CONTENT_TYPE})
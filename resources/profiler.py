@@ -0,0 +1,114 @@
+""" Profile API process on demand """
+
+
+# pylint: disable=line-too-long
+
+
+import io
+import pstats
+import asyncio
+import cProfile
+import aiohttp.web
+
+from api_json import json_response
+
+
+class Profiler(object):  # pylint: disable=too-few-public-methods
+    """
+    Run cProfile on event loop thread for a few seconds and return aggregated stats
+    Nothing is profiled between requests, only one profile runs at a time
+    """
+
+    SECONDS_MAX = 60
+    LIMIT_MAX = 500
+    SORT_KEYS = ("cumulative", "tottime", "calls")
+
+    def __init__(self):
+        self.running = False
+
+    @staticmethod
+    def _int_param(request, name, default, maximum):
+        """ Validate positive integer query param """
+
+        value = request.rel_url.query.get(name, str(default))
+        assert value.isdigit() and 0 < int(value) <= maximum, "%s must be between 1 and %d (int)" % (name, maximum)
+        return int(value)
+
+    @asyncio.coroutine
+    def post(self, request):
+        """
+        ---
+        description: Profile requests handled by this process with cProfile for some seconds, then return aggregated stats as text. Profiler costs nothing when not running. With several workers, only the worker receiving this request is profiled.
+        produces:
+        - text/plain
+        tags:
+        - admin
+        parameters:
+        - in: query
+          name: seconds
+          description: Profiling duration (seconds)
+          required: False
+          type: integer
+          minimum: 1
+          maximum: 60
+          default: 5
+        - in: query
+          name: sort
+          description: Stats sort key
+          required: False
+          type: string
+          enum: [cumulative, tottime, calls]
+          default: cumulative
+        - in: query
+          name: limit
+          description: Number of functions listed
+          required: False
+          type: integer
+          minimum: 1
+          maximum: 500
+          default: 40
+        responses:
+            200:
+                description: pstats report of functions called while profiling
+            400:
+                description: Invalid parameter
+            409:
+                description: A profile is already running
+                schema:
+                    title: Conflict
+                    type: object
+                    required:
+                        - status
+                        - message
+                    properties:
+                        message:
+                            type: string
+                            description: Conflict error message
+                            example: A profile is already running
+                        status:
+                            type: number
+                            description: HTTP error status code
+                            example: 409
+        """
+
+        seconds = self._int_param(request, "seconds", 5, self.SECONDS_MAX)
+        limit = self._int_param(request, "limit", 40, self.LIMIT_MAX)
+        sort = request.rel_url.query.get("sort", "cumulative")
+        assert sort in self.SORT_KEYS, "sort must be one of %s" % ", ".join(self.SORT_KEYS)
+
+        if self.running:
+            payload = {"message": "A profile is already running", "status": 409}
+            return json_response(payload, status=409)
+
+        self.running = True
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield from asyncio.sleep(seconds)
+        finally:
+            profile.disable()
+            self.running = False
+
+        report = io.StringIO()
+        pstats.Stats(profile, stream=report).strip_dirs().sort_stats(sort).print_stats(limit)
+        return aiohttp.web.Response(text=report.getvalue(), content_type="text/plain")
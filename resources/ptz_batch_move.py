@@ -0,0 +1,184 @@
+""" Run PTZ actions on several cameras at once using JSON body """
+
+
+# pylint: disable=line-too-long
+
+
+import logging
+import asyncio
+
+from api_json import json_response
+from api_middlewares import rest_error_from_exception
+from .ptz_move import PtzMove
+
+
+class PtzBatchMove(object):  # pylint: disable=too-few-public-methods
+    """ Run PTZ actions on several cameras at once using JSON body """
+
+    def __init__(self):
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    @staticmethod
+    def _parse_entry(app, entry):
+        """ Validate one batch entry and return camera id, move arguments and lock token """
+
+        assert isinstance(entry, dict), "Each batch entry must be an object"
+        cam_id = entry.get("cam_id", None)
+        assert cam_id in app["ptz_moves"], "Unknown camera %s" % cam_id
+        move = entry.get("move", {})
+        assert isinstance(move, dict), "move must be an object (camera %s)" % cam_id
+        lock_token = entry.get("lock_token", None)
+        assert lock_token is None or isinstance(lock_token, str), "lock_token must be a string (camera %s)" % cam_id
+
+        args = {}
+        for key in PtzMove.MOVE_KEYS:
+            value = move.get(key, 0)
+            assert isinstance(value, int) or (isinstance(value, str) and value.isdigit()), "PTZ %s must be an integer (camera %s)" % (key, cam_id)
+            args[key] = str(int(value))
+        for key in move.keys():
+            assert key in PtzMove.MOVE_KEYS, "Unknown move %s (camera %s)" % (key, cam_id)
+
+        return cam_id, args, lock_token
+
+    @asyncio.coroutine
+    def _move_one(self, app, cam_id, args, lock_token):
+        """ Apply move on one camera, never raise so other cameras are not affected """
+
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+        try:
+            payload, status = yield from app["ptz_moves"][cam_id].move(app, args, lock_token)
+        except Exception as exc:  # pylint: disable=broad-except
+            self.logger.error("Error moving camera %s: %s: %s", cam_id, exc.__class__.__name__, exc)
+            payload = rest_error_from_exception(exc)
+            status = payload["status"]
+
+        result = {"cam_id": cam_id, "elapsed_ms": round((loop.time() - start) * 1000, 3)}
+        result.update(payload)
+        result["status"] = status
+        return result
+
+    @asyncio.coroutine
+    def post(self, request):
+        """
+        ---
+        description: Run PTZ moves on several cameras concurrently. Each entry follows /cams/{cam_id}/ptz/move rules (lock token, exclusive axis...). Overall status is 200 as soon as the batch is valid, check status of each result.
+        consumes:
+        - application/json
+        produces:
+        - application/json
+        tags:
+        - ptz
+        parameters:
+        - in: body
+          name: body
+          required: True
+          schema:
+            type: object
+            required:
+                - moves
+            properties:
+                moves:
+                    type: array
+                    items:
+                        type: object
+                        required:
+                            - cam_id
+                        properties:
+                            cam_id:
+                                type: string
+                                example: "1234"
+                            lock_token:
+                                type: string
+                                example: gua7Aim4
+                            move:
+                                type: object
+                                example: {"left": 3, "up": 2}
+                                properties:
+                                    left:
+                                        type: integer
+                                    right:
+                                        type: integer
+                                    up:
+                                        type: integer
+                                    down:
+                                        type: integer
+                                    zin:
+                                        type: integer
+                                    zout:
+                                        type: integer
+                                    stop:
+                                        type: integer
+        responses:
+            200:
+                description: Batch applied, see each camera result
+                schema:
+                    title: Batch_Success
+                    type: object
+                    required:
+                        - status
+                        - message
+                        - results
+                    properties:
+                        message:
+                            type: string
+                            description: Success message
+                            example: PTZ batch move applied
+                        status:
+                            type: number
+                            description: HTTP success status code
+                            example: 200
+                        results:
+                            type: array
+                            items:
+                                type: object
+                                properties:
+                                    cam_id:
+                                        type: string
+                                        example: "1234"
+                                    status:
+                                        type: number
+                                        example: 200
+                                    message:
+                                        type: string
+                                        example: PTZ move applied
+                                    lock_token:
+                                        type: string
+                                        example: gua7Aim4
+                                    elapsed_ms:
+                                        type: number
+                                        example: 12.5
+            400:
+                description: Bad request
+                schema:
+                    title: Bad_Request
+                    type: object
+                    required:
+                        - status
+                        - message
+                    properties:
+                        message:
+                            type: string
+                            description: Validation error message
+                            example: Unknown camera 4321
+                        status:
+                            type: number
+                            description: HTTP error status code
+                            example: 400
+        """
+
+        try:
+            body = yield from request.json()
+        except ValueError:
+            raise AssertionError("Request body must be valid JSON") from None
+
+        assert isinstance(body, dict) and isinstance(body.get("moves", None), list) and body["moves"], "moves must be a non-empty list"
+
+        entries = [self._parse_entry(request.app, x) for x in body["moves"]]
+        cam_ids = [x[0] for x in entries]
+        assert len(set(cam_ids)) == len(cam_ids), "Each camera can only appear once in a batch"
+
+        results = yield from asyncio.gather(*[self._move_one(request.app, *x) for x in entries])
+
+        payload = {"message": "PTZ batch move applied", "status": 200, "results": results}
+        return json_response(payload, status=200)
@@ -0,0 +1,50 @@
+""" Expose PTZ lock state of all cameras """
+
+
+# pylint: disable=line-too-long
+
+
+import asyncio
+
+from api_json import json_response
+
+
+class PtzLocks(object):  # pylint: disable=too-few-public-methods
+    """ Expose PTZ lock state of all cameras """
+
+    @asyncio.coroutine
+    def get(self, request):
+        """
+        ---
+        description: PTZ lock state of all cameras. Locks taken by a WebSocket connection never expire by themselves (expires_in_seconds is null).
+        produces:
+        - application/json
+        tags:
+        - ptz
+        responses:
+            200:
+                description: Lock state per camera
+                schema:
+                    title: Locks_State
+                    type: object
+                    required:
+                        - status
+                        - locks
+                    properties:
+                        status:
+                            type: number
+                            description: HTTP success status code
+                            example: 200
+                        locks:
+                            type: object
+                            description: Lock state per camera id
+                            example: {"1234": {"locked": true, "held_seconds": 4.2, "expires_in_seconds": 5.8}}
+        """
+
+        state = request.app["lock_manager"].state()
+        locks = {}
+        for cam in request.app["ptz_moves"].keys():
+            locks[cam] = {"locked": cam in state, "held_seconds": None, "expires_in_seconds": None}
+            locks[cam].update(state.get(cam, {}))
+
+        return json_response({"status": 200, "locks": locks}, status=200)
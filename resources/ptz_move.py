@@ -6,65 +6,92 @@
 
 import logging
 import asyncio
-import string
-import random
+import functools
+import contextlib
+import json
 import aiohttp.web
 
+from api_json import PreEncodedPayload, json_response
+from api_middlewares import rest_error_from_exception
+from services import PtzLockManager, ServerTiming
+
 
 class PtzMove(object):  # pylint: disable=too-few-public-methods
     """ Run PTZ action using query params """
 
-    def __init__(self, cam_id, auto_release_delay=10):
+    MOVE_KEYS = ("left", "right", "up", "down", "zin", "zout", "stop")
+    WS_HEARTBEAT = 5
+    DURATION_MS_MAX = 60000
+    SEQUENCE_STEPS_MAX = 32
+    IN_USE_PAYLOAD = PreEncodedPayload(message="PTZ is already in use", status=403)
+    STOP_PAYLOAD = PreEncodedPayload(message="PTZ move stop, lock released", status=200)
+
+    def __init__(self, cam_id, auto_release_delay=10, lock_manager=None, server_timing=False):
         self.logger = logging.getLogger(self.__class__.__name__ + "@" + cam_id)
         self.cam_id = cam_id
         self.auto_release_delay = auto_release_delay
-        self.locked = False
-        self.delayed_unlock_coro = None
+        self.server_timing = server_timing
+        self.lock_manager = lock_manager if lock_manager is not None else PtzLockManager()
+        self.timed_moves_task = None
+        self.websockets = set()
+
+    @property
+    def locked(self):
+        """ Token currently holding this camera PTZ, False if free """
 
-    def _lock(self):
+        return self.lock_manager.owner(self.cam_id) or False
+
+    def _lock(self, auto_release=True):
         """
         Lock this camera PTZ and return token
-        to bypass lock
+        to bypass lock (None if already in use), lock is released after auto_release_delay
+        seconds without renewal for recovery of unclean leave
+        (without calling with stop=1)
         """
 
-        token = "".join(random.choice(string.ascii_uppercase + string.digits) for _ in range(8))
-        self.locked = token
+        return self.lock_manager.acquire(self.cam_id, ttl=self.auto_release_delay if auto_release else None)
 
-        self.delayed_unlock_coro = asyncio.ensure_future(self._delayed_unlock())
+    def _renew_lock(self, token):
+        """ Push back automatic lock release, return False if lock is no longer held by token """
 
-        return token
+        return self.lock_manager.renew(self.cam_id, token)
 
-    def _renew_lock(self):
-        """
-        Cancel auto-release-lock coroutine
-        and start a new one
-        """
+    def _unlock(self, token=None):
+        """ Mark PTZ as free, only if still held by token when given """
 
-        if self.delayed_unlock_coro:
-            self.delayed_unlock_coro.cancel()
-        self.delayed_unlock_coro = asyncio.ensure_future(self._delayed_unlock())
+        self.lock_manager.release(self.cam_id, token)
 
-    def _unlock(self):
+    def claim_lock(self, lock_token=None):
         """
-        Cancel auto-release-lock coroutine
-        and mark PTZ as free
+        Apply PTZ lock rules: renew lock held by lock_token or take it if camera is free
+        Return token and whether lock has just been taken, token is None if camera is
+        used by someone else (lock may be taken by another worker in between)
+        A command from lock owner replaces remaining timed moves
         """
 
-        if self.delayed_unlock_coro:
-            self.delayed_unlock_coro.cancel()
-        self.locked = False
+        owner = self.locked
+        if not owner:
+            owner = self._lock()
+            if owner:
+                self._cancel_timed_moves()
+                return owner, True
+        # Lock may expire and be taken by another worker between both checks, renew verifies token again
+        if not owner or owner != lock_token or not self._renew_lock(lock_token):
+            self.lock_manager.reject(self.cam_id)
+            return None, False
+        self._cancel_timed_moves()
+        return lock_token, False
 
-    @asyncio.coroutine
-    def _delayed_unlock(self):
-        """
-        Schedule automatic lock release
-        after seconds for recovery of unclean
-        leave (without calling with stop=1)
-        """
+    @contextlib.contextmanager
+    def release_on_error(self, lock_token, new_lock):
+        """ Release lock taken by claim_lock if command run within fails: caller never got the token """
 
-        yield from asyncio.sleep(self.auto_release_delay)
-        self._unlock()
-        self.logger.info("PTZ lock released after %d seconds of inactivity", self.auto_release_delay)
+        try:
+            yield
+        except Exception:
+            if new_lock:
+                self._unlock(lock_token)
+            raise
 
     @asyncio.coroutine
     def get(self, request):
@@ -76,6 +103,11 @@ class PtzMove(object):  # pylint: disable=too-few-public-methods
         tags:
         - ptz
         parameters:
+        - in: path
+          name: cam_id
+          description: Camera name as defined in INI file
+          required: True
+          type: string
         - in: query
           name: left
           description: Move left at given speed
@@ -125,6 +157,18 @@ class PtzMove(object):  # pylint: disable=too-few-public-methods
           type: integer
           minimum: 0
           maximum: 1
+        - in: query
+          name: duration_ms
+          description: Stop camera automatically after given milliseconds, lock is released on stop. Can not be combined with stop=1
+          required: False
+          type: integer
+          minimum: 1
+          maximum: 60000
+        - in: query
+          name: sequence
+          description: Chain timed moves in one request, steps are separated by ";" and made of 7 comma separated integers left,right,up,down,zin,zout,duration_ms (e.g. "3,0,0,0,0,0,1500;0,0,2,0,0,0,500"). Camera is stopped and lock released after last step, any later move from lock owner cancels remaining steps. Can not be combined with stop=1
+          required: False
+          type: string
         - in: query
           name: lock_token
           description: Token to keep PTZ locked (Will be returned with first request if PTZ is not already used). Token is cleared if after NNs inactivity or NNs after stop=1.
@@ -207,12 +251,52 @@ class PtzMove(object):  # pylint: disable=too-few-public-methods
                             example: 403
         """
 
+        timing = ServerTiming() if self.server_timing else None
+        if timing is not None:
+            timing.start("total")
+
         # Extract query params
         args = {}
-        for key in ["left", "right", "up", "down", "zin", "zout", "stop"]:
+        for key in self.MOVE_KEYS:
             args[key] = request.rel_url.query.get(key, 0)
         lock_token = request.rel_url.query.get("lock_token", None)
 
+        if "sequence" in request.rel_url.query or "duration_ms" in request.rel_url.query:
+            # Timed moves end with their own stop, an explicit one would be silently dropped
+            assert str(args.pop("stop")) == "0", "stop can not be combined with duration_ms or sequence"
+
+        if "sequence" in request.rel_url.query:
+            steps = self._parse_sequence(request.rel_url.query["sequence"])
+            payload, status = yield from self.move_sequence(request.app, steps, lock_token)
+        elif "duration_ms" in request.rel_url.query:
+            steps = [(args, self._parse_duration_ms(request.rel_url.query["duration_ms"]))]
+            payload, status = yield from self.move_sequence(request.app, steps, lock_token)
+        else:
+            payload, status = yield from self.move(request.app, args, lock_token, timing=timing)
+
+        if timing is None:
+            return json_response(payload, status=status)
+
+        timing.start("encode")
+        response = json_response(payload, status=status)
+        timing.stop("encode")
+        timing.stop("total")
+        response.headers["Server-Timing"] = timing.header()
+        return response
+
+    @staticmethod
+    @functools.lru_cache(maxsize=1024)
+    def _applied_payload(lock_token):
+        """ Payload answered to every move of lock owner, cached per lock token """
+        return PreEncodedPayload(message="PTZ move applied", status=200, lock_token=lock_token)
+
+    @asyncio.coroutine
+    def move(self, app, args, lock_token=None, timing=None):
+        """
+        Verify lock state and apply PTZ move
+        Return JSON payload and HTTP status code, phases are recorded in timing (ServerTiming) if given
+        """
+
         # Parse stop query param to be able to release camera lock on stop request
         if isinstance(args["stop"], str) and args["stop"].isdigit():
             args["stop"] = int(args["stop"])
@@ -220,27 +304,263 @@ class PtzMove(object):  # pylint: disable=too-few-public-methods
         args["stop"] = bool(args["stop"])
 
         # Verify lock state
-        if self.locked:
-            if self.locked != lock_token:
-                payload = {"message": "PTZ is already in use", "status": 403}
-                return aiohttp.web.json_response(payload, status=403)
-            else:
-                self._renew_lock()
-        else:
-            lock_token = self._lock()
+        if timing is not None:
+            timing.start("lock")
+        lock_token, new_lock = self.claim_lock(lock_token)
+        if timing is not None:
+            timing.stop("lock")
+        if lock_token is None:
+            return self.IN_USE_PAYLOAD, 403
 
         # Lock and release lock
         if args["stop"]:
 
-            payload = {"message": "PTZ move stop, lock released", "status": 200}
-            self._unlock()
+            payload = self.STOP_PAYLOAD
+            self._unlock(lock_token)
 
         else:
 
-            payload = {"message": "PTZ move applied", "status": 200, "lock_token": lock_token}
+            payload = self._applied_payload(lock_token)
 
         # Apply PTZ move
+        rcp_service = app["rcp_services"][self.cam_id]
+        with self.release_on_error(lock_token, new_lock):
+            yield from rcp_service.move_ptz(timing=timing, **args)
+
+        return payload, 200
+
+    def _parse_duration_ms(self, value):
+        """ Validate timed move duration """
+
+        if isinstance(value, str) and value.isdigit():
+            value = int(value)
+        assert isinstance(value, int) and 0 < value <= self.DURATION_MS_MAX, "duration_ms must be between 1 and %d (int)" % self.DURATION_MS_MAX
+        return value
+
+    def _parse_sequence(self, data):
+        """
+        Parse timed moves sequence: steps separated by ";"
+        each made of 7 comma separated integers left,right,up,down,zin,zout,duration_ms
+        """
+
+        steps = []
+        for step in data.split(";"):
+            values = [x.strip() for x in step.split(",")]
+            assert len(values) == len(self.MOVE_KEYS), "Sequence step must be %d comma separated integers: left,right,up,down,zin,zout,duration_ms" % len(self.MOVE_KEYS)
+            steps.append((dict(zip(self.MOVE_KEYS[:-1], values[:-1])), self._parse_duration_ms(values[-1])))
+        assert len(steps) <= self.SEQUENCE_STEPS_MAX, "Sequence can not have more than %d steps" % self.SEQUENCE_STEPS_MAX
+        return steps
+
+    def _cancel_timed_moves(self):
+        """ Drop remaining timed moves, a newer command from lock owner replaces them """
+
+        if self.timed_moves_task is not None and not self.timed_moves_task.done():
+            self.timed_moves_task.cancel()
+        self.timed_moves_task = None
+
+    @asyncio.coroutine
+    def move_sequence(self, app, steps, lock_token=None):
+        """
+        Verify lock state, apply first move right away and let the server
+        run next steps and final stop with event loop timing
+        Each step is (move args, duration_ms)
+        Return JSON payload and HTTP status code
+        """
+
+        rcp_service = app["rcp_services"][self.cam_id]
+        for args, _ in steps:
+            rcp_service.parse_move(**args)
+
+        lock_token, new_lock = self.claim_lock(lock_token)
+        if lock_token is None:
+            return self.IN_USE_PAYLOAD, 403
+
+        with self.release_on_error(lock_token, new_lock):
+            yield from rcp_service.move_ptz(**steps[0][0])
+
+        # Durations are counted from first move being applied
+        start = asyncio.get_event_loop().time()
+        self.timed_moves_task = asyncio.ensure_future(self._run_timed_moves(rcp_service, steps, start, lock_token))
+
+        duration_ms = sum(x[1] for x in steps)
+        payload = {"message": "PTZ timed move applied, stop in %d ms" % duration_ms, "status": 200, "lock_token": lock_token, "duration_ms": duration_ms}
+        return payload, 200
+
+    @asyncio.coroutine
+    def _wait_until(self, deadline, lock_token):
+        """
+        Sleep until event loop time deadline, renewing lock
+        so it does not expire during steps longer than auto_release_delay
+        """
+
+        loop = asyncio.get_event_loop()
+        while True:
+            wake_up = min(deadline, loop.time() + self.auto_release_delay / 2)
+            waiter = asyncio.Future()
+            handle = loop.call_at(wake_up, waiter.set_result, None)
+            try:
+                yield from waiter
+            finally:
+                handle.cancel()
+            if wake_up >= deadline:
+                return
+            self._renew_lock(lock_token)
+
+    @asyncio.coroutine
+    def _run_timed_moves(self, rcp_service, steps, start, lock_token):
+        """
+        Apply remaining steps then stop camera and release lock
+        Deadlines are absolute so request latency does not add up along the sequence
+        Sequence is dropped as soon as lock_token no longer owns the lock: lock owner stop
+        may be handled by another worker, which releases the shared lock but can not cancel this task
+        """
+
+        deadline = start
+        try:
+            for index, (args, duration_ms) in enumerate(steps):
+                if index:
+                    if self.locked != lock_token:
+                        self.logger.info("Timed move dropped, lock has been released or taken by another caller")
+                        return
+                    yield from rcp_service.move_ptz(**args)
+                deadline += duration_ms / 1000
+                yield from self._wait_until(deadline, lock_token)
+            if self.locked != lock_token:
+                self.logger.info("Timed move dropped, lock has been released or taken by another caller")
+                return
+            self._unlock(lock_token)
+            yield from rcp_service.move_ptz(stop=True)
+            self.logger.info("Timed move finished, camera stopped and lock released")
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:  # pylint: disable=broad-except
+            self.logger.error("Error running timed move: %s: %s", exc.__class__.__name__, exc)
+            if self.locked == lock_token:
+                yield from self._stop_left_moving(rcp_service, lock_token)
+
+    def _parse_ws_frame(self, data):
+        """
+        Parse compact WebSocket move frame:
+        7 comma separated integers left,right,up,down,zin,zout,stop
+        """
+
+        values = data.split(",")
+        assert len(values) == len(self.MOVE_KEYS), "Move frame must be %d comma separated integers: %s" % (len(self.MOVE_KEYS), ",".join(self.MOVE_KEYS))
+        args = dict(zip(self.MOVE_KEYS, [x.strip() for x in values]))
+        for key, value in args.items():
+            assert value.isdigit(), "PTZ %s must be an integer" % key
+        return args
+
+    @asyncio.coroutine
+    def websocket(self, request):
+        """
+        ---
+        description: Run PTZ moves on camera through a WebSocket. Lock is owned by the connection so no lock_token is needed, each text frame is a move made of 7 comma separated integers (left,right,up,down,zin,zout,stop), e.g. "0,3,2,0,0,0,0". Nothing is answered on success, errors are sent back as JSON frames. Camera is stopped and lock released when connection is closed.
+        tags:
+        - ptz
+        parameters:
+        - in: path
+          name: cam_id
+          description: Camera name as defined in INI file
+          required: True
+          type: string
+        responses:
+            101:
+                description: Switching protocols to WebSocket
+        """
+
+        ws = aiohttp.web.WebSocketResponse(heartbeat=self.WS_HEARTBEAT)
+        yield from ws.prepare(request)
+
+        lock_token = self._lock(auto_release=False)
+        if lock_token is None:
+            self.lock_manager.reject(self.cam_id)
+            yield from ws.send_str(json.dumps(self.IN_USE_PAYLOAD))
+            yield from ws.close()
+            return ws
+
+        self.logger.info("PTZ locked by WebSocket connection from %s", request.remote)
+
         rcp_service = request.app["rcp_services"][self.cam_id]
-        yield from rcp_service.move_ptz(**args)
+        self.websockets.add(ws)
+        # Moves are not awaited before reading next frame, so queued frames are folded
+        # into the latest one by camera pipeline instead of being sent one round trip at a time
+        pending = set()
+
+        try:
+            while True:
+                msg = yield from ws.receive()
+                if msg.type in (aiohttp.WSMsgType.CLOSE, aiohttp.WSMsgType.CLOSING, aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                    break
+                try:
+                    assert msg.type == aiohttp.WSMsgType.TEXT, "Move frame must be sent as text"
+                    args = self._parse_ws_frame(msg.data)
+                except Exception as exc:  # pylint: disable=broad-except
+                    yield from self._send_ws_error(ws, exc)
+                    continue
+                task = asyncio.ensure_future(self._ws_move(ws, rcp_service, args))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+
+        finally:
+            self.websockets.discard(ws)
+            # Handler may be cancelled on client disconnect, stop must go out anyway,
+            # scheduled after moves not submitted yet so it is queued behind them.
+            # Lock is kept until stop is sent so it can not halt the move of a next owner
+            if rcp_service.moving or pending:
+                asyncio.ensure_future(self._stop_left_moving(rcp_service, lock_token))
+            else:
+                self._unlock(lock_token)
+                self.logger.info("PTZ lock released on WebSocket close")
+
+        return ws
+
+    @asyncio.coroutine
+    def _ws_move(self, ws, rcp_service, args):
+        """ Submit one WebSocket move frame, error is sent back once its write completes """
+
+        try:
+            yield from rcp_service.move_ptz(**args)
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:  # pylint: disable=broad-except
+            yield from self._send_ws_error(ws, exc)
+
+    @asyncio.coroutine
+    def _send_ws_error(self, ws, exc):
+        """ Send error of a WebSocket frame as JSON frame, unless connection is already closed """
+
+        rest_error = rest_error_from_exception(exc)
+        # Frames over camera rate limit are counted by metrics, a stuck joystick would flood logs
+        if rest_error["status"] != 429:
+            self.logger.error("Error handling WebSocket frame: %s: %s", exc.__class__.__name__, exc)
+        if not ws.closed:
+            yield from ws.send_str(json.dumps(rest_error))
+
+    @asyncio.coroutine
+    def close(self):
+        """
+        Drop timed moves and close WebSockets bound to current RCP+ client of this camera,
+        used when camera is removed or reconfigured. Lock held by token is not touched
+        """
+
+        self._cancel_timed_moves()
+        if self.websockets:
+            self.logger.info("Closing %d WebSocket connection(s)", len(self.websockets))
+            yield from asyncio.gather(*[x.close(code=aiohttp.WSCloseCode.GOING_AWAY, message=b"Camera reconfigured") for x in list(self.websockets)])
+
+    @asyncio.coroutine
+    def _stop_left_moving(self, rcp_service, lock_token=None):
+        """
+        Stop camera left moving (closed WebSocket, failed timed move), errors are only logged
+        Lock held by lock_token, if given, is released once stop has been sent
+        """
 
-        return aiohttp.web.json_response(payload, status=200)
+        try:
+            yield from rcp_service.move_ptz(stop=True)
+        except Exception as exc:  # pylint: disable=broad-except
+            self.logger.error("Unable to stop PTZ left moving: %s: %s", exc.__class__.__name__, exc)
+        finally:
+            if lock_token is not None:
+                self._unlock(lock_token)
+                self.logger.info("PTZ lock released after stopping camera left moving")
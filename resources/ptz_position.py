@@ -0,0 +1,72 @@
+""" Read PTZ position of camera """
+
+
+# pylint: disable=line-too-long
+
+
+import asyncio
+
+from api_json import json_response
+
+
+class PtzPosition(object):  # pylint: disable=too-few-public-methods
+    """ Read PTZ position of camera """
+
+    def __init__(self, cam_id):
+        self.cam_id = cam_id
+
+    @asyncio.coroutine
+    def get(self, request):
+        """
+        ---
+        description: Current pan, tilt and zoom of camera. Position is cached for position_ttl seconds (camera configuration) and concurrent requests share one read, no lock is needed.
+        produces:
+        - application/json
+        tags:
+        - ptz
+        parameters:
+        - in: path
+          name: cam_id
+          description: Camera name as defined in INI file
+          required: True
+          type: string
+        responses:
+            200:
+                description: Current position
+                schema:
+                    title: Position
+                    type: object
+                    required:
+                        - status
+                        - message
+                        - pan
+                        - tilt
+                        - zoom
+                    properties:
+                        message:
+                            type: string
+                            description: Success message
+                            example: PTZ position
+                        status:
+                            type: number
+                            description: HTTP success status code
+                            example: 200
+                        pan:
+                            type: number
+                            description: Pan angle (degrees)
+                            example: 123.45
+                        tilt:
+                            type: number
+                            description: Tilt angle (degrees)
+                            example: -12.5
+                        zoom:
+                            type: number
+                            description: Zoom magnification ratio
+                            example: 4.2
+        """
+
+        position = yield from request.app["rcp_services"][self.cam_id].get_position()
+
+        payload = {"message": "PTZ position", "status": 200}
+        payload.update(position)
+        return json_response(payload, status=200)
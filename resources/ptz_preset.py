@@ -0,0 +1,221 @@
+""" Store and recall PTZ presets using query params """
+
+
+# pylint: disable=line-too-long
+
+
+import asyncio
+
+from api_json import json_response
+
+
+class PtzPreset(object):
+    """
+    Store and recall PTZ presets using query params
+    Follow the same lock rules than PtzMove of the same camera
+    """
+
+    ACTIONS_DONE = {"recall": "recalled", "store": "stored"}
+
+    def __init__(self, ptz_move):
+        self.cam_id = ptz_move.cam_id
+        self.ptz_move = ptz_move
+
+    @asyncio.coroutine
+    def apply(self, app, action, preset, lock_token=None):
+        """
+        Verify lock state, then store or recall preset
+        Return JSON payload and HTTP status code
+        """
+
+        lock_token, new_lock = self.ptz_move.claim_lock(lock_token)
+        if lock_token is None:
+            return self.ptz_move.IN_USE_PAYLOAD, 403
+
+        rcp_service = app["rcp_services"][self.cam_id]
+        with self.ptz_move.release_on_error(lock_token, new_lock):
+            if action == "recall":
+                yield from rcp_service.recall_preset(preset)
+            else:
+                yield from rcp_service.store_preset(preset)
+
+        payload = {"message": "PTZ preset %s %s" % (preset, self.ACTIONS_DONE[action]), "status": 200, "lock_token": lock_token}
+        return payload, 200
+
+    @asyncio.coroutine
+    def recall(self, request):
+        """
+        ---
+        description: Move camera to a stored preset in one request, camera stops by itself once there. Lock rules are the same than /cams/{cam_id}/ptz/move, lock is taken (or renewed) and released automatically after inactivity.
+        produces:
+        - application/json
+        tags:
+        - ptz
+        parameters:
+        - in: path
+          name: cam_id
+          description: Camera name as defined in INI file
+          required: True
+          type: string
+        - in: query
+          name: preset
+          description: Preset number
+          required: True
+          type: integer
+          minimum: 1
+          maximum: 256
+        - in: query
+          name: lock_token
+          description: Token to keep PTZ locked (Will be returned with first request if PTZ is not already used)
+          required: False
+          type: string
+        responses:
+            200:
+                description: Preset recalled
+                schema:
+                    title: Preset_Success
+                    type: object
+                    required:
+                        - status
+                        - message
+                        - lock_token
+                    properties:
+                        message:
+                            type: string
+                            description: Success message
+                            example: PTZ preset 3 recalled
+                        status:
+                            type: number
+                            description: HTTP success status code
+                            example: 200
+                        lock_token:
+                            type: string
+                            description: Token to keep PTZ locked, pass it to next calls
+                            example: gua7Aim4
+            400:
+                description: Bad request
+                schema:
+                    title: Bad_Request
+                    type: object
+                    required:
+                        - status
+                        - message
+                    properties:
+                        message:
+                            type: string
+                            description: Validation error message
+                            example: PTZ preset must be between 1 and 256 (int)
+                        status:
+                            type: number
+                            description: HTTP error status code
+                            example: 400
+            403:
+                description: Forbidden
+                schema:
+                    title: Forbidden
+                    type: object
+                    required:
+                        - status
+                        - message
+                    properties:
+                        message:
+                            type: string
+                            description: Forbidden error message
+                            example: PTZ is already in use
+                        status:
+                            type: number
+                            description: HTTP error status code
+                            example: 403
+        """
+
+        payload, status = yield from self.apply(request.app, "recall", request.rel_url.query.get("preset", None), request.rel_url.query.get("lock_token", None))
+        return json_response(payload, status=status)
+
+    @asyncio.coroutine
+    def store(self, request):
+        """
+        ---
+        description: Store current camera position as preset. Lock rules are the same than /cams/{cam_id}/ptz/move.
+        produces:
+        - application/json
+        tags:
+        - ptz
+        parameters:
+        - in: path
+          name: cam_id
+          description: Camera name as defined in INI file
+          required: True
+          type: string
+        - in: query
+          name: preset
+          description: Preset number
+          required: True
+          type: integer
+          minimum: 1
+          maximum: 256
+        - in: query
+          name: lock_token
+          description: Token to keep PTZ locked (Will be returned with first request if PTZ is not already used)
+          required: False
+          type: string
+        responses:
+            200:
+                description: Preset stored
+                schema:
+                    title: Preset_Success
+                    type: object
+                    required:
+                        - status
+                        - message
+                        - lock_token
+                    properties:
+                        message:
+                            type: string
+                            description: Success message
+                            example: PTZ preset 3 stored
+                        status:
+                            type: number
+                            description: HTTP success status code
+                            example: 200
+                        lock_token:
+                            type: string
+                            description: Token to keep PTZ locked, pass it to next calls
+                            example: gua7Aim4
+            400:
+                description: Bad request
+                schema:
+                    title: Bad_Request
+                    type: object
+                    required:
+                        - status
+                        - message
+                    properties:
+                        message:
+                            type: string
+                            description: Validation error message
+                            example: PTZ preset must be between 1 and 256 (int)
+                        status:
+                            type: number
+                            description: HTTP error status code
+                            example: 400
+            403:
+                description: Forbidden
+                schema:
+                    title: Forbidden
+                    type: object
+                    required:
+                        - status
+                        - message
+                    properties:
+                        message:
+                            type: string
+                            description: Forbidden error message
+                            example: PTZ is already in use
+                        status:
+                            type: number
+                            description: HTTP error status code
+                            example: 403
+        """
+
+        payload, status = yield from self.apply(request.app, "store", request.rel_url.query.get("preset", None), request.rel_url.query.get("lock_token", None))
+        return json_response(payload, status=status)
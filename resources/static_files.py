@@ -0,0 +1,150 @@
+""" Serve static files from memory with precompressed variants and conditional requests """
+
+
+# pylint: disable=line-too-long
+
+
+import os
+import gzip
+import hashlib
+import asyncio
+import mimetypes
+import aiohttp.web
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class CachedAsset(object):
+    """
+    Response body kept in memory with its gzip and brotli (when brotli module is installed) variants
+    Each variant has its own strong ETag so caches never mix encodings
+    :param body: Raw content (bytes)
+    :param content_type: Content-Type without parameters
+    :param cache_control: Cache-Control header value
+    :param charset: Charset of text content, None for binary content
+    """
+
+    COMPRESS_MIN_SIZE = 256
+    ENCODINGS_PREFERENCE = ("br", "gzip")
+
+    def __init__(self, body, content_type, cache_control, charset=None):
+        self.content_type = content_type
+        self.cache_control = cache_control
+        self.charset = charset
+        digest = hashlib.sha1(body).hexdigest()[:16]
+        self.variants = {"identity": (body, '"%s"' % digest)}
+        if len(body) >= self.COMPRESS_MIN_SIZE:
+            self._add_variant("gzip", gzip.compress(body, 9), digest)
+            if brotli is not None:
+                self._add_variant("br", brotli.compress(body), digest)
+
+    def _add_variant(self, encoding, compressed, digest):
+        """ Keep compressed variant only if it is actually smaller """
+
+        if len(compressed) < len(self.variants["identity"][0]):
+            self.variants[encoding] = (compressed, '"%s-%s"' % (digest, encoding))
+
+    def select_encoding(self, accept_encoding):
+        """ Best available variant accepted by client according to Accept-Encoding header """
+
+        accepted = set()
+        for item in accept_encoding.lower().split(","):
+            coding, _, params = item.partition(";")
+            params = params.strip().replace(" ", "")
+            if params.startswith("q="):
+                try:
+                    if float(params[2:]) <= 0:
+                        continue
+                except ValueError:
+                    continue
+            accepted.add(coding.strip())
+
+        for encoding in self.ENCODINGS_PREFERENCE:
+            if encoding in self.variants and (encoding in accepted or "*" in accepted):
+                return encoding
+        return "identity"
+
+    @staticmethod
+    def _etag_matches(etag, if_none_match):
+        """ Weak comparison of If-None-Match header against ETag """
+
+        if if_none_match.strip() == "*":
+            return True
+        return etag in [x.strip()[2:] if x.strip().startswith("W/") else x.strip() for x in if_none_match.split(",")]
+
+    def response(self, request):
+        """ Build response to request, 304 without body when client copy is still valid """
+
+        encoding = self.select_encoding(request.headers.get("Accept-Encoding", ""))
+        body, etag = self.variants[encoding]
+        headers = {"ETag": etag, "Cache-Control": self.cache_control, "Vary": "Accept-Encoding"}
+
+        if_none_match = request.headers.get("If-None-Match", None)
+        if if_none_match is not None and self._etag_matches(etag, if_none_match):
+            return aiohttp.web.Response(status=304, headers=headers)
+
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return aiohttp.web.Response(body=body, content_type=self.content_type, charset=self.charset, headers=headers)
+
+
+class StaticFiles(object):
+    """
+    Serve files of a directory from memory
+    Each file is read and compressed once, on its first request
+    :param directory: Directory holding static files, only files present at startup are served
+    """
+
+    CACHE_CONTROL = "public, max-age=86400"
+    TEXT_CHARSET = "utf-8"
+
+    def __init__(self, directory):
+        self.directory = directory
+        # Path is never built from user input, only names listed here are served
+        self.filenames = {x for x in os.listdir(directory) if not x.startswith(".") and os.path.isfile(os.path.join(directory, x))}
+        self.assets = {}
+
+    def _load(self, filename):
+        """ Read and compress one file, run in executor as compression is CPU bound """
+
+        with open(os.path.join(self.directory, filename), "rb") as static_file:
+            body = static_file.read()
+        content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        charset = self.TEXT_CHARSET if content_type.startswith("text/") or content_type.endswith(("javascript", "json", "xml")) else None
+        return CachedAsset(body, content_type, self.CACHE_CONTROL, charset=charset)
+
+    @asyncio.coroutine
+    def get(self, request):
+        """
+        ---
+        description: Static files used by HTML interface. Served with ETag and Cache-Control headers, gzip or brotli compressed according to Accept-Encoding, 304 is returned when If-None-Match matches.
+        tags:
+        - interface
+        parameters:
+        - in: path
+          name: filename
+          description: Static file name
+          required: True
+          type: string
+        responses:
+            200:
+                description: File content
+            304:
+                description: Client copy is still valid
+            404:
+                description: Unknown file
+        """
+
+        filename = request.match_info["filename"]
+        if filename not in self.filenames:
+            raise aiohttp.web.HTTPNotFound()
+
+        asset = self.assets.get(filename, None)
+        if asset is None:
+            asset = yield from asyncio.get_event_loop().run_in_executor(None, self._load, filename)
+            self.assets[filename] = asset
+
+        return asset.response(request)
@@ -1,3 +1,9 @@
 """ Relative imports of all services """
 
-from .async_rcp_client import AsyncRcpClient, RcpHttpException
+from .async_rcp_client import AsyncRcpClient, RcpHttpException, RcpHttpServiceUnavailableException, RcpHttpTooManyRequestsException, RcpCommandException, RcpCommand, RCP_COMMANDS, register_command
+from .metrics import REGISTRY as METRICS_REGISTRY, Counter, Gauge, Histogram
+from .ptz_lock_manager import PtzLockManager
+from .ptz_lock_backends import MemoryLockBackend, SharedMemoryLockBackend, LOCK_BACKENDS
+from .circuit_breaker import CircuitBreaker
+from .server_timing import ServerTiming
+from .token_bucket import TokenBucket
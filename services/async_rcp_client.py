@@ -7,10 +7,33 @@ For dome camera PTZ handling
 # pylint: disable=line-too-long
 
 
+import struct
 import logging
 import asyncio
+import functools
+import collections
+import urllib.parse
+import xml.etree.ElementTree
 import aiohttp
 
+from .metrics import Counter, Gauge, Histogram
+from .circuit_breaker import CircuitBreaker
+from .server_timing import ServerTiming
+from .token_bucket import TokenBucket
+
+
+RCP_REQUEST_DURATION = Histogram("rcp_request_duration_seconds", "RCP+ request duration per camera, whatever the transport (HTTP or TCP)", labelnames=("camera",))
+RCP_REQUEST_ERRORS = Counter("rcp_request_errors_total", "RCP+ request errors per camera and exception class, whatever the transport (HTTP or TCP)", labelnames=("camera", "exception"))
+RCP_REQUESTS_IN_FLIGHT = Gauge("rcp_requests_in_flight", "RCP+ requests currently in flight per camera, whatever the transport (HTTP or TCP)", labelnames=("camera",))
+RCP_WRITES = Counter("rcp_ptz_writes_total", "PTZ writes per camera by outcome (sent, skipped as redundant, coalesced into a newer one)", labelnames=("camera", "outcome"))
+RCP_POSITION_READS = Counter("rcp_ptz_position_reads_total", "PTZ position reads per camera by outcome (cached, shared with an in-flight read, sent)", labelnames=("camera", "outcome"))
+RCP_CIRCUIT_OPEN = Gauge("rcp_circuit_open", "1 while camera circuit breaker is open or half-open (requests failing fast), 0 when healthy", labelnames=("camera",))
+RCP_STOP_DURATION = Histogram("rcp_ptz_stop_duration_seconds", "PTZ stop delivery duration per camera, from submission to camera acknowledgement including retries", labelnames=("camera",))
+RCP_WRITES_RATE_LIMITED = Counter(
+    "rcp_ptz_writes_rate_limited_total", "PTZ writes per camera held back by rate limit (rejected with 429, delayed until a token is available)", labelnames=("camera", "action")
+)
+RCP_STOP_ATTEMPTS = Counter("rcp_ptz_stop_attempts_total", "Extra PTZ stop requests per camera (early while a move is in flight, retry after a failure, hedge of a slow request)", labelnames=("camera", "kind"))
+
 
 class RcpException(Exception):
     """
@@ -39,6 +62,33 @@ class RcpHttpException(RcpException):
         self.status_code = status_code
 
 
+class RcpHttpServiceUnavailableException(RcpHttpException):
+    """ Camera is known to be unhealthy, request has not been sent """
+
+    _expected_status_codes = [503]
+
+
+class RcpHttpTooManyRequestsException(RcpHttpException):
+    """ Camera rate limit is reached, write has not been sent """
+
+    _expected_status_codes = [429]
+
+
+class RcpCommandException(RcpException):
+    """
+    Camera understood the request but answered with an RCP+ error code
+    :param error_code: RCP+ error code
+    :type error_code: int
+    :param command: RCP+ command number
+    :type command: int
+    """
+
+    def __init__(self, error_code, command):
+        self.error_code = error_code
+        self.command = command
+        super(RcpCommandException, self).__init__("RCP+ error 0x%02x on command 0x%04X" % (error_code, command))
+
+
 class RcpHttpUnauthorizedException(RcpHttpException):  # pylint: disable=missing-docstring
     _expected_status_codes = [401]
 
@@ -55,9 +105,149 @@ class RcpHttpInternalServerErrorException(RcpHttpException):  # pylint: disable=
     _expected_status_codes = [500, 502, 503, 504]
 
 
+INT_FORMATS = {"F_FLAG": ">B", "T_OCTET": ">B", "T_WORD": ">H", "T_INT": ">i", "T_DWORD": ">I"}
+
+BICOM_HEADER = struct.Struct(">BHHB")
+BICOM_FLAGS = 0x80
+BICOM_GET = 0x81
+BICOM_SET = 0x85
+BICOM_PTZ_SERVER = 0x0006
+BICOM_PTZ_MOVE_OBJECT = 0x0110
+BICOM_PTZ_POSITION_OBJECT = 0x0133
+BICOM_PTZ_PRESET_STORE_OBJECT = 0x0142
+BICOM_PTZ_PRESET_RECALL_OBJECT = 0x0143
+BICOM_PTZ_PRESET = struct.Struct(">H")
+PTZ_POSITION_DATA = struct.Struct(">HhH")
+
+
+def encode_bicom(server, object_id, operation, data=b""):
+    """ BiCom request tunnelled in RCP+ 0x09A5: flags, server id, object id, operation, then object data """
+    return BICOM_HEADER.pack(BICOM_FLAGS, server, object_id, operation) + data
+
+
+BICOM_PTZ_PREFIX = encode_bicom(BICOM_PTZ_SERVER, BICOM_PTZ_MOVE_OBJECT, BICOM_SET)
+
+
+@functools.lru_cache(maxsize=None)
+def encode_ptz_move(left=0, right=0, up=0, down=0, zin=0, zout=0, stop=False):  # pylint: disable=too-many-arguments
+    """
+    BiCom PTZ move payload, one byte per axis: high nibble is direction, low nibble is speed
+    Moves are validated first and the state space is small so every payload is only built once
+    """
+
+    if stop:
+        return BICOM_PTZ_PREFIX + b"\x00\x00\x00"
+    return BICOM_PTZ_PREFIX + bytes((left if left else 0x80 | right, 0x80 | up if up else down, 0x80 | zin if zin else zout))
+
+
+def encode_ptz_position_read():
+    """ BiCom get of absolute PTZ position """
+    return encode_bicom(BICOM_PTZ_SERVER, BICOM_PTZ_POSITION_OBJECT, BICOM_GET)
+
+
+def decode_ptz_position(payload):
+    """
+    BiCom position reply: header echo then pan and tilt in hundredths
+    of degree and zoom in hundredths of magnification ratio
+    """
+
+    if len(payload) < BICOM_HEADER.size + PTZ_POSITION_DATA.size:
+        raise RcpException("Invalid PTZ position reply: 0x%s" % payload.hex())
+    pan, tilt, zoom = PTZ_POSITION_DATA.unpack_from(payload, BICOM_HEADER.size)
+    return {"pan": pan / 100, "tilt": tilt / 100, "zoom": zoom / 100}
+
+
+def encode_ptz_preset_store(preset):
+    """ BiCom set storing current position as preset """
+    return encode_bicom(BICOM_PTZ_SERVER, BICOM_PTZ_PRESET_STORE_OBJECT, BICOM_SET, BICOM_PTZ_PRESET.pack(preset))
+
+
+def encode_ptz_preset_recall(preset):
+    """ BiCom set moving camera to preset """
+    return encode_bicom(BICOM_PTZ_SERVER, BICOM_PTZ_PRESET_RECALL_OBJECT, BICOM_SET, BICOM_PTZ_PRESET.pack(preset))
+
+
+def decode_octets(payload):
+    """ Raw bytes as sent by camera """
+    return payload
+
+
+def decode_string(payload):
+    """ NUL terminated UTF-8 string """
+    return payload.split(b"\x00", 1)[0].decode("utf-8", "replace")
+
+
+def decode_int(data_type):
+    """ Return decoder for integer data types """
+
+    fmt = struct.Struct(INT_FORMATS[data_type])
+
+    def decoder(payload):
+        return fmt.unpack_from(payload)[0] if payload else None
+
+    return decoder
+
+
+class RcpCommand(object):
+    """
+    Immutable RCP+ command definition
+    :param name: Name used to look command up in RCP_COMMANDS
+    :param command: RCP+ command number
+    :param data_type: RCP+ data type (P_OCTET, T_DWORD...)
+    :param direction: READ or WRITE
+    :param encoder: Callable turning arguments into payload bytes, None for commands without payload
+    :param decoder: Callable turning reply payload bytes into a value
+    """
+
+    __slots__ = ("name", "command", "data_type", "direction", "num", "encoder", "decoder")
+
+    def __init__(self, name, command, data_type, direction, num=1, encoder=None, decoder=decode_octets):  # pylint: disable=too-many-arguments
+        assert data_type in RcpTcpTransport.DATA_TYPES, "data_type must be one of %s" % sorted(RcpTcpTransport.DATA_TYPES.keys())
+        assert direction in RcpTcpTransport.DIRECTIONS, "direction must be one of %s" % sorted(RcpTcpTransport.DIRECTIONS.keys())
+        for attr, value in (
+            ("name", name),
+            ("command", command),
+            ("data_type", data_type),
+            ("direction", direction),
+            ("num", num),
+            ("encoder", encoder),
+            ("decoder", decoder),
+        ):
+            object.__setattr__(self, attr, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("RcpCommand is immutable")
+
+    def __repr__(self):
+        return "<RcpCommand %s 0x%04X %s %s>" % (self.name, self.command, self.data_type, self.direction)
+
+    def encode(self, *args, **kwargs):
+        """ Build payload bytes """
+
+        if self.encoder is None:
+            return None
+        return self.encoder(*args, **kwargs)
+
+    def decode(self, payload):
+        """ Parse reply payload bytes """
+
+        return self.decoder(payload)
+
+
+RCP_COMMANDS = {}
+
+
+def register_command(name, command, data_type, direction, num=1, encoder=None, decoder=decode_octets):  # pylint: disable=too-many-arguments
+    """ Define a new RCP+ command usable with AsyncRcpClient.execute() """
+
+    assert name not in RCP_COMMANDS, "RCP+ command %s is already registered" % name
+    RCP_COMMANDS[name] = RcpCommand(name, command, data_type, direction, num=num, encoder=encoder, decoder=decoder)
+    return RCP_COMMANDS[name]
+
+
 @asyncio.coroutine
 def _check_response(response, expected_status=200):
-    if response.status == expected_status:
+    if expected_status is None or response.status == expected_status:
         return response
 
     try:
@@ -93,19 +283,428 @@ def _check_response(response, expected_status=200):
     raise cls(message=message, text=text, status_code=response.status) from None
 
 
+class RcpHttpTransport(object):
+    """
+    RCP+ over HTTP, one GET /rcp.xml per command
+    Connections are kept alive in a per-camera pool
+    Request timeout covers the whole request, connect and read timeouts (seconds) optionally bound
+    TCP connection establishment and each socket read
+    With trace_connections, time waiting for a pooled connection and opening a new one is recorded in ServerTiming of requests
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self, url, auth=None, timeout=1, session=None, pool_size=10, keepalive_timeout=30, connect_timeout=None, read_timeout=None, trace_connections=False  # pylint: disable=bad-continuation
+    ):
+        self.url = url
+        self.auth = auth
+        self.timeout = aiohttp.ClientTimeout(total=timeout, sock_connect=connect_timeout, sock_read=read_timeout)
+        self.session = session
+        self.ext_session = True
+        if self.session is None:
+            self.ext_session = False
+            # aiohttp only pays for tracing when trace configs are given
+            trace_configs = [self._connections_trace_config()] if trace_connections else None
+            self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=pool_size, keepalive_timeout=keepalive_timeout), trace_configs=trace_configs)
+
+    @staticmethod
+    def _connections_trace_config():
+        """ Record connection pool wait ("pool") and connection establishment ("connect") in ServerTiming given as trace_request_ctx """
+
+        def phase(name, end):
+            @asyncio.coroutine
+            def on_event(_, trace_config_ctx, __):
+                timing = trace_config_ctx.trace_request_ctx
+                if timing is not None:
+                    if end:
+                        timing.stop(name)
+                    else:
+                        timing.start(name)
+
+            return on_event
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_queued_start.append(phase("pool", False))
+        trace_config.on_connection_queued_end.append(phase("pool", True))
+        trace_config.on_connection_create_start.append(phase("connect", False))
+        trace_config.on_connection_create_end.append(phase("connect", True))
+        return trace_config
+
+    @asyncio.coroutine
+    def request(self, method, path, expected_status=200, params=None, timing=None):  # pylint: disable=too-many-arguments
+        """ Perform actual HTTP request """
+
+        path = "/" + path.lstrip("/")
+        try:
+            response = yield from self.session.request(method, self.url + path, timeout=self.timeout, params=params, auth=self.auth, trace_request_ctx=timing)
+            # Read body so connection goes back to the pool instead of being closed
+            text = yield from response.text()
+        except (asyncio.TimeoutError, aiohttp.ClientError) as exc:
+            raise RcpException("%s: %s" % (exc.__class__.__name__, exc)) from None
+
+        yield from _check_response(response, expected_status)
+        return text
+
+    @staticmethod
+    def format_payload(data_type, payload):
+        """ Turn payload bytes into rcp.xml payload query param """
+
+        if not isinstance(payload, bytes):
+            return payload
+        if data_type == "P_OCTET":
+            return "0x" + payload.hex()
+        if data_type == "P_STRING":
+            return payload.split(b"\x00", 1)[0].decode("utf-8")
+        if data_type == "P_UNICODE":
+            return payload.decode("utf-16-be").rstrip("\x00")
+        return str(struct.unpack(INT_FORMATS[data_type], payload)[0])
+
+    @staticmethod
+    def parse_reply(text, command, data_type, direction):
+        """
+        Extract rcp.xml result as raw bytes, same as binary transport replies
+        Raise RcpCommandException when camera answered with an error code
+        """
+
+        # Write replies are almost always empty, do not pay for XML parsing
+        if direction == "WRITE" and "<err>" not in text:
+            return b""
+
+        try:
+            result = xml.etree.ElementTree.fromstring(text).find("result")
+        except xml.etree.ElementTree.ParseError as exc:
+            raise RcpException("Malformed rcp.xml reply: %s" % exc) from None
+        if result is None:
+            raise RcpException("Malformed rcp.xml reply: no result")
+
+        error = result.findtext("err")
+        if error is not None:
+            raise RcpCommandException(int(error, 16), command)
+
+        if data_type == "P_OCTET":
+            return bytes.fromhex(result.findtext("str", "").strip())
+        if data_type == "P_STRING":
+            return result.findtext("str", "").encode("utf-8")
+        if data_type == "P_UNICODE":
+            return result.findtext("str", "").encode("utf-16-be")
+        value = result.findtext("dec")
+        if value is None:
+            return b""
+        return struct.pack(INT_FORMATS[data_type], int(value))
+
+    @asyncio.coroutine
+    def command(self, command, data_type, direction, num=1, payload=None, timing=None):  # pylint: disable=too-many-arguments
+        """ Send RCP+ command using rcp.xml query params, return reply payload """
+
+        params = {"command": "0x%04X" % command, "type": data_type, "direction": direction, "num": num}
+        if payload is not None:
+            params["payload"] = self.format_payload(data_type, payload)
+        text = yield from self.request("GET", "/rcp.xml", params=params, timing=timing)
+        return self.parse_reply(text, command, data_type, direction)
+
+    @asyncio.coroutine
+    def ping(self):
+        """
+        Cheapest possible request, used to open or keep alive a connection to camera and to probe its health:
+        any answer but a server error means camera is up
+        """
+
+        try:
+            yield from self.request("GET", "/")
+        except RcpHttpInternalServerErrorException:
+            raise
+        except RcpHttpException:
+            pass
+
+    @asyncio.coroutine
+    def close(self):
+        """ Close HTTP session unless it has been provided """
+
+        if not self.ext_session:
+            yield from self.session.close()
+
+
+class RcpTcpTransport(object):  # pylint: disable=too-many-instance-attributes
+    """
+    RCP+ over one long-lived binary TCP session per camera
+
+    Each frame is a 4 bytes TPKT header (version, reserved, total length) followed by a 16 bytes RCP+ header:
+    tag, data type, version/read-write, continuation/action, reserved, client id, session id, numeric descriptor, payload length
+    (version and read-write are the high and low nibbles of one byte, as continuation and action)
+    Session is opened with CONF_RCP_CONNECT_PRIMITIVE carrying "+username:password+" plain authentication.
+    Requests are pipelined on the same connection, replies come back in order and are matched first in first out.
+    """
+
+    TPKT_HEADER = struct.Struct(">BBH")
+    RCP_HEADER = struct.Struct(">HBBBBHIHH")
+    TPKT_VERSION = 0x03
+    RCP_VERSION = 0x03
+    DATA_TYPES = {"F_FLAG": 0x00, "T_OCTET": 0x01, "T_WORD": 0x02, "T_INT": 0x04, "T_DWORD": 0x08, "P_OCTET": 0x0C, "P_STRING": 0x10, "P_UNICODE": 0x14}
+    DIRECTIONS = {"READ": 0x00, "WRITE": 0x01}
+    ACTION_REQUEST = 0x00
+    ACTION_REPLY = 0x01
+    ACTION_MESSAGE = 0x02
+    ACTION_ERROR = 0x03
+    CONNECT_COMMAND = 0xFF0C
+    CONNECT_OK = 0x01
+    KEEPALIVE_COMMAND = 0x002E
+    CLIENT_ID = 0x0001
+
+    def __init__(self, host, port=1756, username=None, password=None, timeout=1, connect_timeout=None, read_timeout=None):  # pylint: disable=too-many-arguments
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.connect_timeout = connect_timeout if connect_timeout is not None else timeout
+        self.read_timeout = read_timeout if read_timeout is not None else timeout
+        self.session_id = 0
+        self.reader = None
+        self.writer = None
+        self._reader_task = None
+        self._pending = collections.deque()
+        self._connect_lock = asyncio.Lock()
+        self._drain_lock = asyncio.Lock()
+
+    @classmethod
+    def encode_frame(cls, command, data_type, direction, action, session_id=0, num=1, payload=b""):  # pylint: disable=too-many-arguments
+        """ Build one binary RCP+ frame """
+
+        length = cls.TPKT_HEADER.size + cls.RCP_HEADER.size + len(payload)
+        return (
+            cls.TPKT_HEADER.pack(cls.TPKT_VERSION, 0, length)
+            + cls.RCP_HEADER.pack(command, cls.DATA_TYPES[data_type], cls.RCP_VERSION << 4 | cls.DIRECTIONS[direction], action, 0, cls.CLIENT_ID, session_id, num, len(payload))
+            + payload
+        )
+
+    @classmethod
+    @asyncio.coroutine
+    def read_frame(cls, reader):
+        """ Read one binary RCP+ frame, return (tag, direction, action, session_id, num, payload) """
+
+        header = yield from reader.readexactly(cls.TPKT_HEADER.size + cls.RCP_HEADER.size)
+        _, _, length = cls.TPKT_HEADER.unpack_from(header)
+        tag, _, direction, action, _, _, session_id, num, _ = cls.RCP_HEADER.unpack_from(header, cls.TPKT_HEADER.size)
+        payload = yield from reader.readexactly(length - len(header))
+        return tag, direction & 0x0F, action & 0x0F, session_id, num, payload
+
+    @classmethod
+    def encode_payload(cls, data_type, payload):
+        """ Turn rcp.xml style payload (hex string, string or integer) into bytes """
+
+        if payload is None:
+            return b""
+        if isinstance(payload, bytes):
+            return payload
+        if data_type == "P_OCTET":
+            assert isinstance(payload, str) and payload.lower().startswith("0x"), "P_OCTET payload must be an hexadecimal string"
+            return bytes.fromhex(payload[2:])
+        if data_type == "P_STRING":
+            return payload.encode("utf-8") + b"\x00"
+        if data_type == "P_UNICODE":
+            return payload.encode("utf-16-be") + b"\x00\x00"
+        return struct.pack(INT_FORMATS[data_type], int(payload))
+
+    def _connect_payload(self):
+        """ CONF_RCP_CONNECT_PRIMITIVE payload: connect action, RCP+ method, then plain authentication """
+
+        auth = "+%s:%s+" % (self.username or "", self.password or "")
+        return bytes([0x01, 0x01, 0x00, 0x00]) + auth.encode("utf-8")
+
+    @asyncio.coroutine
+    def _connect(self):
+        """ Open TCP connection and RCP+ session unless already done """
+
+        yield from self._connect_lock.acquire()
+        try:
+            if self.writer is not None:
+                return
+            try:
+                self.reader, self.writer = yield from asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.connect_timeout)
+            except (asyncio.TimeoutError, OSError) as exc:
+                raise RcpException("%s: %s" % (exc.__class__.__name__, exc)) from None
+            self._reader_task = asyncio.ensure_future(self._read_replies())
+
+            try:
+                session_id, reply = yield from self._send(self.CONNECT_COMMAND, "P_OCTET", "WRITE", 1, self._connect_payload())
+            except RcpException as exc:
+                self._disconnect(exc)
+                raise
+            if not reply or reply[0] != self.CONNECT_OK:
+                self._disconnect(RcpException("RCP+ session refused"))
+                raise RcpHttpUnauthorizedException(message="401 Unauthorized", text="RCP+ session refused", status_code=401)
+            self.session_id = session_id
+        finally:
+            self._connect_lock.release()
+
+    def _disconnect(self, exc):
+        """ Drop connection and fail all requests waiting for a reply """
+
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = None
+        self.writer = None
+        self.session_id = 0
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+        self._reader_task = None
+        while self._pending:
+            waiter = self._pending.popleft()
+            if not waiter.done():
+                waiter.set_exception(exc)
+
+    @asyncio.coroutine
+    def _send(self, command, data_type, direction, num, payload):  # pylint: disable=too-many-arguments
+        """ Write one request frame and wait for its reply, return (session_id, payload) """
+
+        if self.writer is None:
+            raise RcpException("Connection to camera lost")
+
+        waiter = asyncio.Future()
+        self._pending.append(waiter)
+        try:
+            self.writer.write(self.encode_frame(command, data_type, direction, self.ACTION_REQUEST, self.session_id, num, payload))
+            # Frames are written in order right away, a slow camera must not let write buffer grow without bound
+            yield from asyncio.wait_for(self._drain(), self.read_timeout)
+            return (yield from asyncio.wait_for(waiter, self.read_timeout))
+        except asyncio.TimeoutError:
+            # Replies are matched in order, a late one would be given to the next request
+            self._disconnect(RcpException("Connection reset after timeout"))
+            raise RcpException("TimeoutError: no RCP+ reply within %ss" % self.read_timeout) from None
+        except OSError as exc:
+            self._disconnect(RcpException("%s: connection to camera lost" % exc.__class__.__name__))
+            raise RcpException("%s: %s" % (exc.__class__.__name__, exc)) from None
+
+    @asyncio.coroutine
+    def _drain(self):
+        """ Wait for write buffer to go below its high water mark, one pipelined request at a time """
+
+        yield from self._drain_lock.acquire()
+        try:
+            if self.writer is not None:
+                yield from self.writer.drain()
+        finally:
+            self._drain_lock.release()
+
+    @asyncio.coroutine
+    def _read_replies(self):
+        """ Dispatch replies to pending requests, in order """
+
+        try:
+            while True:
+                tag, _, action, session_id, _, payload = yield from self.read_frame(self.reader)
+                if action == self.ACTION_MESSAGE:
+                    continue
+                waiter = self._pending.popleft() if self._pending else None
+                if waiter is None or waiter.done():
+                    continue
+                if action == self.ACTION_ERROR:
+                    waiter.set_exception(RcpCommandException(payload[0] if payload else 0, tag))
+                else:
+                    waiter.set_result((session_id, payload))
+        except (asyncio.IncompleteReadError, OSError) as exc:
+            self._reader_task = None
+            self._disconnect(RcpException("%s: connection to camera lost" % exc.__class__.__name__))
+
+    @asyncio.coroutine
+    def command(self, command, data_type, direction, num=1, payload=None, timing=None):  # pylint: disable=too-many-arguments
+        """ Send RCP+ command on the persistent session, return reply payload """
+
+        connecting = timing is not None and self.writer is None
+        if connecting:
+            timing.start("connect")
+        yield from self._connect()
+        if connecting:
+            timing.stop("connect")
+        _, reply = yield from self._send(command, data_type, direction, num, self.encode_payload(data_type, payload))
+        return reply
+
+    @asyncio.coroutine
+    def ping(self):
+        """ Harmless read keeping the session alive """
+
+        yield from self.command(self.KEEPALIVE_COMMAND, "P_STRING", "READ")
+
+    @asyncio.coroutine
+    def close(self):
+        """ Close RCP+ session """
+
+        self._disconnect(RcpException("Transport closed"))
+
+
+TRANSPORTS = {"http": RcpHttpTransport, "tcp": RcpTcpTransport}
+# Writes over rate limit are either folded into latest one once a token is available, or rejected with 429
+RATE_LIMIT_MODES = ("coalesce", "reject")
+
+
+PTZ_MOVE = register_command("ptz_move", 0x09A5, "P_OCTET", "WRITE", encoder=encode_ptz_move)
+PTZ_POSITION = register_command("ptz_position", 0x09A5, "P_OCTET", "READ", encoder=encode_ptz_position_read, decoder=decode_ptz_position)
+PTZ_PRESET_STORE = register_command("ptz_preset_store", 0x09A5, "P_OCTET", "WRITE", encoder=encode_ptz_preset_store)
+PTZ_PRESET_RECALL = register_command("ptz_preset_recall", 0x09A5, "P_OCTET", "WRITE", encoder=encode_ptz_preset_recall)
+
+
+class _QueuedWrite(object):  # pylint: disable=too-few-public-methods
+    """
+    RCP+ write waiting for its turn in the camera pipeline
+    All callers folded into this write are notified through waiters futures, and get its phases in their ServerTiming
+    """
+
+    __slots__ = ("command", "payload", "stop", "waiters", "timings", "submitted_at")
+
+    def __init__(self, command, payload, stop):
+        self.command = command
+        self.payload = payload
+        self.stop = stop
+        self.waiters = []
+        self.timings = []
+        self.submitted_at = asyncio.get_event_loop().time()
+
+
 class AsyncRcpClient(object):  # pylint: disable=too-many-instance-attributes
-    """ aiohttp asynchronous RCP client """
+    """
+    aiohttp asynchronous RCP client
+    RCP+ commands go through HTTP rcp.xml (transport="http") or a persistent binary TCP session (transport="tcp")
+    """
 
-    BITCOM_ID = "0x800006011085"
     PTZ_SPEED_MIN = 0
     PTZ_SPEED_MAX = 7
+    PTZ_AXES = ("left", "right", "up", "down", "zin", "zout")
+    PTZ_EXCLUSIVE_AXES = (("left", "right"), ("up", "down"), ("zin", "zout"))
+    PTZ_PRESET_MIN = 1
+    PTZ_PRESET_MAX = 256
 
     def __init__(  # pylint: disable=too-many-arguments
-        self, url="http://localhost", timeout=1, session=None, username=None, password=None, name="Unspecified"  # pylint: disable=bad-continuation
+        self,
+        url="http://localhost",
+        timeout=1,
+        connect_timeout=None,
+        read_timeout=None,
+        session=None,
+        username=None,
+        password=None,
+        name="Unspecified",
+        pool_size=10,
+        keepalive_timeout=30,
+        keepalive_interval=10,
+        prewarm_connections=1,
+        refresh_window=1,
+        transport="http",
+        tcp_port=1756,
+        position_ttl=0.5,
+        breaker_failures=3,
+        breaker_reset_timeout=5,
+        stop_retries=3,
+        stop_retry_backoff=0.05,
+        stop_hedge_delay=0,
+        move_log_interval=1,
+        server_timing=False,
+        rate_limit=0,
+        rate_limit_burst=5,
+        rate_limit_mode="coalesce",
     ):
 
         assert isinstance(url, str) and str, "url must be a non-empty string"
-        assert isinstance(timeout, int) and timeout > 0, "timeout must be a integer (seconds)"
+        assert isinstance(timeout, (int, float)) and timeout > 0, "timeout must be a positive number (seconds)"
+        for value, arg in ((connect_timeout, "connect_timeout"), (read_timeout, "read_timeout")):
+            assert value is None or (isinstance(value, (int, float)) and 0 < value <= timeout), "%s must be a positive number (seconds) not above timeout, or None" % arg
         if session is not None:
             assert isinstance(session, aiohttp.ClientSession), "session must be a aiohttp.ClientSession instance or None"
         if username is not None:
@@ -115,130 +714,612 @@ class AsyncRcpClient(object):  # pylint: disable=too-many-instance-attributes
             assert isinstance(password, str) and str, "password must be a non-empty string or None"
             assert username is not None, "username and password must be specified or none of them"
         assert isinstance(name, str) and name, "name must be a non-empty string"
+        assert isinstance(pool_size, int) and pool_size > 0, "pool_size must be a positive integer"
+        assert isinstance(keepalive_timeout, (int, float)) and keepalive_timeout > 0, "keepalive_timeout must be a positive number (seconds)"
+        assert isinstance(keepalive_interval, (int, float)) and keepalive_interval >= 0, "keepalive_interval must be a positive number (seconds) or 0 to disable"
+        assert isinstance(prewarm_connections, int) and 0 <= prewarm_connections <= pool_size, "prewarm_connections must be an integer between 0 and pool_size"
+        assert isinstance(refresh_window, (int, float)) and refresh_window >= 0, "refresh_window must be a positive number (seconds) or 0 to disable"
+        assert transport in TRANSPORTS, "transport must be one of %s" % sorted(TRANSPORTS.keys())
+        assert isinstance(tcp_port, int) and 0 < tcp_port < 65536, "tcp_port must be a valid TCP port"
+        assert isinstance(position_ttl, (int, float)) and position_ttl >= 0, "position_ttl must be a positive number (seconds) or 0 to disable cache"
+        assert isinstance(stop_retries, int) and stop_retries >= 0, "stop_retries must be a positive integer or 0 to disable"
+        assert isinstance(stop_retry_backoff, (int, float)) and stop_retry_backoff >= 0, "stop_retry_backoff must be a positive number (seconds)"
+        assert isinstance(stop_hedge_delay, (int, float)) and stop_hedge_delay >= 0, "stop_hedge_delay must be a positive number (seconds) or 0 to disable"
+        assert isinstance(move_log_interval, (int, float)) and move_log_interval >= 0, "move_log_interval must be a positive number (seconds) or 0 to log every move"
+        assert isinstance(rate_limit, (int, float)) and rate_limit >= 0, "rate_limit must be a positive number (writes per second) or 0 to disable"
+        assert rate_limit_mode in RATE_LIMIT_MODES, "rate_limit_mode must be one of %s" % ", ".join(RATE_LIMIT_MODES)
 
         self.url = url.rstrip("/")
         self.timeout = timeout
-        self.session = session
-        self.ext_session = True
-        if self.session is None:
-            self.ext_session = False
-            self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=10))
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.keepalive_interval = keepalive_interval
+        self.prewarm_connections = prewarm_connections
+        self.refresh_window = refresh_window
+        self.position_ttl = position_ttl
+        self.stop_retries = stop_retries
+        self.stop_retry_backoff = stop_retry_backoff
+        self.stop_hedge_delay = stop_hedge_delay
+        self.move_log_interval = move_log_interval
+        self.rate_limiter = TokenBucket(rate_limit, burst=rate_limit_burst) if rate_limit else None
+        self.rate_limit_mode = rate_limit_mode
         self.username = username
         self.password = password
         self.auth = None
         if self.username is not None:
             self.auth = aiohttp.helpers.BasicAuth(self.username, self.password)
+        if transport == "tcp":
+            self.transport = RcpTcpTransport(
+                urllib.parse.urlparse(self.url).hostname, port=tcp_port, username=username, password=password, timeout=timeout, connect_timeout=connect_timeout, read_timeout=read_timeout
+            )
+        else:
+            self.transport = RcpHttpTransport(
+                self.url,
+                auth=self.auth,
+                timeout=timeout,
+                session=session,
+                pool_size=pool_size,
+                keepalive_timeout=keepalive_timeout,
+                connect_timeout=connect_timeout,
+                read_timeout=read_timeout,
+                trace_connections=server_timing,
+            )
         self.name = name
         self.logger = logging.getLogger(self.__class__.__name__ + "@" + self.name)
-        self.logger.info("Initialized at %s", self.url)
+        self._write_queue = collections.deque()
+        self._pipeline_task = None
+        self._in_flight_write = None
+        self._token_waiter = None
+        self._keepalive_task = None
+        self._last_activity = 0
+        self._last_payload = None
+        self._last_payload_at = 0
+        self._moving = False
+        self._move_logged_at = None
+        self._moves_not_logged = 0
+        self._position = None
+        self._position_at = 0
+        self._position_read = None
+        self.breaker = CircuitBreaker(failure_threshold=breaker_failures, reset_timeout=breaker_reset_timeout)
+        self._health_task = None
+        self._metric_duration = RCP_REQUEST_DURATION.labels(self.name)
+        self._metric_in_flight = RCP_REQUESTS_IN_FLIGHT.labels(self.name)
+        self._metric_writes_sent = RCP_WRITES.labels(self.name, "sent")
+        self._metric_writes_skipped = RCP_WRITES.labels(self.name, "skipped")
+        self._metric_writes_coalesced = RCP_WRITES.labels(self.name, "coalesced")
+        self._metric_position_reads = {x: RCP_POSITION_READS.labels(self.name, x) for x in ("cached", "shared", "sent")}
+        self._metric_circuit_open = RCP_CIRCUIT_OPEN.labels(self.name)
+        self._metric_stop_duration = RCP_STOP_DURATION.labels(self.name)
+        self._metric_stop_attempts = {x: RCP_STOP_ATTEMPTS.labels(self.name, x) for x in ("early", "retry", "hedge")}
+        self._metric_rate_limited = {x: RCP_WRITES_RATE_LIMITED.labels(self.name, x) for x in ("rejected", "delayed")}
+        self.logger.info("Initialized at %s using %s transport", self.url, transport)
+
+    @property
+    def counters(self):
+        """ Number of PTZ writes sent, skipped as redundant or coalesced into a newer one """
+
+        return {
+            "writes_sent": self._metric_writes_sent.value,
+            "writes_skipped": self._metric_writes_skipped.value,
+            "writes_coalesced": self._metric_writes_coalesced.value,
+        }
+
+    @property
+    def moving(self):
+        """ Tell if last move submitted to camera was not a stop """
+
+        return self._moving
+
+    @asyncio.coroutine
+    def start(self):
+        """
+        Open connections to camera ahead of first move
+        and start background task keeping them warm
+        """
+
+        yield from self._prewarm()
+        if self.keepalive_interval and self.prewarm_connections:
+            self._keepalive_task = asyncio.ensure_future(self._keep_connections_warm())
+
+    @asyncio.coroutine
+    def drain(self, timeout):
+        """ Wait up to timeout seconds for queued writes to be sent, close() would fail them """
+
+        if self._pipeline_task is not None:
+            yield from asyncio.wait([self._pipeline_task], timeout=timeout)
 
     @asyncio.coroutine
     def close(self):
         """ Kill asyncio session on shutdown """
 
-        if not self.ext_session:
-            yield from self.session.close()
+        if self._keepalive_task is not None:
+            self._keepalive_task.cancel()
+        if self._pipeline_task is not None:
+            self._pipeline_task.cancel()
+        if self._position_read is not None:
+            self._position_read.cancel()
+        if self._health_task is not None:
+            self._health_task.cancel()
+        self._fail_queued_writes(RcpException("Client closed before write has been sent"))
+
+        yield from self.transport.close()
         self.logger.info("Stopped")
 
     @asyncio.coroutine
-    def _request(self, method, path, expected_status=200, params=None):
-        """ Perform actual HTTP request """
+    def _instrumented(self, coro, timing=None):
+        """ Run a transport coroutine, recording latency, in-flight requests and errors, and camera round trip in timing if given """
 
-        path = "/" + path.lstrip("/")
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+        self._metric_in_flight.inc()
         try:
-            response = yield from self.session.request(method, self.url + path, timeout=self.timeout, params=params, auth=self.auth)
-        except (asyncio.TimeoutError, aiohttp.ClientError) as exc:
-            raise RcpException("%s: %s" % (exc.__class__.__name__, exc)) from None
+            result = yield from coro
+            self._last_activity = loop.time()
+        except RcpException as exc:
+            RCP_REQUEST_ERRORS.labels(self.name, exc.__class__.__name__).inc()
+            if self._is_camera_failure(exc):
+                self._record_failure(exc)
+            else:
+                self._record_success()
+            raise
+        else:
+            self._record_success()
+            return result
+        finally:
+            self._metric_in_flight.dec()
+            duration = loop.time() - start
+            self._metric_duration.observe(duration)
+            if timing is not None:
+                timing.add("camera", duration)
 
-        yield from _check_response(response, expected_status)
+    @staticmethod
+    def _is_camera_failure(exc):
+        """ Camera unreachable, too slow or failing server side, as opposed to a refused request """
+        return isinstance(exc, RcpHttpInternalServerErrorException) or not isinstance(exc, (RcpHttpException, RcpCommandException))
+
+    def _record_success(self):
+        """ Close circuit breaker """
+
+        if self.breaker.record_success():
+            self._metric_circuit_open.set(0)
+            self.logger.info("Camera is healthy again, circuit closed")
+
+    def _record_failure(self, exc):
+        """ Count failure, start probing camera once circuit opens """
+
+        if self.breaker.record_failure(exc):
+            self._metric_circuit_open.set(1)
+            self.logger.warning("Camera is unhealthy after %d consecutive failures, circuit open: %s", self.breaker.failures, self.breaker.last_error)
+        if not self.breaker.closed and self._health_task is None:
+            self._health_task = asyncio.ensure_future(self._probe_until_healthy())
+
+    def _check_circuit(self):
+        """ Fail right away while camera is known to be unhealthy """
+
+        if not self.breaker.closed:
+            raise RcpHttpServiceUnavailableException(
+                message="503 Service Unavailable", text="camera %s is unhealthy (%s)" % (self.name, self.breaker.last_error), status_code=503
+            )
 
     @asyncio.coroutine
-    def move_ptz(  # pylint: disable=too-many-arguments,invalid-name,too-many-branches,too-many-statements
-        self, left=0, right=0, up=0, down=0, zin=0, zout=0, stop=False  # pylint: disable=bad-continuation
-    ):
-        """ Call RCP+ and request for PTZ move """
+    def _probe_until_healthy(self):
+        """ Let one probe go through every reset_timeout until camera answers """
 
-        if isinstance(left, str) and left.isdigit():
-            left = int(left)
-            assert (
-                isinstance(left, int) and left <= self.PTZ_SPEED_MAX and left >= self.PTZ_SPEED_MIN
-            ), "PTZ speed (left axis) must be between 0 and 7 (int)"
-        if isinstance(right, str) and right.isdigit():
-            right = int(right)
-            assert (
-                isinstance(right, int) and right <= self.PTZ_SPEED_MAX and right >= self.PTZ_SPEED_MIN
-            ), "PTZ speed (right axis) must be between 0 and 7 (int)"
-        if isinstance(up, str) and up.isdigit():
-            up = int(up)
-            assert isinstance(up, int) and up <= self.PTZ_SPEED_MAX and up >= self.PTZ_SPEED_MIN, "PTZ speed (up axis) must be between 0 and 7 (int)"
-        if isinstance(down, str) and down.isdigit():
-            down = int(down)
-            assert (
-                isinstance(down, int) and down <= self.PTZ_SPEED_MAX and down >= self.PTZ_SPEED_MIN
-            ), "PTZ speed (down axis) must be between 0 and 7 (int)"
-        if isinstance(zin, str) and zin.isdigit():
-            zin = int(zin)
-            assert (
-                isinstance(zin, int) and zin <= self.PTZ_SPEED_MAX and zin >= self.PTZ_SPEED_MIN
-            ), "PTZ speed (zin axis) must be between 0 and 7 (int)"
-        if isinstance(zout, str) and zout.isdigit():
-            zout = int(zout)
+        try:
+            while not self.breaker.closed:
+                yield from asyncio.sleep(self.breaker.reset_timeout)
+                self.breaker.half_open()
+                try:
+                    yield from self._ping()
+                except RcpException:
+                    pass
+        finally:
+            self._health_task = None
+
+    @property
+    def health(self):
+        """ Circuit breaker state of this camera """
+        return self.breaker.as_dict()
+
+    @asyncio.coroutine
+    def _request(self, command, payload=None, timing=None):
+        """ Perform actual RCP+ request through configured transport, return reply payload bytes """
+
+        self._check_circuit()
+        return (yield from self._instrumented(self.transport.command(command.command, command.data_type, command.direction, num=command.num, payload=payload, timing=timing), timing=timing))
+
+    @asyncio.coroutine
+    def execute(self, command, *args, **kwargs):
+        """
+        Run any registered RCP+ command right away and return decoded reply
+        :param command: RcpCommand or its name in RCP_COMMANDS
+        Extra arguments are given to command encoder
+        """
+
+        if not isinstance(command, RcpCommand):
+            assert command in RCP_COMMANDS, "Unknown RCP+ command %s" % command
+            command = RCP_COMMANDS[command]
+
+        reply = yield from self._request(command, payload=command.encode(*args, **kwargs))
+        return command.decode(reply)
+
+    @asyncio.coroutine
+    def _ping(self):
+        """ Cheapest possible request, only used to open or keep alive a connection to camera """
+
+        yield from self._instrumented(self.transport.ping())
+
+    @asyncio.coroutine
+    def _prewarm(self):
+        """ Open prewarm_connections connections to camera concurrently """
+
+        if not self.prewarm_connections:
+            return
+
+        results = yield from asyncio.gather(*[self._ping() for _ in range(self.prewarm_connections)], return_exceptions=True)
+        errors = [x for x in results if isinstance(x, Exception)]
+        if errors:
+            self.logger.warning("Unable to prewarm connection(s) to camera: %s", errors[0])
+        else:
+            self.logger.debug("Prewarmed %d connection(s) to camera", self.prewarm_connections)
+
+    @asyncio.coroutine
+    def _keep_connections_warm(self):
+        """
+        Ping camera periodically when idle so the first move after a pause
+        does not pay for TCP (and HTTP auth) setup
+        """
+
+        loop = asyncio.get_event_loop()
+        while True:
+            yield from asyncio.sleep(self.keepalive_interval)
+            if loop.time() - self._last_activity >= self.keepalive_interval:
+                yield from self._prewarm()
+
+    def _submit_write(self, command, payload, stop=False, timing=None):
+        """
+        Queue a RCP+ write in this camera pipeline
+        Return a future resolved once the write (or a newer one replacing it) has been applied
+        Time spent in queue and sending the write is recorded in timing if given
+
+        At most one write is in flight per camera, a move waiting in queue is replaced by
+        newer ones (latest wins) so camera never lags more than one round trip behind the
+        operator, while a stop is never replaced nor dropped and is tried even if camera
+        looks unhealthy or rate limit is reached
+        """
+
+        if not stop:
+            self._check_circuit()
+            if self.rate_limit_mode == "reject" and self.rate_limiter is not None and not self.rate_limiter.take():
+                self._metric_rate_limited["rejected"].inc()
+                raise RcpHttpTooManyRequestsException(
+                    message="429 Too Many Requests", text="camera %s accepts %s write(s) per second" % (self.name, self.rate_limiter.rate), status_code=429
+                )
+        waiter = asyncio.Future()
+
+        superseded, superseded_timings = [], []
+        if self._write_queue and not self._write_queue[-1].stop:
+            replaced = self._write_queue.pop()
+            superseded, superseded_timings = replaced.waiters, replaced.timings
+
+        if stop and self._write_queue and self._write_queue[-1].stop:
+            write = self._write_queue[-1]
+        else:
+            write = _QueuedWrite(command, payload, stop)
+            self._write_queue.append(write)
+        write.waiters.extend(superseded)
+        write.waiters.append(waiter)
+        write.timings.extend(superseded_timings)
+        if timing is not None:
+            timing.start("queue")
+            write.timings.append(timing)
+
+        if superseded:
+            # One queued write replaced, whatever the number of callers already folded into it
+            self._metric_writes_coalesced.inc()
+            self.logger.debug("Coalesced queued write of %d caller(s) into latest one", len(superseded))
+
+        # Do not wait for move in flight, queued stop is still sent after it in case it lands last
+        if stop and self._in_flight_write is not None and not self._in_flight_write.stop:
+            self._metric_stop_attempts["early"].inc()
+            asyncio.ensure_future(self._send_early_stop(payload))
+
+        # Queued move waiting for a token has been replaced, stop must not wait
+        if stop and self._token_waiter is not None and not self._token_waiter.done():
+            self._token_waiter.set_result(None)
+
+        if self._pipeline_task is None:
+            self._pipeline_task = asyncio.ensure_future(self._run_pipeline())
+
+        return waiter
+
+    def _rate_limited(self, write):
+        """ Tell if write must wait for a token before being sent, takes the token otherwise """
+
+        if write.stop or self.rate_limiter is None or self.rate_limit_mode != "coalesce":
+            return False
+        return not self.rate_limiter.take()
+
+    @asyncio.coroutine
+    def _wait_for_token(self):
+        """ Wait until rate limiter has a token, or a stop has been queued """
+
+        self._metric_rate_limited["delayed"].inc()
+        self._token_waiter = asyncio.Future()
+        try:
+            yield from asyncio.wait([self._token_waiter], timeout=self.rate_limiter.wait_time())
+        finally:
+            self._token_waiter = None
+
+    @asyncio.coroutine
+    def _run_pipeline(self):
+        """ Send queued writes one after the other until queue is empty """
+
+        try:
+            while self._write_queue:
+                # Newer moves keep replacing the queued one while it waits, only latest is sent
+                if self._rate_limited(self._write_queue[0]):
+                    self._in_flight_write = None
+                    yield from self._wait_for_token()
+                    continue
+                write = self._write_queue.popleft()
+                self._in_flight_write = write
+                # Measured once for all callers folded into this write
+                timing = None
+                if write.timings:
+                    timing = ServerTiming()
+                    for caller_timing in write.timings:
+                        caller_timing.stop("queue")
+                try:
+                    if write.stop:
+                        yield from self._deliver_stop(write.payload, timing=timing)
+                        self._metric_stop_duration.observe(asyncio.get_event_loop().time() - write.submitted_at)
+                    else:
+                        yield from self._request(write.command, payload=write.payload, timing=timing)
+                except asyncio.CancelledError:
+                    self._notify_waiters(write.waiters, exc=RcpException("Client closed while write was in flight"))
+                    raise
+                except Exception as exc:  # pylint: disable=broad-except
+                    # Camera state is unknown, next move must not be skipped as redundant
+                    self._last_payload = None
+                    self._notify_waiters(write.waiters, exc=exc)
+                else:
+                    self._metric_writes_sent.inc()
+                    self._notify_waiters(write.waiters)
+                finally:
+                    # Callers only resume on next loop iteration, their timings are complete by then
+                    for caller_timing in write.timings:
+                        caller_timing.merge(timing)
+        finally:
+            self._in_flight_write = None
+            self._pipeline_task = None
+
+    @asyncio.coroutine
+    def _send_stop_once(self, payload, timing=None):
+        """
+        Send one stop, bypassing circuit breaker
+        A second request is hedged when first one is not answered within stop_hedge_delay, only first one is recorded in timing
+        """
+
+        def send(timing=None):
+            return asyncio.ensure_future(
+                self._instrumented(self.transport.command(PTZ_MOVE.command, PTZ_MOVE.data_type, PTZ_MOVE.direction, num=PTZ_MOVE.num, payload=payload, timing=timing), timing=timing)
+            )
+
+        first = send(timing)
+        if not self.stop_hedge_delay:
+            return (yield from first)
+
+        pending = {first}
+        try:
+            done, pending = yield from asyncio.wait(pending, timeout=self.stop_hedge_delay)
+            if not done:
+                self._metric_stop_attempts["hedge"].inc()
+                pending.add(send())
+            error = None
+            while True:
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+                if not pending:
+                    raise error
+                done, pending = yield from asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in pending:
+                task.cancel()
+
+    @asyncio.coroutine
+    def _deliver_stop(self, payload, timing=None):
+        """ Send stop, retrying camera failures up to stop_retries times with exponential backoff """
+
+        delay = self.stop_retry_backoff
+        for attempt in range(self.stop_retries + 1):
+            if attempt:
+                self._metric_stop_attempts["retry"].inc()
+            try:
+                return (yield from self._send_stop_once(payload, timing=timing))
+            except RcpException as exc:
+                if attempt == self.stop_retries or not self._is_camera_failure(exc):
+                    raise
+                self.logger.warning("Stop attempt %d failed, retrying in %d ms: %s", attempt + 1, delay * 1000, exc)
+            yield from asyncio.sleep(delay)
+            delay *= 2
+
+    @asyncio.coroutine
+    def _send_early_stop(self, payload):
+        """ Stop camera right away while a move is in flight, queued stop remains the one that counts """
+
+        try:
+            yield from self._send_stop_once(payload)
+        except RcpException as exc:
+            self.logger.debug("Early stop failed, queued stop will follow: %s", exc)
+
+    @staticmethod
+    def _notify_waiters(waiters, exc=None):
+        """ Resolve futures of callers waiting for a write """
+
+        for waiter in waiters:
+            if waiter.done():
+                continue
+            if exc is None:
+                waiter.set_result(None)
+            else:
+                waiter.set_exception(exc)
+
+    def _is_redundant_write(self, payload, stop):
+        """
+        Tell if payload is the same move than the last one submitted within refresh_window
+        Stop is always sent, and identical moves are resent once window expired as a keepalive
+        """
+
+        return not stop and payload == self._last_payload and asyncio.get_event_loop().time() - self._last_payload_at < self.refresh_window
+
+    def _remember_write(self, payload):
+        """ Record move accepted in pipeline, a write rejected before (429, open circuit) must not make its retry redundant """
+
+        self._last_payload = payload
+        self._last_payload_at = asyncio.get_event_loop().time()
+
+    def _fail_queued_writes(self, exc):
+        """ Drop all writes not sent yet and notify their callers """
+
+        while self._write_queue:
+            self._notify_waiters(self._write_queue.popleft().waiters, exc=exc)
+
+    @asyncio.coroutine
+    def _read_position(self):
+        """ Read position from camera and cache it """
+
+        try:
+            position = yield from self.execute(PTZ_POSITION)
+            self._position = position
+            self._position_at = asyncio.get_event_loop().time()
+            return position
+        finally:
+            self._position_read = None
+
+    @asyncio.coroutine
+    def get_position(self):
+        """
+        Return current pan, tilt (degrees) and zoom of camera
+        Position is cached for position_ttl seconds and concurrent callers share the same in-flight read
+        """
+
+        if self._position is not None and asyncio.get_event_loop().time() - self._position_at < self.position_ttl:
+            self._metric_position_reads["cached"].inc()
+            return self._position
+
+        if self._position_read is None:
+            self._metric_position_reads["sent"].inc()
+            self._position_read = asyncio.ensure_future(self._read_position())
+        else:
+            self._metric_position_reads["shared"].inc()
+
+        # A cancelled caller must not cancel the read other callers are waiting for
+        return (yield from asyncio.shield(self._position_read))
+
+    def _parse_preset(self, preset):
+        """ Validate preset number """
+
+        if isinstance(preset, str) and preset.isdigit():
+            preset = int(preset)
+        assert (
+            isinstance(preset, int) and self.PTZ_PRESET_MIN <= preset <= self.PTZ_PRESET_MAX
+        ), "PTZ preset must be between %d and %d (int)" % (self.PTZ_PRESET_MIN, self.PTZ_PRESET_MAX)
+        return preset
+
+    @asyncio.coroutine
+    def store_preset(self, preset):
+        """ Store current camera position as preset """
+
+        preset = self._parse_preset(preset)
+        self.logger.info("Storing preset %d", preset)
+        yield from self.execute(PTZ_PRESET_STORE, preset)
+
+    @asyncio.coroutine
+    def recall_preset(self, preset):
+        """
+        Move camera to preset, camera stops by itself once there
+        Goes through write pipeline so it replaces a pending move and a later move replaces it
+        """
+
+        preset = self._parse_preset(preset)
+        self.logger.info("Recalling preset %d", preset)
+
+        # Camera is going somewhere else, next move must not be skipped and cached position is stale
+        self._last_payload = None
+        self._position = None
+        self._moving = False
+
+        response = yield from self._submit_write(PTZ_PRESET_RECALL, PTZ_PRESET_RECALL.encode(preset))
+        return response
+
+    def parse_move(self, left=0, right=0, up=0, down=0, zin=0, zout=0, stop=False):  # pylint: disable=too-many-arguments,invalid-name
+        """
+        Validate PTZ move (integers or digit strings)
+        Return speeds per axis and stop flag
+        """
+
+        speeds = {}
+        for axis, speed in zip(self.PTZ_AXES, (left, right, up, down, zin, zout)):
+            if isinstance(speed, str) and speed.isdigit():
+                speed = int(speed)
             assert (
-                isinstance(zout, int) and zout <= self.PTZ_SPEED_MAX and zout >= self.PTZ_SPEED_MIN
-            ), "PTZ speed (zout axis) must be between 0 and 7 (int)"
+                isinstance(speed, int) and self.PTZ_SPEED_MIN <= speed <= self.PTZ_SPEED_MAX
+            ), "PTZ speed (%s axis) must be between %d and %d (int)" % (axis, self.PTZ_SPEED_MIN, self.PTZ_SPEED_MAX)
+            speeds[axis] = speed
         if isinstance(stop, str) and stop.isdigit():
             stop = int(stop)
         assert stop in [0, 1, True, False], "Stop must be either True or False"
         stop = bool(stop)
 
         if stop:
-            assert not any([left, right, up, down, zin, zout]), "All axis must be 0 when stop=True"  # pylint: disable=multiple-statements
-        if left:
-            assert not right, "left and right move are exclusive"  # pylint: disable=multiple-statements
-        if right:
-            assert not left, "left and right move are exclusive"  # pylint: disable=multiple-statements
-        if up:
-            assert not down, "up and down move are exclusive"  # pylint: disable=multiple-statements
-        if down:
-            assert not up, "up and down move are exclusive"  # pylint: disable=multiple-statements
-        if zin:
-            assert not zout, "zin and zout move are exclusive"  # pylint: disable=multiple-statements
-        if zout:
-            assert not zin, "zin and zout move are exclusive"  # pylint: disable=multiple-statements
-
-        self.logger.info("Moving: left=%s, right=%s, up=%s, down=%s, in=%s, out=%s, stop=%s", left, right, up, down, zin, zout, stop)
-
-        action_r = [0, 0, 0, 0, 0, 0]
-        if left:
-            action_r[0] = 0
-            action_r[1] = left
-        else:
-            action_r[0] = 8
-            action_r[1] = right
-        if up:
-            action_r[2] = 8
-            action_r[3] = up
-        else:
-            action_r[2] = 0
-            action_r[3] = down
-        if zin:
-            action_r[4] = 8
-            action_r[5] = zin
-        else:
-            action_r[4] = 0
-            action_r[5] = zout
+            assert not any(speeds.values()), "All axis must be 0 when stop=True"
+        for first, second in self.PTZ_EXCLUSIVE_AXES:
+            assert not (speeds[first] and speeds[second]), "%s and %s move are exclusive" % (first, second)
 
-        if stop:
-            action = "000000"
-        else:
-            action = "".join([str(x) for x in action_r])
+        return speeds, stop
+
+    def _log_move(self, left, right, up, down, zin, zout, stop):  # pylint: disable=too-many-arguments,invalid-name
+        """
+        Log move at most once per move_log_interval, a joystick sends many of them per second
+        Stops are always logged, with the number of moves left out since last log
+        """
+
+        now = asyncio.get_event_loop().time()
+        if not stop and self._move_logged_at is not None and now - self._move_logged_at < self.move_log_interval:
+            self._moves_not_logged += 1
+            return
+
+        self.logger.info(
+            "Moving: left=%s, right=%s, up=%s, down=%s, in=%s, out=%s, stop=%s (%d move(s) not logged)", left, right, up, down, zin, zout, stop, self._moves_not_logged
+        )
+        self._move_logged_at = now
+        self._moves_not_logged = 0
+
+    @asyncio.coroutine
+    def move_ptz(  # pylint: disable=too-many-arguments,invalid-name
+        self, left=0, right=0, up=0, down=0, zin=0, zout=0, stop=False, timing=None  # pylint: disable=bad-continuation
+    ):
+        """ Call RCP+ and request for PTZ move, recording its phases in timing (ServerTiming) if given """
+
+        speeds, stop = self.parse_move(left, right, up, down, zin, zout, stop)
+        left, right, up, down, zin, zout = [speeds[x] for x in self.PTZ_AXES]
+        payload = PTZ_MOVE.encode(left, right, up, down, zin, zout, stop)
 
-        payload = self.BITCOM_ID + action
+        if self._is_redundant_write(payload, stop):
+            self._metric_writes_skipped.inc()
+            self.logger.debug("Skipping redundant move: left=%s, right=%s, up=%s, down=%s, in=%s, out=%s", left, right, up, down, zin, zout)
+            return None
 
-        rcp_path = "/rcp.xml"
-        rcp_params = {"command": "0x09A5", "type": "P_OCTET", "direction": "WRITE", "num": 1, "payload": payload}
+        waiter = self._submit_write(PTZ_MOVE, payload, stop=stop, timing=timing)
+        self._remember_write(payload)
+        if self.logger.isEnabledFor(logging.INFO):
+            self._log_move(left, right, up, down, zin, zout, stop)
+        self._moving = not stop
 
-        response = yield from self._request("GET", rcp_path, params=rcp_params)
+        response = yield from waiter
         return response
 
 
@@ -0,0 +1,76 @@
+"""
+Circuit breaker tracking camera health
+Open after consecutive failures so callers fail fast instead of waiting for timeouts,
+half-open while a probe checks whether camera is back
+"""
+
+
+# pylint: disable=line-too-long
+
+
+import asyncio
+
+
+class CircuitBreaker(object):
+    """
+    Consecutive failures counter with closed, open and half-open states
+    :param failure_threshold: Consecutive failures opening the circuit
+    :param reset_timeout: Delay before probing an open circuit (seconds)
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=3, reset_timeout=5):
+        assert isinstance(failure_threshold, int) and failure_threshold > 0, "failure_threshold must be a positive integer"
+        assert isinstance(reset_timeout, (int, float)) and reset_timeout > 0, "reset_timeout must be a positive number (seconds)"
+
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.last_error = None
+
+    @property
+    def closed(self):
+        """ Tell if requests are allowed """
+        return self.state == self.CLOSED
+
+    def record_success(self):
+        """ Close circuit, return True if it was not closed """
+
+        was_closed = self.state == self.CLOSED
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        return not was_closed
+
+    def record_failure(self, exc):
+        """ Count failure, return True if circuit has just been opened """
+
+        self.failures += 1
+        self.last_error = "%s: %s" % (exc.__class__.__name__, exc)
+        if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+            opened = self.state == self.CLOSED
+            self.state = self.OPEN
+            if opened:
+                self.opened_at = asyncio.get_event_loop().time()
+            return opened
+        return False
+
+    def half_open(self):
+        """ Let one probe go through """
+        self.state = self.HALF_OPEN
+
+    def as_dict(self):
+        """ Health state ready to be serialized """
+
+        return {
+            "healthy": self.state == self.CLOSED,
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "open_for_seconds": round(asyncio.get_event_loop().time() - self.opened_at, 3) if self.opened_at is not None else None,
+            "last_error": self.last_error,
+        }
@@ -0,0 +1,217 @@
+"""
+Minimal Prometheus metrics exposed using text format
+Updated from event loop thread only so no locking is needed,
+histograms use fixed buckets: observing is one bisect and two additions
+"""
+
+
+# pylint: disable=line-too-long
+
+
+import bisect
+
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape_label_value(value):
+    """ Escape label value according to Prometheus text format """
+
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames, labelvalues, extra=None):
+    """ Render {name="value",...} label set """
+
+    pairs = list(zip(labelnames, labelvalues))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join('%s="%s"' % (name, _escape_label_value(value)) for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    """ Render sample value, integers without trailing .0 """
+
+    if isinstance(value, float) and value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class MetricsRegistry(object):
+    """ Hold all metrics and render them in Prometheus text format """
+
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        """ Add a metric, names must be unique """
+
+        assert metric.name not in self.metrics, "Metric %s is already registered" % metric.name
+        self.metrics[metric.name] = metric
+
+    def remove_label_value(self, labelname, value):
+        """ Drop series of all metrics having given label value, e.g. those of a removed camera """
+
+        for metric in self.metrics.values():
+            metric.remove_label_value(labelname, value)
+
+    def render(self):
+        """ Render all metrics in Prometheus text exposition format """
+
+        lines = []
+        for name in sorted(self.metrics.keys()):
+            lines.extend(self.metrics[name].render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+class _Metric(object):
+    """ Base class for all metrics, children are instanciated per label values """
+
+    TYPE = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+        registry.register(self)
+
+    def _new_child(self):
+        raise NotImplementedError()
+
+    def labels(self, *labelvalues):
+        """
+        Return child metric for given label values
+        Keep the result around to avoid the lookup on hot path
+        """
+
+        assert len(labelvalues) == len(self.labelnames), "Metric %s expects labels %s" % (self.name, self.labelnames)
+        labelvalues = tuple(str(x) for x in labelvalues)
+        child = self._children.get(labelvalues, None)
+        if child is None:
+            child = self._children[labelvalues] = self._new_child()
+        return child
+
+    def remove_label_value(self, labelname, value):
+        """ Drop children having given value for labelname, references kept by callers are no longer rendered """
+
+        if labelname not in self.labelnames:
+            return
+        index = self.labelnames.index(labelname)
+        for labelvalues in [x for x in self._children if x[index] == str(value)]:
+            del self._children[labelvalues]
+
+    def _render_samples(self, labelvalues, child):
+        raise NotImplementedError()
+
+    def render(self):
+        """ Render HELP, TYPE and samples lines """
+
+        lines = ["# HELP %s %s" % (self.name, self.documentation), "# TYPE %s %s" % (self.name, self.TYPE)]
+        for labelvalues in sorted(self._children.keys()):
+            lines.extend(self._render_samples(labelvalues, self._children[labelvalues]))
+        return lines
+
+
+class _Value(object):
+    """ Single value holder used by counters and gauges """
+
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        """ Increment value """
+        self.value += amount
+
+    def dec(self, amount=1):
+        """ Decrement value """
+        self.value -= amount
+
+    def set(self, value):
+        """ Set value """
+        self.value = value
+
+
+class Counter(_Metric):
+    """ Monotonic counter """
+
+    TYPE = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        """ Increment counter without labels """
+        self._children[()].inc(amount)
+
+    def _render_samples(self, labelvalues, child):
+        return ["%s%s %s" % (self.name, _format_labels(self.labelnames, labelvalues), _format_value(child.value))]
+
+
+class Gauge(Counter):
+    """ Value going up and down """
+
+    TYPE = "gauge"
+
+    def dec(self, amount=1):
+        """ Decrement gauge without labels """
+        self._children[()].dec(amount)
+
+    def set(self, value):
+        """ Set gauge without labels """
+        self._children[()].set(value)
+
+
+class _HistogramValue(object):
+    """ Fixed buckets counts, cumulated only when rendering """
+
+    __slots__ = ("upper_bounds", "counts", "sum")
+
+    def __init__(self, upper_bounds):
+        self.upper_bounds = upper_bounds
+        self.counts = [0] * (len(upper_bounds) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        """ Record one observation """
+        self.counts[bisect.bisect_left(self.upper_bounds, value)] += 1
+        self.sum += value
+
+
+class Histogram(_Metric):
+    """ Histogram with fixed upper bounds (le) buckets """
+
+    TYPE = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):  # pylint: disable=too-many-arguments
+        assert list(buckets) == sorted(buckets), "Histogram buckets must be sorted"
+        self.upper_bounds = tuple(float(x) for x in buckets)
+        super(Histogram, self).__init__(name, documentation, labelnames=labelnames, registry=registry)
+
+    def _new_child(self):
+        return _HistogramValue(self.upper_bounds)
+
+    def observe(self, value):
+        """ Record one observation without labels """
+        self._children[()].observe(value)
+
+    def _render_samples(self, labelvalues, child):
+        lines = []
+        cumulated = 0
+        for upper_bound, count in zip(self.upper_bounds + (float("inf"),), child.counts):
+            cumulated += count
+            lines.append("%s_bucket%s %d" % (self.name, _format_labels(self.labelnames, labelvalues, ("le", _format_value(upper_bound))), cumulated))
+        lines.append("%s_sum%s %s" % (self.name, _format_labels(self.labelnames, labelvalues), _format_value(child.sum)))
+        lines.append("%s_count%s %d" % (self.name, _format_labels(self.labelnames, labelvalues), cumulated))
+        return lines
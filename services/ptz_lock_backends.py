@@ -0,0 +1,179 @@
+"""
+Storage of PTZ locks used by PtzLockManager
+Memory backend only works within one process, shared memory backend
+allows several workers on the same host to share camera locks
+"""
+
+
+# pylint: disable=line-too-long
+
+
+import os
+import mmap
+import zlib
+import fcntl
+import struct
+import contextlib
+import collections
+
+
+PtzLock = collections.namedtuple("PtzLock", ("token", "ttl", "deadline", "acquired_at", "pid"))
+PtzLock.__doc__ = """ One camera lock, ttl and deadline are None for locks never expiring by themselves (monotonic clock) """
+
+
+class MemoryLockBackend(object):
+    """
+    Keep locks in a dict, only suitable for a single process
+    :param path: Unused, accepted so every backend of LOCK_BACKENDS is built the same way
+    """
+
+    def __init__(self, path=None):  # pylint: disable=unused-argument
+        self.locks = {}
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """ Nothing to protect within one event loop """
+        yield
+
+    def get(self, cam_id):
+        """ Return camera lock, None if free """
+        return self.locks.get(cam_id, None)
+
+    def put(self, cam_id, lock):
+        """ Store camera lock """
+        self.locks[cam_id] = lock
+
+    def delete(self, cam_id):
+        """ Mark camera as free """
+        self.locks.pop(cam_id, None)
+
+    def keys(self):
+        """ Cameras currently locked """
+        return list(self.locks.keys())
+
+    def close(self):
+        """ Nothing to release """
+
+
+class SharedMemoryLockBackend(object):
+    """
+    Keep locks in a memory mapped file shared by all processes on the host
+    File is made of fixed size slots found by linear probing on camera name,
+    a camera keeps its slot forever so lookups are cached per process.
+    All accesses must happen inside transaction() which holds an exclusive flock
+    :param path: Path of the file, should live on a tmpfs (/dev/shm)
+    :param slots: Maximum number of cameras
+    """
+
+    SLOT = struct.Struct(">64s8sdddI")
+    NAME_SIZE = 64
+    TOKEN_SIZE = 8
+    NO_EXPIRY = -1.0
+
+    def __init__(self, path, slots=256):
+        assert isinstance(slots, int) and slots > 0, "slots must be a positive integer"
+
+        self.path = path
+        self.slots = slots
+        self.size = self.SLOT.size * slots
+        self._slot_indexes = {}
+
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        with self._flock():
+            if os.fstat(self.fd).st_size < self.size:
+                os.ftruncate(self.fd, self.size)
+        self.mmap = mmap.mmap(self.fd, self.size)
+
+    @contextlib.contextmanager
+    def _flock(self):
+        """ Hold exclusive lock on the file """
+
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def transaction(self):
+        """ Serialize read-modify-write sequences across processes """
+        return self._flock()
+
+    def _read_slot(self, index):
+        """ Return raw slot fields """
+        return self.SLOT.unpack_from(self.mmap, index * self.SLOT.size)
+
+    def _slot_index(self, cam_id, create):
+        """ Find slot of a camera using linear probing, claim an empty one if create is set """
+
+        index = self._slot_indexes.get(cam_id, None)
+        if index is not None:
+            return index
+
+        name = cam_id.encode("utf-8")
+        assert len(name) <= self.NAME_SIZE, "Camera name %s is too long for shared locks (max %d bytes)" % (cam_id, self.NAME_SIZE)
+        name = name.ljust(self.NAME_SIZE, b"\0")
+
+        start = zlib.crc32(name) % self.slots
+        for offset in range(self.slots):
+            index = (start + offset) % self.slots
+            slot_name = self._read_slot(index)[0]
+            if slot_name == name:
+                self._slot_indexes[cam_id] = index
+                return index
+            if slot_name == b"\0" * self.NAME_SIZE:
+                if not create:
+                    return None
+                self.SLOT.pack_into(self.mmap, index * self.SLOT.size, name, b"\0" * self.TOKEN_SIZE, 0, 0, 0, 0)
+                self._slot_indexes[cam_id] = index
+                return index
+
+        raise AssertionError("No free slot left in shared locks file %s (%d slots)" % (self.path, self.slots))
+
+    def get(self, cam_id):
+        """ Return camera lock, None if free """
+
+        index = self._slot_index(cam_id, create=False)
+        if index is None:
+            return None
+        _, token, ttl, deadline, acquired_at, pid = self._read_slot(index)
+        if token == b"\0" * self.TOKEN_SIZE:
+            return None
+        if ttl == self.NO_EXPIRY:
+            ttl = deadline = None
+        return PtzLock(token.decode("ascii"), ttl, deadline, acquired_at, pid)
+
+    def put(self, cam_id, lock):
+        """ Store camera lock """
+
+        index = self._slot_index(cam_id, create=True)
+        ttl = lock.ttl if lock.ttl is not None else self.NO_EXPIRY
+        deadline = lock.deadline if lock.deadline is not None else self.NO_EXPIRY
+        self.SLOT.pack_into(
+            self.mmap, index * self.SLOT.size, cam_id.encode("utf-8"), lock.token.encode("ascii"), ttl, deadline, lock.acquired_at, lock.pid
+        )
+
+    def delete(self, cam_id):
+        """ Mark camera as free """
+
+        index = self._slot_index(cam_id, create=False)
+        if index is not None:
+            self.SLOT.pack_into(self.mmap, index * self.SLOT.size, cam_id.encode("utf-8"), b"\0" * self.TOKEN_SIZE, 0, 0, 0, 0)
+
+    def keys(self):
+        """ Cameras currently locked """
+
+        cams = []
+        for index in range(self.slots):
+            name, token = self._read_slot(index)[:2]
+            if token != b"\0" * self.TOKEN_SIZE:
+                cams.append(name.rstrip(b"\0").decode("utf-8"))
+        return cams
+
+    def close(self):
+        """ Unmap and close the file, locks are kept for other processes """
+
+        self.mmap.close()
+        os.close(self.fd)
+
+
+LOCK_BACKENDS = {"memory": MemoryLockBackend, "shm": SharedMemoryLockBackend}
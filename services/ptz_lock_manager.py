@@ -0,0 +1,206 @@
+"""
+PTZ locks of all cameras in one place
+Locks expire at a deadline checked by one periodic sweep,
+renewing a lock is a plain deadline update in the lock backend
+"""
+
+
+# pylint: disable=line-too-long
+
+
+import os
+import time
+import string
+import random
+import logging
+import asyncio
+
+from .metrics import Counter, Histogram
+from .ptz_lock_backends import PtzLock, MemoryLockBackend
+
+
+PTZ_LOCK_EVENTS = Counter("ptz_lock_events_total", "PTZ lock events per camera (acquire, renew, release, expire, reject)", labelnames=("camera", "event"))
+PTZ_LOCK_HELD = Histogram("ptz_lock_held_seconds", "Time PTZ lock has been held per camera", labelnames=("camera",), buckets=(1, 5, 10, 30, 60, 300, 900, 3600))
+
+
+def _pid_alive(pid):
+    """ Check whether a process still exists """
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class PtzLockManager(object):
+    """
+    Hold PTZ locks of all cameras
+    :param backend: Lock storage, MemoryLockBackend (single process) if not set
+    :param resolution: Interval between two expiry sweeps (seconds), expired locks are also dropped when looked up
+    """
+
+    TOKEN_CHARS = string.ascii_uppercase + string.digits
+    TOKEN_LENGTH = 8
+
+    def __init__(self, backend=None, resolution=0.5):
+        assert isinstance(resolution, (int, float)) and resolution > 0, "resolution must be a positive number (seconds)"
+
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.backend = backend if backend is not None else MemoryLockBackend()
+        self.resolution = resolution
+        self._sweep_handle = None
+        self._metric_events = {}
+        self._metric_held = {}
+
+    def _count(self, cam_id, event):
+        """ Increment lock event counter, children are cached per camera """
+
+        try:
+            self._metric_events[cam_id, event].inc()
+        except KeyError:
+            self._metric_events[cam_id, event] = PTZ_LOCK_EVENTS.labels(cam_id, event)
+            self._metric_events[cam_id, event].inc()
+
+    def _observe_held(self, cam_id, lock, now):
+        """ Record lock hold time """
+
+        if cam_id not in self._metric_held:
+            self._metric_held[cam_id] = PTZ_LOCK_HELD.labels(cam_id)
+        self._metric_held[cam_id].observe(now - lock.acquired_at)
+
+    def forget_metrics(self, cam_id):
+        """ Drop metric children cached for a removed camera """
+
+        for key in [x for x in self._metric_events if x[0] == cam_id]:
+            del self._metric_events[key]
+        self._metric_held.pop(cam_id, None)
+
+    def _schedule_sweep(self):
+        """ Make sure one sweep is scheduled while some lock may expire """
+
+        if self._sweep_handle is None:
+            self._sweep_handle = asyncio.get_event_loop().call_later(self.resolution, self._sweep)
+
+    def _sweep(self):
+        """ Expire all locks past their deadline, reschedule while some lock can still expire """
+
+        self._sweep_handle = None
+        now = time.monotonic()
+        pending = False
+        with self.backend.transaction():
+            for cam_id in self.backend.keys():
+                lock = self._current(cam_id, now)
+                if lock is not None and lock.deadline is not None:
+                    pending = True
+        if pending:
+            self._schedule_sweep()
+
+    @staticmethod
+    def _is_expired(lock, now):
+        """
+        Locks without deadline only expire when their process is gone,
+        a deadline further than ttl comes from a previous boot
+        """
+
+        if lock.deadline is None:
+            return lock.pid != os.getpid() and not _pid_alive(lock.pid)
+        return lock.deadline <= now or lock.deadline - now > lock.ttl
+
+    def _current(self, cam_id, now):
+        """ Return valid lock of camera dropping it if expired, must be called inside a backend transaction """
+
+        lock = self.backend.get(cam_id)
+        if lock is None:
+            return None
+        if self._is_expired(lock, now):
+            self.backend.delete(cam_id)
+            self._count(cam_id, "expire")
+            self._observe_held(cam_id, lock, now)
+            self.logger.info("PTZ lock of %s released after %s seconds of inactivity", cam_id, lock.ttl)
+            return None
+        return lock
+
+    def owner(self, cam_id):
+        """ Return token currently holding camera lock, None if free """
+
+        with self.backend.transaction():
+            lock = self._current(cam_id, time.monotonic())
+        return lock.token if lock is not None else None
+
+    def acquire(self, cam_id, ttl=None):
+        """
+        Lock camera and return token to bypass lock, None if camera is already locked
+        Lock is released automatically after ttl seconds without renewal (never if None)
+        """
+
+        token = "".join(random.choice(self.TOKEN_CHARS) for _ in range(self.TOKEN_LENGTH))
+        with self.backend.transaction():
+            now = time.monotonic()
+            if self._current(cam_id, now) is not None:
+                return None
+            self.backend.put(cam_id, PtzLock(token, ttl, now + ttl if ttl is not None else None, now, os.getpid()))
+        self._count(cam_id, "acquire")
+        if ttl is not None:
+            self._schedule_sweep()
+        return token
+
+    def renew(self, cam_id, token):
+        """
+        Push back lock deadline by its ttl if camera is still locked by token
+        Return False if lock expired or has been taken by someone else (another worker may take it any time)
+        """
+
+        with self.backend.transaction():
+            lock = self._current(cam_id, time.monotonic())
+            if lock is None or lock.token != token:
+                return False
+            if lock.ttl is not None:
+                self.backend.put(cam_id, lock._replace(deadline=time.monotonic() + lock.ttl))
+        self._count(cam_id, "renew")
+        if lock.ttl is not None:
+            # Lock may have been taken by another process which sweeps it
+            self._schedule_sweep()
+        return True
+
+    def release(self, cam_id, token=None):
+        """ Mark camera PTZ as free, only if still held by token when given """
+
+        with self.backend.transaction():
+            lock = self.backend.get(cam_id)
+            if lock is None or (token is not None and lock.token != token):
+                return
+            self.backend.delete(cam_id)
+        self._count(cam_id, "release")
+        self._observe_held(cam_id, lock, time.monotonic())
+
+    def reject(self, cam_id):
+        """ Record a request refused because camera is locked by someone else """
+
+        self._count(cam_id, "reject")
+
+    def state(self):
+        """ Lock state of all currently locked cameras """
+
+        now = time.monotonic()
+        state = {}
+        with self.backend.transaction():
+            for cam_id in self.backend.keys():
+                lock = self._current(cam_id, now)
+                if lock is None:
+                    continue
+                state[cam_id] = {
+                    "held_seconds": round(now - lock.acquired_at, 3),
+                    "expires_in_seconds": round(lock.deadline - now, 3) if lock.deadline is not None else None,
+                }
+        return state
+
+    def close(self):
+        """ Stop sweeping and release backend resources """
+
+        if self._sweep_handle is not None:
+            self._sweep_handle.cancel()
+            self._sweep_handle = None
+        self.backend.close()
@@ -0,0 +1,49 @@
+""" Per-request phases durations, sent back in Server-Timing response header """
+
+
+# pylint: disable=line-too-long
+
+
+import time
+import collections
+
+
+class ServerTiming(object):
+    """
+    Durations (seconds) of the phases of one request, a phase measured several times is summed
+    Only created when Server-Timing is enabled, code paths get None otherwise and skip measures
+    """
+
+    __slots__ = ("durations", "_started")
+
+    def __init__(self):
+        self.durations = collections.OrderedDict()
+        self._started = {}
+
+    def start(self, name):
+        """ Start measuring a phase """
+
+        self._started[name] = time.perf_counter()
+
+    def stop(self, name):
+        """ End a phase started with start(), ignored if it was not started """
+
+        started = self._started.pop(name, None)
+        if started is not None:
+            self.add(name, time.perf_counter() - started)
+
+    def add(self, name, duration):
+        """ Record a phase measured by caller """
+
+        self.durations[name] = self.durations.get(name, 0) + duration
+
+    def merge(self, other):
+        """ Add phases measured by another ServerTiming, once for a request shared by several callers """
+
+        for name, duration in other.durations.items():
+            self.add(name, duration)
+
+    def header(self):
+        """ Server-Timing header value, durations in milliseconds """
+
+        return ", ".join("%s;dur=%.3f" % (name, duration * 1000) for name, duration in self.durations.items())
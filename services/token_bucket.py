@@ -0,0 +1,49 @@
+"""
+Token bucket limiting writes sent to a camera
+Bucket refills continuously up to its burst size, each write takes one token
+"""
+
+
+# pylint: disable=line-too-long
+
+
+import asyncio
+
+
+class TokenBucket(object):
+    """
+    Rate limiter allowing bursts after quiet periods
+    :param rate: Tokens added per second
+    :param burst: Bucket size, writes allowed in a row once bucket is full
+    """
+
+    def __init__(self, rate, burst=1):
+        assert isinstance(rate, (int, float)) and rate > 0, "rate must be a positive number (per second)"
+        assert isinstance(burst, int) and burst > 0, "burst must be a positive integer"
+
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated_at = asyncio.get_event_loop().time()
+
+    def _refill(self):
+        """ Add tokens earned since last update """
+
+        now = asyncio.get_event_loop().time()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def take(self):
+        """ Take one token, return False if bucket is empty """
+
+        self._refill()
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def wait_time(self):
+        """ Seconds until next token is available, 0 if bucket is not empty """
+
+        self._refill()
+        return max(0, (1 - self.tokens) / self.rate)